@@ -0,0 +1,117 @@
+"""Aggregated endpoints of the API gateway.
+
+The home screen of the clients needs the profile of the user, its root tasks and its projects.
+The gateway fetches them from the users, tasks and projects services concurrently and returns a
+single payload, so the latency is the one of the slowest service instead of the sum of all of
+them.
+
+Every source has its own timeout (HOME_{SOURCE}_TIMEOUT, HOME_SOURCE_TIMEOUT by default). A source
+that fails or times out is left empty and reported in the errors of the response, so a slow
+service degrades the home screen instead of failing it."""
+
+import asyncio
+import os
+from typing import Any
+
+import httpx
+
+from api_gateway_service.api_gateway_schemas import HomeResponse
+from api_gateway_service.resilience import UpstreamOverloadedError
+from api_gateway_service.upstreams import UpstreamRegistry
+from auth_service.auth_crud import INTERNAL_IDENTITY_HEADER
+
+HOME_SOURCE_TIMEOUT = float(os.getenv("HOME_SOURCE_TIMEOUT", "2"))
+
+# Field of the response: (service, endpoint)
+HOME_SOURCES = {
+    "user": ("users", "/me"),
+    "tasks": ("tasks", "/"),
+    "projects": ("projects", "/"),
+}
+
+# Request headers forwarded to the sources
+FORWARDED_HEADERS = ("authorization", INTERNAL_IDENTITY_HEADER.lower(), "accept-language")
+
+
+def get_source_timeout(source: str) -> float:
+    """Get the timeout of a source of the home screen.
+
+    Args:
+        source (str): Source name, e.g. "tasks".
+
+    Returns:
+        float: Seconds.
+    """
+    return float(os.getenv(f"HOME_{source.upper()}_TIMEOUT", HOME_SOURCE_TIMEOUT))
+
+
+async def fetch_source(
+    upstreams: UpstreamRegistry, source: str, headers: dict[str, str]
+) -> tuple[Any, str | None]:
+    """Fetch a source of the home screen.
+
+    Args:
+        upstreams (UpstreamRegistry): Upstream services.
+        source (str): Source name.
+        headers (dict[str, str]): Headers of the request.
+
+    Returns:
+        tuple[Any, str | None]: Decoded JSON body, and the error if the source failed.
+    """
+    service, endpoint = HOME_SOURCES[source]
+    upstream = upstreams[service]
+
+    async def fetch() -> httpx.Response:
+        response = await upstream.send(
+            upstream.client.build_request("GET", upstream.url(endpoint), headers=headers)
+        )
+        try:
+            await response.aread()
+        finally:
+            await response.aclose()
+        return response
+
+    try:
+        response = await asyncio.wait_for(fetch(), get_source_timeout(source))
+    except asyncio.TimeoutError:
+        return None, "timeout"
+    except UpstreamOverloadedError:
+        return None, "unavailable"
+    except httpx.HTTPError:
+        return None, "unreachable"
+
+    if response.status_code != 200:
+        return None, f"status {response.status_code}"
+
+    try:
+        return response.json(), None
+    except ValueError:
+        return None, "invalid response"
+
+
+async def get_home(upstreams: UpstreamRegistry, request_headers: dict[str, str]) -> HomeResponse:
+    """Fetch every source of the home screen concurrently.
+
+    Args:
+        upstreams (UpstreamRegistry): Upstream services.
+        request_headers (dict[str, str]): Headers of the client request.
+
+    Returns:
+        HomeResponse: Combined payload, with the errors of the sources that failed.
+    """
+    headers = {
+        name: request_headers[name] for name in FORWARDED_HEADERS if name in request_headers
+    }
+
+    results = await asyncio.gather(
+        *(fetch_source(upstreams, source, headers) for source in HOME_SOURCES)
+    )
+
+    home = HomeResponse()
+    for source, (body, error) in zip(HOME_SOURCES, results):
+        if error is None:
+            setattr(home, source, body)
+        else:
+            home.errors[source] = error
+
+    return home
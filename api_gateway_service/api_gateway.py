@@ -1,7 +1,16 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from starlette.middleware.cors import CORSMiddleware
 
-from api_gateway_service.api_router import api_router
+from api_gateway_service.api_router import api_router, service_urls
+from api_gateway_service.compression import CompressionMiddleware
+from api_gateway_service.identity import ClientAddressMiddleware, IdentityMiddleware
+from api_gateway_service.rate_limiter import RateLimitMiddleware
+from api_gateway_service.response_cache import ResponseCacheMiddleware
+from api_gateway_service.upstreams import UpstreamRegistry
+from auth_service.password_hashing import password_hasher
 from common_components.database import settings
 
 # Provide a list of origins that should be permitted to make cross-origin requests (CORS).
@@ -13,13 +22,31 @@ origins = [
 ]
 
 
+@asynccontextmanager
+async def lifespan(application: FastAPI):
+    """Create the shared upstream clients and start their health checks on startup, and stop
+    them and the password hashing workers on shutdown.
+
+    Args:
+        application (FastAPI): FastAPI application.
+    """
+    application.state.upstreams = UpstreamRegistry.from_service_urls(service_urls)
+    application.state.upstreams.start_health_checks()
+
+    yield
+
+    await application.state.upstreams.aclose()
+    # Waits for the hashes still running
+    await run_in_threadpool(password_hasher.shutdown)
+
+
 def get_application() -> FastAPI:
     """Get application.
 
     Returns:
         FastAPI: FastAPI application.
     """
-    application = FastAPI(**settings.FASTAPI_KWARGS)
+    application = FastAPI(**settings.FASTAPI_KWARGS, lifespan=lifespan)
 
     application.add_middleware(
         CORSMiddleware,
@@ -29,6 +56,22 @@ def get_application() -> FastAPI:
         allow_headers=["*"],
     )
 
+    # Per-user cache of the GET responses of the read heavy routes
+    application.add_middleware(ResponseCacheMiddleware)
+
+    # Verify the token once and forward the identity of the user to the services. Outside the
+    # cache, so the requests of the personal access tokens are cached per user too
+    application.add_middleware(IdentityMiddleware)
+
+    # Per-user and per-IP token buckets, checked before any cached or proxied response
+    application.add_middleware(RateLimitMiddleware)
+
+    # Client IP of the requests forwarded by the trusted proxies, for the rate limits and logins
+    application.add_middleware(ClientAddressMiddleware)
+
+    # Outermost, so the cache stores uncompressed responses and serves any encoding
+    application.add_middleware(CompressionMiddleware)
+
     application.include_router(api_router, prefix=settings.API_PREFIX)
 
     return application
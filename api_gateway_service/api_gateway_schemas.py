@@ -0,0 +1,49 @@
+"""Schemas for the API gateway.
+
+The schemas are used to define the structure of the data that is sent to the gateway's own
+endpoints."""
+
+from typing import Any, Literal
+
+from pydantic import BaseModel
+
+
+class SubRequest(BaseModel):
+    """A request of a batch."""
+
+    id: str | None = None
+    method: Literal["GET", "POST", "PUT", "PATCH", "DELETE"] = "GET"
+    path: str
+    body: Any = None
+    # Ids of the sub-requests that must succeed before this one runs
+    depends_on: list[str] = []
+
+
+class BatchRequest(BaseModel):
+    """Batch schema. Used to validate a list of sub-requests."""
+
+    requests: list[SubRequest]
+
+
+class SubResponse(BaseModel):
+    """Response of a sub-request."""
+
+    id: str | None = None
+    status: int
+    headers: dict[str, str] = {}
+    body: Any = None
+
+
+class BatchResponse(BaseModel):
+    """Batch response schema. The responses are in the same order as the sub-requests."""
+
+    responses: list[SubResponse]
+
+
+class HomeResponse(BaseModel):
+    """Home screen schema. A source that failed or timed out is None and listed in errors."""
+
+    user: Any = None
+    tasks: list | None = None
+    projects: list | None = None
+    errors: dict[str, str] = {}
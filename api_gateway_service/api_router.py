@@ -1,9 +1,16 @@
 import os
 
-import httpx  # A Python HTTP client for making requests to other services
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, HTTPException
 from starlette.requests import Request
-
+from starlette.responses import StreamingResponse
+from starlette.status import HTTP_401_UNAUTHORIZED, HTTP_404_NOT_FOUND
+
+from api_gateway_service.aggregation import get_home
+from api_gateway_service.api_gateway_schemas import BatchRequest, BatchResponse, HomeResponse
+from api_gateway_service.batch import execute_batch, validate_batch
+from api_gateway_service.identity import get_principal
+from api_gateway_service.monitoring import router as monitoring_router
+from api_gateway_service.proxy import PROXY_METHODS, proxy_request
 from auth_service.auth_router import router as auth_router
 from projects_service.projects_router import router as project_router
 from tasks_service.tasks_router import router as task_router
@@ -15,6 +22,7 @@ api_router.include_router(auth_router)
 api_router.include_router(user_router)
 api_router.include_router(task_router)
 api_router.include_router(project_router)
+api_router.include_router(monitoring_router)
 
 # Define the microservices and their default host/port values
 microservices = {"auth": "8001", "projects": "8002", "tasks": "8003", "users": "8004"}
@@ -26,61 +34,78 @@ service_urls = {
 }
 
 
-# Route to the Authentication Microservice
-@api_router.post("/auth/{endpoint}", response_model=str)
-async def route_to_auth_service(endpoint: str, request: Request):
-    # Build the URL for the auth service endpoint
-    url = f"{service_urls['auth']}/{endpoint}"
+def require_principal(request: Request) -> str:
+    """Get the principal of a request to the gateway's own routes.
+
+    The principal was resolved by the IdentityMiddleware, from an access token or a personal
+    access token, the same way as for the requests proxied to the services.
+
+    Args:
+        request (Request): Client request.
+
+    Raises:
+        HTTPException: If the request is not authenticated.
 
-    # Forward the request to the auth service
-    async with httpx.AsyncClient() as client:
-        response = await client.request(
-            request.method, url, headers=dict(request.headers), json=await request.json()
+    Returns:
+        str: Username of the principal.
+    """
+    principal = get_principal(request.scope)
+    if principal is None:
+        raise HTTPException(
+            status_code=HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
         )
 
-    return response.text
+    return principal
 
 
-# Route to the Projects Microservice
-@api_router.post("/projects/{endpoint}", response_model=str)
-async def route_to_projects_service(endpoint: str, request: Request):
-    # Build the URL for the projects service endpoint
-    url = f"{service_urls['projects']}/{endpoint}"
+@api_router.post(
+    "/batch",
+    response_model=BatchResponse,
+    tags=["Gateway"],
+    dependencies=[Depends(require_principal)],
+)
+async def batch_requests(batch: BatchRequest, request: Request) -> BatchResponse:
+    """Run several API requests in a single round trip.
 
-    # Forward the request to the projects service
-    async with httpx.AsyncClient() as client:
-        response = await client.request(
-            request.method, url, headers=dict(request.headers), json=await request.json()
-        )
+    Args:
+        batch (BatchRequest): Sub-requests.
+        request (Request): Batch request.
 
-    return response.text
+    Raises:
+        HTTPException: If the batch is not valid.
 
+    Returns:
+        BatchResponse: Responses of the sub-requests, in the same order.
+    """
+    validate_batch(batch)
 
-# Route to the Tasks Microservice
-@api_router.post("/tasks/{endpoint}", response_model=str)
-async def route_to_tasks_service(endpoint: str, request: Request):
-    # Build the URL for the tasks service endpoint
-    url = f"{service_urls['tasks']}/{endpoint}"
+    return BatchResponse(responses=await execute_batch(request.app, request.scope, batch))
 
-    # Forward the request to the tasks service
-    async with httpx.AsyncClient() as client:
-        response = await client.request(
-            request.method, url, headers=dict(request.headers), json=await request.json()
-        )
 
-    return response.text
+@api_router.get(
+    "/home",
+    response_model=HomeResponse,
+    tags=["Gateway"],
+    dependencies=[Depends(require_principal)],
+)
+async def get_home_screen(request: Request) -> HomeResponse:
+    """Get the profile, root tasks and projects of the current user in a single request.
 
+    Args:
+        request (Request): Client request.
 
-# Route to the Users Microservice
-@api_router.post("/users/{endpoint}", response_model=str)
-async def route_to_users_service(endpoint: str, request: Request):
-    # Build the URL for the users service endpoint
-    url = f"{service_urls['users']}/{endpoint}"
+    Returns:
+        HomeResponse: Combined payload. Sources that failed are empty and listed in errors.
+    """
+    return await get_home(request.app.state.upstreams, dict(request.headers))
 
-    # Forward the request to the users service
-    async with httpx.AsyncClient() as client:
-        response = await client.request(
-            request.method, url, headers=dict(request.headers), json=await request.json()
-        )
 
-    return response.text
+# Route to the Microservices. Every method is streamed to the upstream service as is.
+@api_router.api_route("/{service}/{path:path}", methods=PROXY_METHODS, include_in_schema=False)
+async def route_to_service(service: str, path: str, request: Request) -> StreamingResponse:
+    if service not in request.app.state.upstreams:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Not Found")
+
+    return await proxy_request(request.app.state.upstreams[service], request, path)
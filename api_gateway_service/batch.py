@@ -0,0 +1,211 @@
+"""Batch requests of the API gateway.
+
+Clients that need several resources at once (e.g. a mobile app on startup) can send them in a
+single POST /api/batch request instead of paying a network round trip for each one. The token is
+verified once for the whole batch, and the sub-requests are dispatched in-process to the gateway
+application, so they go through the same routes, cache and rate limits as any other request.
+
+Sub-requests run concurrently, up to BATCH_CONCURRENCY at a time, unless they depend on other
+sub-requests of the batch. A sub-request whose dependency failed is not run and gets a 424."""
+
+import asyncio
+import json
+import os
+
+from fastapi import HTTPException
+from starlette.status import HTTP_400_BAD_REQUEST, HTTP_424_FAILED_DEPENDENCY
+from starlette.types import ASGIApp, Message, Scope
+
+from api_gateway_service.api_gateway_schemas import BatchRequest, SubRequest, SubResponse
+from api_gateway_service.identity import CLAIMS_SCOPE_KEY
+from common_components.database import settings
+
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "20"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+BATCH_PATH = f"{settings.API_PREFIX}/batch"
+
+# Headers of the batch request that don't apply to the sub-requests. Sub-responses are embedded in
+# the batch response, which is compressed as a whole.
+SKIPPED_HEADERS = {b"content-length", b"content-type", b"transfer-encoding", b"accept-encoding"}
+
+
+def validate_batch(batch: BatchRequest) -> None:
+    """Check that the sub-requests of a batch can be run.
+
+    Args:
+        batch (BatchRequest): Batch request.
+
+    Raises:
+        HTTPException: If the batch is empty or too large, a path is not an API path, an id is
+            repeated, or a sub-request depends on a sub-request that is not before it.
+    """
+    if not 0 < len(batch.requests) <= BATCH_MAX_REQUESTS:
+        raise HTTPException(
+            status_code=HTTP_400_BAD_REQUEST,
+            detail=f"A batch must have between 1 and {BATCH_MAX_REQUESTS} requests",
+        )
+
+    ids = set()
+    for sub_request in batch.requests:
+        path = sub_request.path.partition("?")[0]
+        if not path.startswith(f"{settings.API_PREFIX}/") or path.rstrip("/") == BATCH_PATH:
+            raise HTTPException(
+                status_code=HTTP_400_BAD_REQUEST, detail=f"Invalid path {sub_request.path}"
+            )
+
+        if any(dependency not in ids for dependency in sub_request.depends_on):
+            raise HTTPException(
+                status_code=HTTP_400_BAD_REQUEST,
+                detail="Requests can only depend on previous requests of the batch",
+            )
+
+        if sub_request.id is not None:
+            if sub_request.id in ids:
+                raise HTTPException(
+                    status_code=HTTP_400_BAD_REQUEST, detail=f"Duplicated id {sub_request.id}"
+                )
+            ids.add(sub_request.id)
+
+
+async def execute_batch(app: ASGIApp, scope: Scope, batch: BatchRequest) -> list[SubResponse]:
+    """Run the sub-requests of a batch.
+
+    Args:
+        app (ASGIApp): Gateway application.
+        scope (Scope): ASGI scope of the batch request.
+        batch (BatchRequest): Validated batch request.
+
+    Returns:
+        list[SubResponse]: Responses, in the order of the sub-requests.
+    """
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    tasks: dict[str, asyncio.Task] = {}
+
+    async def run(sub_request: SubRequest) -> SubResponse:
+        for dependency in sub_request.depends_on:
+            if (await tasks[dependency]).status >= 400:
+                return SubResponse(
+                    id=sub_request.id,
+                    status=HTTP_424_FAILED_DEPENDENCY,
+                    body={"detail": f"Request {dependency} failed"},
+                )
+
+        async with semaphore:
+            return await dispatch(app, scope, sub_request)
+
+    pending = []
+    for sub_request in batch.requests:
+        task = asyncio.create_task(run(sub_request))
+        if sub_request.id is not None:
+            tasks[sub_request.id] = task
+        pending.append(task)
+
+    return list(await asyncio.gather(*pending))
+
+
+async def dispatch(app: ASGIApp, parent_scope: Scope, sub_request: SubRequest) -> SubResponse:
+    """Run a sub-request in-process and buffer its response.
+
+    Args:
+        app (ASGIApp): Gateway application.
+        parent_scope (Scope): ASGI scope of the batch request.
+        sub_request (SubRequest): Sub-request.
+
+    Returns:
+        SubResponse: Status, headers and decoded body of the response.
+    """
+    path, _, query_string = sub_request.path.partition("?")
+    body = b"" if sub_request.body is None else json.dumps(sub_request.body).encode()
+
+    headers = [
+        (name, value) for name, value in parent_scope["headers"] if name not in SKIPPED_HEADERS
+    ]
+    if body:
+        headers += [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ]
+
+    scope = {
+        "type": "http",
+        "asgi": parent_scope.get("asgi", {"version": "3.0"}),
+        "http_version": parent_scope.get("http_version", "1.1"),
+        "scheme": parent_scope.get("scheme", "http"),
+        "server": parent_scope.get("server"),
+        "client": parent_scope.get("client"),
+        "root_path": parent_scope.get("root_path", ""),
+        "method": sub_request.method,
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query_string.encode(),
+        "headers": headers,
+    }
+    # The token was verified once for the whole batch
+    if CLAIMS_SCOPE_KEY in parent_scope:
+        scope[CLAIMS_SCOPE_KEY] = parent_scope[CLAIMS_SCOPE_KEY]
+
+    body_sent = False
+    disconnected = asyncio.Event()
+
+    async def receive() -> Message:
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        # Streaming responses listen for a disconnect, which never comes for a sub-request
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    start_message: Message = {}
+    response_body = bytearray()
+
+    async def send(message: Message) -> None:
+        if message["type"] == "http.response.start":
+            start_message.update(message)
+        elif message["type"] == "http.response.body":
+            response_body.extend(message.get("body", b""))
+
+    try:
+        await app(scope, receive, send)
+    except Exception:
+        # The error response, if any, was already sent by the application
+        if not start_message:
+            return SubResponse(
+                id=sub_request.id, status=500, body={"detail": "Internal Server Error"}
+            )
+
+    response_headers = {
+        name.decode("latin-1").lower(): value.decode("latin-1")
+        for name, value in start_message.get("headers", [])
+    }
+
+    return SubResponse(
+        id=sub_request.id,
+        status=start_message["status"],
+        headers=response_headers,
+        body=decode_body(bytes(response_body), response_headers.get("content-type", "")),
+    )
+
+
+def decode_body(body: bytes, content_type: str):
+    """Decode the body of a sub-response, so it can be embedded in the batch response.
+
+    Args:
+        body (bytes): Response body.
+        content_type (str): Content type of the response.
+
+    Returns:
+        Any: Parsed JSON, text, or None if the body is empty.
+    """
+    if not body:
+        return None
+
+    if "json" in content_type:
+        try:
+            return json.loads(body)
+        except ValueError:
+            pass
+
+    return body.decode("utf-8", errors="replace")
@@ -0,0 +1,237 @@
+"""Response compression of the API gateway.
+
+Nested responses (users with their tasks and projects, projects with their subtasks) compress very
+well, so the gateway compresses the responses sent to the clients with the best encoding that both
+sides support: zstd, brotli or gzip, in that order of preference. zstd and brotli need the
+zstandard and brotli packages and are only offered if they are installed.
+
+Responses smaller than COMPRESSION_MINIMUM_SIZE bytes are sent as is, since compressing them costs
+more CPU than it saves bandwidth. Streaming responses are compressed chunk by chunk, and every
+chunk is flushed so the client can decode it as soon as it arrives (e.g. server-sent events).
+Responses that are already encoded, or whose content type does not compress (e.g.
+images), are never compressed again."""
+
+import os
+import zlib
+from collections.abc import Callable
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3"))
+
+COMPRESSIBLE_CONTENT_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "application/problem+json",
+)
+
+
+class GzipCompressor:
+    """Streaming gzip compressor."""
+
+    def __init__(self, level: int) -> None:
+        # wbits=31 produces a gzip header and trailer
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
+
+    def sync_flush(self) -> bytes:
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def flush(self) -> bytes:
+        return self.compressor.flush()
+
+
+class BrotliCompressor:
+    """Adapter giving a brotli compressor the interface of GzipCompressor."""
+
+    def __init__(self, quality: int) -> None:
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.process(data)
+
+    def sync_flush(self) -> bytes:
+        return self.compressor.flush()
+
+    def flush(self) -> bytes:
+        return self.compressor.finish()
+
+
+class ZstdCompressor:
+    """Adapter giving a zstd compressor the interface of GzipCompressor."""
+
+    def __init__(self, level: int) -> None:
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
+
+    def sync_flush(self) -> bytes:
+        return self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def flush(self) -> bytes:
+        return self.compressor.flush()
+
+
+def get_encoders() -> dict[str, Callable]:
+    """Get the streaming compressor factories of the supported encodings.
+
+    Returns:
+        dict[str, Callable]: Factories indexed by encoding, in order of preference. Every
+            compressor has a compress(data) method, a sync_flush() method emitting what it
+            buffered so far, and a flush() method ending the stream.
+    """
+    encoders = {}
+
+    if zstandard is not None:
+        encoders["zstd"] = lambda: ZstdCompressor(COMPRESSION_ZSTD_LEVEL)
+    if brotli is not None:
+        encoders["br"] = lambda: BrotliCompressor(COMPRESSION_BROTLI_QUALITY)
+
+    encoders["gzip"] = lambda: GzipCompressor(COMPRESSION_GZIP_LEVEL)
+
+    return encoders
+
+
+def negotiate_encoding(accept_encoding: str, encodings: list[str]) -> str | None:
+    """Choose the encoding of a response from the Accept-Encoding header of the request.
+
+    Args:
+        accept_encoding (str): Accept-Encoding header, e.g. "gzip, br;q=0.9".
+        encodings (list[str]): Encodings supported by the server, in order of preference.
+
+    Returns:
+        str | None: Encoding with the highest quality value, or None if the response should not
+            be compressed.
+    """
+    qualities = {}
+
+    for item in accept_encoding.lower().split(","):
+        encoding, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if encoding:
+            qualities[encoding] = quality
+
+    wildcard = qualities.get("*", 0.0)
+    candidates = [
+        (qualities.get(encoding, wildcard), -index, encoding)
+        for index, encoding in enumerate(encodings)
+    ]
+    quality, _, encoding = max(candidates, default=(0.0, 0, None))
+
+    return encoding if quality > 0 else None
+
+
+def is_compressible(headers: Headers) -> bool:
+    """Check whether a response can be compressed.
+
+    Args:
+        headers (Headers): Response headers.
+
+    Returns:
+        bool: True if the response is not encoded yet and its content type compresses well.
+    """
+    if headers.get("content-encoding", "identity") != "identity":
+        return False
+
+    return headers.get("content-type", "").lower().startswith(COMPRESSIBLE_CONTENT_TYPES)
+
+
+class CompressionMiddleware:
+    """ASGI middleware that compresses the responses with the encoding negotiated with the client."""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = COMPRESSION_MINIMUM_SIZE,
+        encoders: dict[str, Callable] | None = None,
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encoders = encoders if encoders is not None else get_encoders()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            return await self.app(scope, receive, send)
+
+        encoding = negotiate_encoding(
+            Headers(scope=scope).get("accept-encoding", ""), list(self.encoders)
+        )
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start_message: Message = {}
+        compressor = None
+        started = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal compressor, started
+
+            if message["type"] == "http.response.start":
+                # Wait for the first chunk of the body to decide whether to compress
+                start_message.update(message)
+                return
+
+            if message["type"] != "http.response.body":
+                return await send(message)
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if not started:
+                started = True
+                headers = MutableHeaders(scope=start_message)
+                size = int(headers.get("content-length", len(body) if not more_body else -1))
+
+                if (
+                    start_message["status"] in (204, 304)
+                    or not is_compressible(headers)
+                    or 0 <= size < self.minimum_size
+                ):
+                    await send(start_message)
+                    return await send(message)
+
+                compressor = self.encoders[encoding]()
+                del headers["content-length"]
+                headers["content-encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                await send(start_message)
+
+            if compressor is None:
+                return await send(message)
+
+            data = compressor.compress(body)
+            if more_body:
+                # Without a flush the compressor would hold the chunk until the end of the body
+                data += compressor.sync_flush()
+            else:
+                data += compressor.flush()
+
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
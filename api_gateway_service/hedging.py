@@ -0,0 +1,119 @@
+"""Hedged requests and retry budget of the API gateway.
+
+Tail latency is often caused by a single slow replica or a GC pause. For idempotent requests the
+gateway sends a second (hedged) request when the first one is slower than a percentile of the
+recent latencies of the upstream, and uses whichever answers first. Idempotent requests that can't
+reach the upstream are retried once.
+
+Hedges and retries are extra load, so they are paid from a global retry budget: every request
+deposits a fraction of a token and every hedge or retry withdraws a whole one. The extra load is
+therefore never more than that fraction of the traffic, plus a small burst."""
+
+import os
+from collections import deque
+
+from common_components.metrics import percentile
+
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.1"))
+RETRY_BUDGET_MAX_TOKENS = float(os.getenv("RETRY_BUDGET_MAX_TOKENS", "10"))
+
+# Methods that can be safely sent twice
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+class RetryBudget:
+    """Token bucket funding the hedges and retries."""
+
+    def __init__(
+        self, ratio: float = RETRY_BUDGET_RATIO, max_tokens: float = RETRY_BUDGET_MAX_TOKENS
+    ) -> None:
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = 0.0
+        self.deposits = 0
+        self.withdrawals = 0
+        self.exhausted = 0
+
+    def deposit(self) -> None:
+        """Fund the budget with a request."""
+        self.deposits += 1
+        self.tokens = min(self.tokens + self.ratio, self.max_tokens)
+
+    def try_withdraw(self) -> bool:
+        """Try to pay for a hedge or a retry.
+
+        Returns:
+            bool: True if the budget allows one more request.
+        """
+        if self.tokens < 1:
+            self.exhausted += 1
+            return False
+
+        self.tokens -= 1
+        self.withdrawals += 1
+        return True
+
+    def stats(self) -> dict:
+        """Get the state of the budget.
+
+        Returns:
+            dict: Available tokens, requests funding the budget and extra requests paid.
+        """
+        return {
+            "ratio": self.ratio,
+            "tokens": round(self.tokens, 3),
+            "requests": self.deposits,
+            "extra_requests": self.withdrawals,
+            "exhausted": self.exhausted,
+        }
+
+
+# Budget shared by every upstream of the gateway
+retry_budget = RetryBudget()
+
+
+class LatencyTracker:
+    """Recent latencies of an upstream, to derive the hedging delay from a percentile."""
+
+    def __init__(
+        self,
+        percentile: float = 95,
+        min_delay: float = 0.05,
+        min_samples: int = 20,
+        window: int = 1000,
+        refresh_every: int = 50,
+    ) -> None:
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.refresh_every = refresh_every
+        self.samples: deque[float] = deque(maxlen=window)
+        self.delay: float | None = None
+        self.new_samples = 0
+
+    def record(self, latency: float) -> None:
+        """Record the latency of a successful request.
+
+        Args:
+            latency (float): Time until the response headers were received, in seconds.
+        """
+        self.samples.append(latency)
+        self.new_samples += 1
+
+        # Sorting the window on every request would be wasteful, refresh the delay periodically
+        if len(self.samples) >= self.min_samples and (
+            self.delay is None or self.new_samples >= self.refresh_every
+        ):
+            # The helper reports milliseconds
+            self.delay = max(
+                percentile(list(self.samples), self.percentile) / 1000, self.min_delay
+            )
+            self.new_samples = 0
+
+    def hedge_delay(self) -> float | None:
+        """Get the delay after which a request is hedged.
+
+        Returns:
+            float | None: Seconds, or None if there are not enough samples yet.
+        """
+        return self.delay
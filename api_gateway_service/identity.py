@@ -0,0 +1,304 @@
+"""Identity of the clients of the API gateway.
+
+The gateway middlewares need to know who is making a request (e.g. to key caches per user) before
+the request reaches the services. The principal is the user of a verified access token or
+personal access token.
+
+The token is verified once per request, and the identity of the user is forwarded to the services
+in a signed internal header, so they don't have to decode the token or load the user again.
+Personal access tokens are looked up by digest by the IdentityMiddleware, with the same principal
+cache as the services. The identity then carries the scopes of the token, checked by the services.
+
+Behind a load balancer or a reverse proxy, the peer of every request is the proxy. The client IP
+is then read from the TRUSTED_PROXY_HEADERS (default X-Forwarded-For), but only when the peer is
+one of the TRUSTED_PROXIES (comma separated addresses or networks, none by default), so clients
+can't pick the IP their requests are rate limited and throttled by."""
+
+import ipaddress
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from jose import JWTError
+from sqlalchemy.orm import Session
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+import common_components.database.db as db
+from auth_service.auth_crud import (
+    INTERNAL_IDENTITY_HEADER,
+    PAT_PREFIX,
+    decode_access_token,
+    get_personal_access_token_principal,
+    get_token_digest,
+    sign_internal_identity,
+)
+
+CLAIMS_SCOPE_KEY = "gateway.claims"
+# Lifetime of the identity forwarded for a personal access token, only used by the request itself
+PAT_IDENTITY_TTL = 60
+
+TRUSTED_PROXIES = os.getenv("TRUSTED_PROXIES", "")
+TRUSTED_PROXY_HEADERS = os.getenv("TRUSTED_PROXY_HEADERS", "x-forwarded-for")
+
+
+def parse_networks(value: str) -> list[ipaddress.IPv4Network | ipaddress.IPv6Network]:
+    """Parse a list of trusted proxies.
+
+    Args:
+        value (str): Comma separated addresses or networks, e.g. "10.0.0.0/8,127.0.0.1".
+
+    Returns:
+        list[ipaddress.IPv4Network | ipaddress.IPv6Network]: Networks of the proxies.
+    """
+    return [
+        ipaddress.ip_network(item.strip(), strict=False)
+        for item in value.split(",")
+        if item.strip()
+    ]
+
+
+def is_trusted(
+    address: str, networks: list[ipaddress.IPv4Network | ipaddress.IPv6Network]
+) -> bool:
+    """Check whether an address is one of the trusted proxies.
+
+    Args:
+        address (str): IP address.
+        networks (list[ipaddress.IPv4Network | ipaddress.IPv6Network]): Networks of the proxies.
+
+    Returns:
+        bool: Whether the address is in one of the networks.
+    """
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+
+    return any(ip in network for network in networks)
+
+
+def get_client_ip(
+    scope: Scope,
+    trusted_proxies: list[ipaddress.IPv4Network | ipaddress.IPv6Network],
+    header_names: list[str],
+) -> str | None:
+    """Get the IP of the client of a request, through the trusted proxies.
+
+    The forwarded addresses are read from right to left: each one was added by the hop before it,
+    and only the hops that are trusted proxies are believed. The first address that is not a
+    trusted proxy is the client, anything to its left may have been sent by the client itself.
+
+    Args:
+        scope (Scope): ASGI scope of the request.
+        trusted_proxies (list[ipaddress.IPv4Network | ipaddress.IPv6Network]): Networks of the
+            proxies whose forwarded headers are trusted.
+        header_names (list[str]): Forwarded headers, in order of preference.
+
+    Returns:
+        str | None: Client IP, or None if the request has no peer.
+    """
+    client = scope.get("client")
+    address = client[0] if client else None
+    if address is None or not is_trusted(address, trusted_proxies):
+        return address
+
+    headers = Headers(scope=scope)
+    for name in header_names:
+        values = headers.getlist(name)
+        if not values:
+            continue
+
+        hops = [hop.strip() for value in values for hop in value.split(",")]
+        for hop in reversed(hops):
+            if not is_trusted(address, trusted_proxies):
+                break
+            try:
+                address = str(ipaddress.ip_address(hop))
+            except ValueError:
+                # Not an address, e.g. "unknown", the last trusted proxy is the best we know
+                break
+        break
+
+    return address
+
+
+def get_bearer_token(scope: Scope) -> str | None:
+    """Get the bearer token of a request.
+
+    Args:
+        scope (Scope): ASGI scope of the request.
+
+    Returns:
+        str | None: Bearer token, or None if the request is not authenticated with one.
+    """
+    scheme, _, token = Headers(scope=scope).get("authorization", "").partition(" ")
+
+    if scheme.lower() != "bearer" or not token:
+        return None
+
+    return token
+
+
+@contextmanager
+def database_session() -> Iterator[Session]:
+    """Open a database session to look up the personal access tokens.
+
+    Yields:
+        Session: Database session.
+    """
+    session = db.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def get_claims(scope: Scope) -> dict | None:
+    """Get the verified claims of the access token of a request.
+
+    The claims are stored in the scope, so the token is only verified once per request. A personal
+    access token has no claims until it is resolved by resolve_claims.
+
+    Args:
+        scope (Scope): ASGI scope of the request.
+
+    Returns:
+        dict | None: Token claims, or None if the request has no valid token.
+    """
+    if CLAIMS_SCOPE_KEY in scope:
+        return scope[CLAIMS_SCOPE_KEY]
+
+    token = get_bearer_token(scope)
+    if token is not None and token.startswith(PAT_PREFIX):
+        return None
+
+    claims = None
+    if token is not None:
+        try:
+            claims = decode_access_token(token)
+        except JWTError:
+            pass
+
+    scope[CLAIMS_SCOPE_KEY] = claims
+    return claims
+
+
+async def resolve_claims(scope: Scope) -> dict | None:
+    """Get the claims of a request, looking up its personal access token if it has one.
+
+    The claims of a personal access token are built from its principal: the user, and the scopes
+    of the token.
+
+    Args:
+        scope (Scope): ASGI scope of the request.
+
+    Returns:
+        dict | None: Token claims, or None if the request has no valid token.
+    """
+    token = get_bearer_token(scope)
+    if CLAIMS_SCOPE_KEY in scope or token is None or not token.startswith(PAT_PREFIX):
+        return get_claims(scope)
+
+    with database_session() as session:
+        principal = await get_personal_access_token_principal(token, session)
+
+    claims = None
+    if principal is not None:
+        claims = {
+            "uid": principal.id,
+            "sub": principal.username,
+            "disabled": principal.disabled,
+            "exp": time.time() + PAT_IDENTITY_TTL,
+            "scopes": principal.scopes,
+        }
+
+    scope[CLAIMS_SCOPE_KEY] = claims
+    return claims
+
+
+def get_principal(scope: Scope) -> str | None:
+    """Get the authenticated principal of a request.
+
+    The token signature and expiry are verified, so a forged token can't be used to read or
+    invalidate the data of another user. Whether the user still exists is checked by the services.
+    Personal access tokens are only known once resolved by the IdentityMiddleware: before it, their
+    requests have no principal.
+
+    Args:
+        scope (Scope): ASGI scope of the request.
+
+    Returns:
+        str | None: Username of the principal, or None if the request has no valid token.
+    """
+    claims = get_claims(scope)
+
+    return claims.get("sub") if claims else None
+
+
+def get_token_key(scope: Scope) -> str | None:
+    """Get the key of the personal access token of a request.
+
+    The token is not looked up, so an unknown token gets a key too: it only keys the requests of
+    a token, e.g. to rate limit them before the token is resolved.
+
+    Args:
+        scope (Scope): ASGI scope of the request.
+
+    Returns:
+        str | None: "pat:<digest>", or None if the request has no personal access token.
+    """
+    token = get_bearer_token(scope)
+    if token is None or not token.startswith(PAT_PREFIX):
+        return None
+
+    return f"pat:{get_token_digest(token)}"
+
+
+class IdentityMiddleware:
+    """ASGI middleware that forwards the verified identity of the client to the services."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self.header = INTERNAL_IDENTITY_HEADER.lower().encode("latin-1")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        # Never trust an identity sent by the client itself
+        headers = [(name, value) for name, value in scope["headers"] if name != self.header]
+
+        claims = await resolve_claims(scope)
+        identity = sign_internal_identity(claims) if claims else None
+        if identity is not None:
+            headers.append((self.header, identity.encode("latin-1")))
+
+        await self.app({**scope, "headers": headers}, receive, send)
+
+
+class ClientAddressMiddleware:
+    """ASGI middleware that sets the client of the requests forwarded by the trusted proxies."""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        trusted_proxies: str = TRUSTED_PROXIES,
+        header_names: str = TRUSTED_PROXY_HEADERS,
+    ) -> None:
+        self.app = app
+        self.trusted_proxies = parse_networks(trusted_proxies)
+        self.header_names = [
+            name.strip().lower() for name in header_names.split(",") if name.strip()
+        ]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.trusted_proxies:
+            return await self.app(scope, receive, send)
+
+        address = get_client_ip(scope, self.trusted_proxies, self.header_names)
+        if address is not None and address != scope["client"][0]:
+            scope = {**scope, "client": (address, 0)}
+
+        await self.app(scope, receive, send)
@@ -0,0 +1,156 @@
+"""Replica-aware load balancing of the upstream services.
+
+Every upstream can be served by several endpoints (replicas). Requests are sent to the healthy
+endpoint with the least outstanding requests, so a slow replica naturally receives less traffic.
+Background health probes eject endpoints that stop answering and readmit them once they recover."""
+
+import asyncio
+import logging
+import random
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Weight of the last sample in the exponentially weighted moving average of the latency
+LATENCY_EWMA_ALPHA = 0.2
+
+
+class Endpoint:
+    """A replica of an upstream service, with its load and health statistics."""
+
+    def __init__(self, origin: str) -> None:
+        self.origin = httpx.URL(origin)
+        self.healthy = True
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.latency_ewma: float | None = None
+        self.consecutive_failures = 0
+        self.consecutive_successes = 0
+
+    def record(self, latency: float, error: bool) -> None:
+        """Record the result of a request sent to the endpoint.
+
+        Args:
+            latency (float): Time until the response headers were received, in seconds.
+            error (bool): Whether the request failed or the upstream answered with a 5xx.
+        """
+        self.requests += 1
+        if error:
+            self.errors += 1
+
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma += LATENCY_EWMA_ALPHA * (latency - self.latency_ewma)
+
+    def stats(self) -> dict:
+        """Get the statistics of the endpoint.
+
+        Returns:
+            dict: Health, load, error and latency statistics.
+        """
+        return {
+            "url": str(self.origin),
+            "healthy": self.healthy,
+            "outstanding_requests": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "latency_ewma_ms": (
+                round(self.latency_ewma * 1000, 3) if self.latency_ewma is not None else None
+            ),
+        }
+
+
+class LoadBalancer:
+    """Least outstanding requests balancing with active health checks."""
+
+    def __init__(
+        self,
+        origins: list[str],
+        health_path: str = "/",
+        health_interval: float = 5.0,
+        unhealthy_threshold: int = 2,
+        healthy_threshold: int = 2,
+    ) -> None:
+        self.endpoints = [Endpoint(origin) for origin in origins]
+        self.health_path = health_path
+        self.health_interval = health_interval
+        self.unhealthy_threshold = unhealthy_threshold
+        self.healthy_threshold = healthy_threshold
+
+    def pick(self) -> Endpoint:
+        """Pick the endpoint for the next request.
+
+        If every endpoint has been ejected, all of them are considered, since failing open is
+        better than refusing every request.
+
+        Returns:
+            Endpoint: Healthy endpoint with the least outstanding requests.
+        """
+        candidates = [endpoint for endpoint in self.endpoints if endpoint.healthy]
+        candidates = candidates or self.endpoints
+
+        least_outstanding = min(endpoint.outstanding for endpoint in candidates)
+
+        # Break ties randomly, so idle replicas share the load evenly
+        return random.choice(
+            [endpoint for endpoint in candidates if endpoint.outstanding == least_outstanding]
+        )
+
+    async def probe(self, client: httpx.AsyncClient, endpoint: Endpoint) -> None:
+        """Probe an endpoint and update its health.
+
+        Any answer below 500 means the replica is alive, even if the probe is not authorized.
+
+        Args:
+            client (httpx.AsyncClient): Client of the upstream.
+            endpoint (Endpoint): Endpoint to probe.
+        """
+        try:
+            response = await client.get(
+                str(endpoint.origin.join(self.health_path)), timeout=self.health_interval
+            )
+            alive = response.status_code < 500
+        except httpx.HTTPError:
+            alive = False
+
+        if alive:
+            endpoint.consecutive_failures = 0
+            endpoint.consecutive_successes += 1
+            if not endpoint.healthy and endpoint.consecutive_successes >= self.healthy_threshold:
+                logger.info("Readmitting endpoint %s", endpoint.origin)
+                endpoint.healthy = True
+        else:
+            endpoint.consecutive_successes = 0
+            endpoint.consecutive_failures += 1
+            if endpoint.healthy and endpoint.consecutive_failures >= self.unhealthy_threshold:
+                logger.warning("Ejecting endpoint %s", endpoint.origin)
+                endpoint.healthy = False
+
+    async def check_health(self, client: httpx.AsyncClient) -> None:
+        """Probe every endpoint concurrently.
+
+        Args:
+            client (httpx.AsyncClient): Client of the upstream.
+        """
+        await asyncio.gather(*(self.probe(client, endpoint) for endpoint in self.endpoints))
+
+    async def run_health_checks(self, client: httpx.AsyncClient) -> None:
+        """Probe every endpoint periodically, until cancelled.
+
+        Args:
+            client (httpx.AsyncClient): Client of the upstream.
+        """
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self.check_health(client)
+
+    def stats(self) -> list[dict]:
+        """Get the statistics of every endpoint.
+
+        Returns:
+            list[dict]: Endpoint statistics.
+        """
+        return [endpoint.stats() for endpoint in self.endpoints]
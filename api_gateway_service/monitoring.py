@@ -0,0 +1,94 @@
+"""Monitoring endpoints of the API gateway.
+
+The statistics show which users are throttled, how loaded the database is, etc., so they are only
+served to the monitoring system. Every request must send the MONITORING_TOKEN in the
+X-Monitoring-Token header. If MONITORING_TOKEN is not set, the endpoints are disabled."""
+
+import os
+import secrets
+
+from fastapi import APIRouter, Depends, HTTPException
+from starlette.requests import Request
+from starlette.status import HTTP_403_FORBIDDEN, HTTP_404_NOT_FOUND
+
+from api_gateway_service.hedging import retry_budget
+from api_gateway_service.rate_limiter import rate_limiter
+from api_gateway_service.response_cache import read_coalescer, response_cache
+from auth_service.login_throttle import login_throttle
+from auth_service.password_hashing import password_hasher
+from common_components.database.db import get_pool_stats, get_replica_stats
+
+MONITORING_TOKEN = os.getenv("MONITORING_TOKEN", "")
+MONITORING_TOKEN_HEADER = "X-Monitoring-Token"
+
+
+def require_monitoring_token(request: Request) -> None:
+    """Check that a request comes from the monitoring system.
+
+    Args:
+        request (Request): Request.
+
+    Raises:
+        HTTPException: If the monitoring endpoints are disabled, or the token is missing or wrong.
+    """
+    if not MONITORING_TOKEN:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Not Found")
+
+    token = request.headers.get(MONITORING_TOKEN_HEADER, "")
+    if not secrets.compare_digest(token.encode(), MONITORING_TOKEN.encode()):
+        raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail="Not allowed")
+
+
+router = APIRouter(
+    prefix="/gateway",
+    dependencies=[Depends(require_monitoring_token)],
+    include_in_schema=False,
+)
+
+
+# Connection pool occupancy of the upstream services
+@router.get("/upstreams")
+async def get_upstreams_stats(request: Request) -> dict:
+    return request.app.state.upstreams.stats()
+
+
+# Extra requests sent as hedges and retries
+@router.get("/retry-budget")
+async def get_retry_budget_stats() -> dict:
+    return retry_budget.stats()
+
+
+# Hit and miss counters of the response cache and coalesced reads
+@router.get("/cache")
+async def get_response_cache_stats() -> dict:
+    return {**response_cache.stats(), "coalescing": read_coalescer.stats()}
+
+
+# Allowed and limited requests per route class
+@router.get("/rate-limits")
+async def get_rate_limit_stats() -> dict:
+    return rate_limiter.stats()
+
+
+# Queue depth and latency of the password hashing pool
+@router.get("/password-hashing")
+async def get_password_hashing_stats() -> dict:
+    return password_hasher.stats()
+
+
+# Throttled and locked out logins
+@router.get("/login-throttle")
+async def get_login_throttle_stats() -> dict:
+    return login_throttle.stats()
+
+
+# Checked out and idle connections of the database pool
+@router.get("/database-pool")
+async def get_database_pool_stats() -> dict:
+    return get_pool_stats()
+
+
+# Replication lag and routing of the reads to the database replicas
+@router.get("/database-replicas")
+async def get_database_replica_stats() -> dict:
+    return get_replica_stats()
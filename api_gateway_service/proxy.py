@@ -0,0 +1,118 @@
+"""Streaming reverse proxy of the API gateway.
+
+Request and response bodies are piped chunk by chunk between the client and the upstream service,
+without being parsed or buffered, so the memory used by the gateway does not depend on the size of
+the payloads. Status codes and end-to-end headers are kept intact in both directions."""
+
+import httpx
+from fastapi import HTTPException
+from starlette.background import BackgroundTask
+from starlette.requests import Request
+from starlette.responses import StreamingResponse
+from starlette.status import (
+    HTTP_502_BAD_GATEWAY,
+    HTTP_503_SERVICE_UNAVAILABLE,
+    HTTP_504_GATEWAY_TIMEOUT,
+)
+
+from api_gateway_service.resilience import UpstreamOverloadedError
+from api_gateway_service.upstreams import Upstream
+
+# Methods that can be proxied
+PROXY_METHODS = ["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"]
+
+# Hop-by-hop headers only apply to a single connection and must not be forwarded (RFC 9110).
+# The host header is set by the client for the upstream URL.
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "upgrade",
+    "host",
+}
+
+
+def filter_headers(headers: list[tuple[bytes, bytes]]) -> list[tuple[bytes, bytes]]:
+    """Remove the hop-by-hop headers, including the ones listed in the Connection header.
+
+    Args:
+        headers (list[tuple[bytes, bytes]]): Raw headers.
+
+    Returns:
+        list[tuple[bytes, bytes]]: End-to-end headers.
+    """
+    excluded = set(HOP_BY_HOP_HEADERS)
+    for name, value in headers:
+        if name.lower() == b"connection":
+            excluded.update(token.strip().lower() for token in value.decode("latin-1").split(","))
+
+    return [
+        (name, value) for name, value in headers if name.decode("latin-1").lower() not in excluded
+    ]
+
+
+def has_body(request: Request) -> bool:
+    """Check whether the client sent a request body.
+
+    Args:
+        request (Request): Incoming request.
+
+    Returns:
+        bool: True if the request has a body.
+    """
+    return "content-length" in request.headers or "transfer-encoding" in request.headers
+
+
+async def proxy_request(
+    upstream: Upstream, request: Request, path: str, headers: dict | None = None
+) -> StreamingResponse:
+    """Forward a request to an upstream service and stream its response back.
+
+    Args:
+        upstream (Upstream): Upstream service.
+        request (Request): Incoming request.
+        path (str): Path of the endpoint, relative to the upstream base URL.
+        headers (dict, optional): Extra headers for the upstream request. Defaults to None.
+
+    Returns:
+        StreamingResponse: Upstream response.
+
+    Raises:
+        HTTPException: If the upstream service cannot be reached, times out or is overloaded.
+    """
+    upstream_request = upstream.client.build_request(
+        request.method,
+        upstream.url(path),
+        params=request.query_params.multi_items(),
+        headers=filter_headers(request.headers.raw),
+        content=request.stream() if has_body(request) else None,
+    )
+    if headers:
+        upstream_request.headers.update(headers)
+
+    try:
+        upstream_response = await upstream.send(upstream_request)
+    except UpstreamOverloadedError as error:
+        raise HTTPException(
+            status_code=HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Service temporarily unavailable",
+            headers={"Retry-After": error.retry_after_header},
+        )
+    except httpx.TimeoutException:
+        raise HTTPException(status_code=HTTP_504_GATEWAY_TIMEOUT, detail="Upstream timeout")
+    except httpx.TransportError:
+        raise HTTPException(status_code=HTTP_502_BAD_GATEWAY, detail="Upstream unavailable")
+
+    response = StreamingResponse(
+        upstream_response.aiter_raw(),
+        status_code=upstream_response.status_code,
+        background=BackgroundTask(upstream_response.aclose),
+    )
+    # Keep repeated headers (e.g. set-cookie) and the raw content encoding and length
+    response.raw_headers = filter_headers(upstream_response.headers.raw)
+
+    return response
@@ -0,0 +1,451 @@
+"""Rate limiting of the API gateway.
+
+Every request takes a token from a token bucket, so a single client can't exhaust the database
+pool or the password hashing CPU of the services. Authenticated requests are limited per user,
+personal access tokens per token digest (before the database lookup of the token), and anonymous
+ones per client IP. Each route class has its own limit, set as "capacity/seconds":
+
+- RATE_LIMIT_LOGIN: token requests, which hash a password (default 10/60, per IP).
+- RATE_LIMIT_WRITE: POST, PUT, PATCH and DELETE requests (default 120/60).
+- RATE_LIMIT_READ: any other request (default 600/60).
+
+Every request also takes a token from the bucket of its client IP, RATE_LIMIT_IP (default
+1200/60), so a client can't multiply its limits by spreading its requests over many accounts. Both
+tokens are taken atomically, so a request rejected by one limit doesn't use the other. The client
+IP is resolved through the trusted proxies by the ClientAddressMiddleware, see identity.
+
+Limited requests get a 429 with a Retry-After header, and every response carries the RateLimit
+headers of the IETF draft (RateLimit-Limit, RateLimit-Remaining, RateLimit-Reset and
+RateLimit-Policy).
+
+The buckets live in memory, sharded so that each shard has its own small lock. With several
+gateway replicas, RATE_LIMIT_REDIS_URL moves the buckets to Redis (requires the redis package),
+so the limits are shared. If Redis can't be reached the requests are let through."""
+
+import logging
+import math
+import os
+import threading
+import time
+import zlib
+
+from starlette.datastructures import MutableHeaders
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from api_gateway_service.identity import get_principal, get_token_key
+
+try:
+    from redis import asyncio as redis
+except ImportError:  # pragma: no cover - optional dependency
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_LOGIN = os.getenv("RATE_LIMIT_LOGIN", "10/60")
+RATE_LIMIT_WRITE = os.getenv("RATE_LIMIT_WRITE", "120/60")
+RATE_LIMIT_READ = os.getenv("RATE_LIMIT_READ", "600/60")
+RATE_LIMIT_IP = os.getenv("RATE_LIMIT_IP", "1200/60")
+RATE_LIMIT_SHARDS = int(os.getenv("RATE_LIMIT_SHARDS", "16"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "")
+
+LOGIN_PATHS = {"/api/auth/token"}
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+class Limit:
+    """Token bucket limit of a route class."""
+
+    def __init__(self, name: str, capacity: int, period: float) -> None:
+        self.name = name
+        self.capacity = capacity
+        self.period = period
+        self.rate = capacity / period
+
+    @classmethod
+    def parse(cls, name: str, value: str) -> "Limit":
+        """Parse a limit setting.
+
+        Args:
+            name (str): Route class, e.g. "login".
+            value (str): Limit, as "capacity/seconds", e.g. "10/60".
+
+        Returns:
+            Limit: Limit of the route class.
+        """
+        capacity, _, period = value.partition("/")
+        return cls(name, int(capacity), float(period or 1))
+
+    @property
+    def policy(self) -> str:
+        return f"{self.capacity};w={self.period:g}"
+
+
+class TokenBucket:
+    """Tokens left in a bucket and when they were last refilled."""
+
+    __slots__ = ("tokens", "updated_at")
+
+    def __init__(self, tokens: float, updated_at: float) -> None:
+        self.tokens = tokens
+        self.updated_at = updated_at
+
+
+class MemoryStore:
+    """Token buckets of a single gateway process, sharded to keep the locks uncontended.
+
+    A store can be shared by several limiters, e.g. to stand in for a shared backend in tests.
+    """
+
+    def __init__(
+        self, shards: int = RATE_LIMIT_SHARDS, max_keys: int = RATE_LIMIT_MAX_KEYS
+    ) -> None:
+        self.shards = [{} for _ in range(shards)]
+        self.locks = [threading.Lock() for _ in range(shards)]
+        self.max_keys_per_shard = max(max_keys // shards, 1)
+
+    async def take(
+        self, buckets: list[tuple[str, Limit]], cost: int = 1
+    ) -> tuple[bool, list[float]]:
+        """Take tokens from several buckets atomically: from all of them, or from none.
+
+        Args:
+            buckets (list[tuple[str, Limit]]): Keys and limits of the buckets.
+            cost (int): Number of tokens to take from each bucket.
+
+        Returns:
+            tuple[bool, list[float]]: Whether the tokens were taken and the tokens left in each
+                bucket.
+        """
+        indexes = [zlib.crc32(key.encode()) % len(self.shards) for key, _ in buckets]
+        # Always locked in the same order, so two requests can't wait for each other
+        locks = [self.locks[index] for index in sorted(set(indexes))]
+        now = time.monotonic()
+
+        for lock in locks:
+            lock.acquire()
+        try:
+            taken = []
+            for index, (key, limit) in zip(indexes, buckets):
+                shard = self.shards[index]
+                bucket = shard.get(key)
+                if bucket is None:
+                    if len(shard) >= self.max_keys_per_shard:
+                        self.prune(shard, now, limit, keep=[key for key, _ in buckets])
+                    bucket = shard[key] = TokenBucket(limit.capacity, now)
+
+                bucket.tokens = min(
+                    limit.capacity, bucket.tokens + (now - bucket.updated_at) * limit.rate
+                )
+                bucket.updated_at = now
+                taken.append(bucket)
+
+            allowed = all(bucket.tokens >= cost for bucket in taken)
+            if allowed:
+                for bucket in taken:
+                    bucket.tokens -= cost
+
+            return allowed, [bucket.tokens for bucket in taken]
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def clear(self) -> None:
+        """Remove every bucket."""
+        for index, shard in enumerate(self.shards):
+            with self.locks[index]:
+                shard.clear()
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self.shards)
+
+    def prune(self, shard: dict, now: float, limit: Limit, keep: list[str]) -> None:
+        """Make room in a full shard.
+
+        Args:
+            shard (dict): Buckets of the shard.
+            now (float): Current time.
+            limit (Limit): Limit of the bucket being added.
+            keep (list[str]): Keys of the buckets being taken from, never dropped.
+        """
+        # Idle buckets are full again after a period, dropping them does not change any limit
+        for key in [
+            key for key, bucket in shard.items() if now - bucket.updated_at > limit.period
+        ]:
+            del shard[key]
+
+        # Every client is still active, drop the least recently used bucket instead of growing
+        candidates = [key for key in shard if key not in keep]
+        if len(shard) >= self.max_keys_per_shard and candidates:
+            del shard[min(candidates, key=lambda key: shard[key].updated_at)]
+
+
+# Atomic token buckets, using the clock of the Redis server so replicas agree on the time. The
+# tokens are taken from every bucket, or from none of them.
+REDIS_TAKE_SCRIPT = """
+local cost = tonumber(ARGV[1])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local tokens = {}
+local allowed = 1
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2])
+    local rate = tonumber(ARGV[i * 2 + 1])
+    local bucket = redis.call('HMGET', key, 'tokens', 'updated_at')
+    local updated_at = tonumber(bucket[2]) or now
+    tokens[i] = math.min(
+        capacity, (tonumber(bucket[1]) or capacity) + math.max(now - updated_at, 0) * rate
+    )
+    if tokens[i] < cost then
+        allowed = 0
+    end
+end
+local left = {}
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2])
+    local rate = tonumber(ARGV[i * 2 + 1])
+    if allowed == 1 then
+        tokens[i] = tokens[i] - cost
+    end
+    redis.call('HSET', key, 'tokens', tostring(tokens[i]), 'updated_at', tostring(now))
+    redis.call('PEXPIRE', key, math.ceil(capacity / rate * 1000))
+    left[i] = tostring(tokens[i])
+end
+return {allowed, left}
+"""
+
+
+class RedisStore:
+    """Token buckets shared by every gateway replica through Redis."""
+
+    def __init__(self, url: str, prefix: str = "rate_limit:") -> None:
+        if redis is None:
+            raise RuntimeError(
+                "RATE_LIMIT_REDIS_URL is set, but the redis package is not installed"
+            )
+
+        self.client = redis.from_url(url)
+        self.script = self.client.register_script(REDIS_TAKE_SCRIPT)
+        self.prefix = prefix
+
+    async def take(
+        self, buckets: list[tuple[str, Limit]], cost: int = 1
+    ) -> tuple[bool, list[float]]:
+        """Take tokens from several buckets atomically: from all of them, or from none.
+
+        Args:
+            buckets (list[tuple[str, Limit]]): Keys and limits of the buckets.
+            cost (int): Number of tokens to take from each bucket.
+
+        Returns:
+            tuple[bool, list[float]]: Whether the tokens were taken and the tokens left in each
+                bucket.
+        """
+        allowed, tokens = await self.script(
+            keys=[self.prefix + key for key, _ in buckets],
+            args=[cost]
+            + [value for _, limit in buckets for value in (limit.capacity, limit.rate)],
+        )
+        return bool(allowed), [float(value) for value in tokens]
+
+    def clear(self) -> None:
+        """Buckets in Redis expire on their own, there is nothing to clear locally."""
+
+
+class RateLimitResult:
+    """Outcome of a rate limited request."""
+
+    def __init__(self, limit: Limit, allowed: bool, tokens: float) -> None:
+        self.limit = limit
+        self.allowed = allowed
+        self.remaining = max(math.floor(tokens), 0)
+        # Time until the bucket is full again, and until the next token when it is empty
+        self.reset = math.ceil((limit.capacity - tokens) / limit.rate)
+        self.retry_after = max(math.ceil((1 - tokens) / limit.rate), 1)
+
+    @property
+    def headers(self) -> dict[str, str]:
+        return {
+            "RateLimit-Limit": str(self.limit.capacity),
+            "RateLimit-Remaining": str(self.remaining),
+            "RateLimit-Reset": str(self.reset),
+            "RateLimit-Policy": self.limit.policy,
+        }
+
+
+class RateLimiter:
+    """Per-user and per-IP token bucket rate limiter, with one limit per route class."""
+
+    def __init__(
+        self,
+        store: MemoryStore | RedisStore | None = None,
+        login: str = RATE_LIMIT_LOGIN,
+        write: str = RATE_LIMIT_WRITE,
+        read: str = RATE_LIMIT_READ,
+        ip: str = RATE_LIMIT_IP,
+        enabled: bool = RATE_LIMIT_ENABLED,
+    ) -> None:
+        if store is None:
+            store = RedisStore(RATE_LIMIT_REDIS_URL) if RATE_LIMIT_REDIS_URL else MemoryStore()
+
+        self.store = store
+        self.limits = {
+            "login": Limit.parse("login", login),
+            "write": Limit.parse("write", write),
+            "read": Limit.parse("read", read),
+            "ip": Limit.parse("ip", ip),
+        }
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self) -> None:
+        """Remove every bucket and reset the counters."""
+        self.store.clear()
+        self.allowed = dict.fromkeys(self.limits, 0)
+        self.limited = dict.fromkeys(self.limits, 0)
+        self.errors = 0
+
+    @staticmethod
+    def route_class(scope: Scope) -> str:
+        """Get the route class of a request.
+
+        Args:
+            scope (Scope): ASGI scope of the request.
+
+        Returns:
+            str: "login", "write" or "read".
+        """
+        if scope["path"].rstrip("/") in LOGIN_PATHS:
+            return "login"
+        if scope["method"] in WRITE_METHODS:
+            return "write"
+        return "read"
+
+    @staticmethod
+    def client_key(scope: Scope, route_class: str) -> str:
+        """Get the identity a request is limited by.
+
+        Args:
+            scope (Scope): ASGI scope of the request.
+            route_class (str): Route class of the request.
+
+        Returns:
+            str: "token:pat:<digest>" for personal access tokens, "user:<username>" for other
+                authenticated requests, "ip:<address>" otherwise. Logins are always limited per
+                IP, since anyone can try the password of any user.
+        """
+        if route_class == "login":
+            return RateLimiter.ip_key(scope)
+
+        token_key = get_token_key(scope)
+        if token_key is not None:
+            return f"token:{token_key}"
+
+        principal = get_principal(scope)
+        if principal is not None:
+            return f"user:{principal}"
+
+        return RateLimiter.ip_key(scope)
+
+    @staticmethod
+    def ip_key(scope: Scope) -> str:
+        """Get the client IP key of a request.
+
+        Args:
+            scope (Scope): ASGI scope of the request.
+
+        Returns:
+            str: "ip:<address>".
+        """
+        client = scope.get("client")
+        return f"ip:{client[0] if client else 'unknown'}"
+
+    async def check(self, scope: Scope) -> RateLimitResult | None:
+        """Take a token for a request, from the bucket of its route class and from the one of its
+        client IP. Both are taken at once, so a rejected request doesn't use any of them.
+
+        Args:
+            scope (Scope): ASGI scope of the request.
+
+        Returns:
+            RateLimitResult | None: Result of the limit that rejected the request, or of its route
+                class if it is allowed. None if the request is not rate limited.
+        """
+        route_class = self.route_class(scope)
+        names = [route_class, "ip"]
+        keys = [f"{route_class}:{self.client_key(scope, route_class)}", self.ip_key(scope)]
+
+        try:
+            allowed, tokens = await self.store.take(
+                [(key, self.limits[name]) for name, key in zip(names, keys)]
+            )
+        except Exception:
+            # Don't turn an outage of the shared backend into an outage of the gateway
+            logger.exception("Rate limit backend failed, letting the request through")
+            self.errors += 1
+            return None
+
+        if not allowed:
+            # Reported by the first bucket that was out of tokens
+            name, left = next((name, left) for name, left in zip(names, tokens) if left < 1)
+            self.limited[name] += 1
+            return RateLimitResult(self.limits[name], False, left)
+
+        self.allowed[route_class] += 1
+        self.allowed["ip"] += 1
+        return RateLimitResult(self.limits[route_class], True, tokens[0])
+
+    def stats(self) -> dict:
+        """Get the rate limiting statistics.
+
+        Returns:
+            dict: Limits, allowed and limited requests per route class, and backend errors.
+        """
+        return {
+            "enabled": self.enabled,
+            "backend": type(self.store).__name__,
+            "limits": {name: limit.policy for name, limit in self.limits.items()},
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "backend_errors": self.errors,
+        }
+
+
+# Limiter shared by the gateway application
+rate_limiter = RateLimiter()
+
+
+class RateLimitMiddleware:
+    """ASGI middleware that rejects the requests over their rate limit with a 429."""
+
+    def __init__(self, app: ASGIApp, limiter: RateLimiter = rate_limiter) -> None:
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        # CORS preflight requests are sent by the browser on its own, don't count them
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or not self.limiter.enabled:
+            return await self.app(scope, receive, send)
+
+        result = await self.limiter.check(scope)
+        if result is None:
+            return await self.app(scope, receive, send)
+
+        if not result.allowed:
+            response = JSONResponse(
+                {"detail": "Too many requests"},
+                status_code=429,
+                headers={**result.headers, "Retry-After": str(result.retry_after)},
+            )
+            return await response(scope, receive, send)
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                for name, value in result.headers.items():
+                    headers[name] = value
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
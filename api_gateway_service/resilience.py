@@ -0,0 +1,174 @@
+"""Overload protection of the upstream services.
+
+Every upstream has a circuit breaker and an adaptive concurrency limit. When a service keeps
+failing, or answers slower than the gateway sends it requests, the gateway fails fast with a 503
+and a Retry-After header, instead of piling up requests, sockets and latency that would also hurt
+the healthy routes.
+
+- The circuit breaker opens after a number of consecutive failures. After a cool down it lets a
+  single probe request through (half-open) and closes again if it succeeds.
+- The concurrency limit follows AIMD: it grows by one while the upstream is busy and healthy, and
+  is multiplied by a backoff ratio whenever a request fails or is slower than a latency threshold.
+"""
+
+import math
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class UpstreamOverloadedError(Exception):
+    """Raised when a request is rejected to protect an upstream service."""
+
+    def __init__(self, service: str, reason: str, retry_after: float) -> None:
+        super().__init__(f"{service} upstream is overloaded ({reason})")
+        self.service = service
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(math.ceil(self.retry_after), 1))
+
+
+class CircuitBreaker:
+    """Circuit breaker with half-open probing."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 10.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.rejections = 0
+        self.times_opened = 0
+
+    def allow(self) -> bool:
+        """Check whether a request can be sent.
+
+        Returns:
+            bool: True if the circuit is closed, or if the request is the half-open probe.
+        """
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+
+        if self.state == CLOSED or (self.state == HALF_OPEN and not self.probe_in_flight):
+            self.probe_in_flight = self.state == HALF_OPEN
+            return True
+
+        self.rejections += 1
+        return False
+
+    def record(self, failed: bool) -> None:
+        """Record the result of a request that was allowed.
+
+        Args:
+            failed (bool): Whether the request failed.
+        """
+        if self.state == HALF_OPEN:
+            self.probe_in_flight = False
+
+        if not failed:
+            self.consecutive_failures = 0
+            self.state = CLOSED
+            return
+
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.times_opened += 1
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def cancel(self) -> None:
+        """Forget a request that was allowed but has no result, e.g. because it was not sent."""
+        if self.state == HALF_OPEN:
+            self.probe_in_flight = False
+
+    def retry_after(self) -> float:
+        """Get the time until the circuit lets a probe request through.
+
+        Returns:
+            float: Seconds.
+        """
+        if self.state == OPEN:
+            return max(self.reset_timeout - (time.monotonic() - self.opened_at), 0.0)
+        return 0.0
+
+    def stats(self) -> dict:
+        """Get the state of the circuit breaker.
+
+        Returns:
+            dict: State, consecutive failures and counters.
+        """
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened,
+            "rejections": self.rejections,
+        }
+
+
+class AIMDConcurrencyLimit:
+    """Adaptive concurrency limit with additive increase and multiplicative decrease."""
+
+    def __init__(
+        self,
+        initial_limit: int = 20,
+        min_limit: int = 1,
+        max_limit: int = 100,
+        latency_threshold: float = 1.0,
+        backoff_ratio: float = 0.9,
+    ) -> None:
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_threshold = latency_threshold
+        self.backoff_ratio = backoff_ratio
+
+        self.in_flight = 0
+        self.rejections = 0
+
+    def try_acquire(self) -> bool:
+        """Try to reserve a slot for a request.
+
+        Returns:
+            bool: True if the request is under the limit and can be sent.
+        """
+        if self.in_flight >= int(self.limit):
+            self.rejections += 1
+            return False
+
+        self.in_flight += 1
+        return True
+
+    def release(self, latency: float, failed: bool) -> None:
+        """Free the slot of a request and adapt the limit to its result.
+
+        Args:
+            latency (float): Time until the response headers were received, in seconds.
+            failed (bool): Whether the request failed.
+        """
+        if failed or latency > self.latency_threshold:
+            self.limit = max(self.limit * self.backoff_ratio, self.min_limit)
+        elif self.in_flight * 2 >= self.limit:
+            # Only grow while the limit is actually being used
+            self.limit = min(self.limit + 1, self.max_limit)
+
+        self.in_flight -= 1
+
+    def stats(self) -> dict:
+        """Get the state of the concurrency limit.
+
+        Returns:
+            dict: Current limit, requests in flight and rejections.
+        """
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "rejections": self.rejections,
+        }
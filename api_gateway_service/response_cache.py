@@ -0,0 +1,329 @@
+"""Per-user HTTP response cache of the API gateway.
+
+Successful GET responses of the read heavy routes are cached per authenticated principal (and
+personal access token), path and query string, so repeated reads skip the authentication, the
+database and the serialization in the services. Entries expire after a TTL and the cache is
+bounded in entries and bytes, evicting the least recently used entries first. Any POST, PUT, PATCH
+or DELETE made by a user through the gateway invalidates all the entries of that user. A batch
+request is not a write by itself: its sub-requests go through the cache one by one, and the writes
+among them invalidate it.
+
+Concurrent identical reads of the same user that miss the cache are coalesced, so only one of
+them reaches the services and the others share its response.
+
+Updates made by other users (e.g. a collaborator of a shared project) are only visible once the
+entries expire, so the TTL should be kept short."""
+
+import os
+import time
+from collections import OrderedDict
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from api_gateway_service.batch import BATCH_PATH
+from api_gateway_service.identity import get_principal, get_token_key
+from api_gateway_service.single_flight import SingleFlight
+
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "10"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_MAX_ENTRY_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRY_BYTES", str(1024 * 1024)))
+RESPONSE_CACHE_PATHS = os.getenv("RESPONSE_CACHE_PATHS", "/api/tasks,/api/projects,/api/users")
+
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+class CachedResponse:
+    """A response stored in the cache."""
+
+    def __init__(
+        self, status: int, headers: list[tuple[bytes, bytes]], body: bytes, expires_at: float
+    ) -> None:
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.expires_at = expires_at
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + sum(len(name) + len(value) for name, value in self.headers)
+
+
+class ResponseCache:
+    """TTL cache of responses, bounded in entries and bytes with LRU eviction."""
+
+    def __init__(
+        self,
+        ttl: float = RESPONSE_CACHE_TTL,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+        max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+        max_entry_bytes: int = RESPONSE_CACHE_MAX_ENTRY_BYTES,
+    ) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.clear()
+
+    def clear(self) -> None:
+        """Remove all the entries and reset the counters."""
+        self.entries: OrderedDict[tuple, CachedResponse] = OrderedDict()
+        self.keys_by_principal: dict[str, set[tuple]] = {}
+        # Incremented on every invalidation, to discard responses that were being fetched
+        self.generations: dict[str, int] = {}
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: tuple) -> CachedResponse | None:
+        """Get a response from the cache.
+
+        Args:
+            key (tuple): Principal, path and query string.
+
+        Returns:
+            CachedResponse | None: Cached response, or None if missing or expired.
+        """
+        response = self.entries.get(key)
+
+        if response is None or response.expires_at <= time.monotonic():
+            if response is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return response
+
+    def set(self, key: tuple, response: CachedResponse) -> None:
+        """Store a response in the cache, evicting the least recently used ones if needed.
+
+        Args:
+            key (tuple): Principal, path and query string.
+            response (CachedResponse): Response to store.
+        """
+        if response.size > self.max_entry_bytes:
+            return
+
+        if key in self.entries:
+            self._remove(key)
+
+        self.entries[key] = response
+        self.keys_by_principal.setdefault(key[0], set()).add(key)
+        self.size += response.size
+
+        while self.entries and (
+            len(self.entries) > self.max_entries or self.size > self.max_bytes
+        ):
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def generation(self, principal: str) -> int:
+        """Get the invalidation generation of a principal.
+
+        Args:
+            principal (str): Principal.
+
+        Returns:
+            int: Number of times the entries of the principal have been invalidated.
+        """
+        return self.generations.get(principal, 0)
+
+    def invalidate(self, principal: str) -> None:
+        """Remove all the entries of a principal.
+
+        Args:
+            principal (str): Principal.
+        """
+        self.generations[principal] = self.generation(principal) + 1
+        self.invalidations += 1
+
+        for key in list(self.keys_by_principal.get(principal, ())):
+            self._remove(key)
+
+    def stats(self) -> dict:
+        """Get the cache statistics.
+
+        Returns:
+            dict: Hit, miss, eviction and invalidation counters and cache occupancy.
+        """
+        lookups = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+        }
+
+    def _remove(self, key: tuple) -> None:
+        response = self.entries.pop(key)
+        self.size -= response.size
+
+        keys = self.keys_by_principal[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self.keys_by_principal[key[0]]
+
+
+# Cache and coalescer of the reads shared by the gateway application
+response_cache = ResponseCache()
+read_coalescer = SingleFlight()
+
+
+class ResponseCacheMiddleware:
+    """ASGI middleware that serves cached and coalesced GET responses per authenticated principal."""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        cache: ResponseCache = response_cache,
+        coalescer: SingleFlight = read_coalescer,
+        paths: str = RESPONSE_CACHE_PATHS,
+    ) -> None:
+        self.app = app
+        self.cache = cache
+        self.coalescer = coalescer
+        self.paths = tuple(path.strip() for path in paths.split(",") if path.strip())
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        principal = get_principal(scope)
+        if principal is None:
+            return await self.app(scope, receive, send)
+
+        if scope["method"] in WRITE_METHODS and scope["path"].rstrip("/") != BATCH_PATH:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                self.cache.invalidate(principal)
+            return
+
+        cache_control = Headers(scope=scope).get("cache-control", "")
+        if (
+            scope["method"] != "GET"
+            or not scope["path"].startswith(self.paths)
+            or "no-cache" in cache_control
+            or "no-store" in cache_control
+        ):
+            return await self.app(scope, receive, send)
+
+        # A personal access token has its own entries, its scopes may not allow the user's reads
+        key = (principal, scope["path"], scope["query_string"], get_token_key(scope))
+
+        cached_response = self.cache.get(key)
+        if cached_response is not None:
+            return await self.send_cached_response(cached_response, send, b"HIT")
+
+        # Identical concurrent reads of the same user share a single call to the services
+        is_leader = False
+
+        async def fetch() -> CachedResponse | None:
+            nonlocal is_leader
+            is_leader = True
+            return await self.fetch(key, scope, receive, send)
+
+        try:
+            shared_response, shared = await self.coalescer.do(key, fetch)
+        except Exception:
+            if is_leader:
+                raise
+            shared_response, shared = None, True
+
+        if shared and shared_response is not None:
+            await self.send_cached_response(shared_response, send, b"COALESCED")
+        elif shared:
+            # The response of the leader could not be shared, fetch it again
+            await self.fetch(key, scope, receive, send)
+
+    async def fetch(
+        self, key: tuple, scope: Scope, receive: Receive, send: Send
+    ) -> CachedResponse | None:
+        """Run the request and store its response, while streaming it to the client.
+
+        Args:
+            key (tuple): Principal, path and query string.
+            scope (Scope): ASGI scope of the request.
+            receive (Receive): ASGI receive channel.
+            send (Send): ASGI send channel.
+
+        Returns:
+            CachedResponse | None: Buffered response, or None if it is too large or sets cookies,
+                so it can't be shared with other clients.
+        """
+        generation = self.cache.generation(key[0])
+        start_message: Message = {}
+        body = bytearray()
+        shareable = True
+        response = None
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal shareable, response
+
+            if message["type"] == "http.response.start":
+                start_message.update(message)
+                headers = MutableHeaders(scope=message)
+                shareable = "set-cookie" not in headers
+                headers["X-Cache"] = "MISS"
+
+            elif message["type"] == "http.response.body" and shareable:
+                body.extend(message.get("body", b""))
+                shareable = len(body) <= self.cache.max_entry_bytes
+
+                if not message.get("more_body", False) and shareable:
+                    response = CachedResponse(
+                        start_message["status"],
+                        [
+                            (name, value)
+                            for name, value in start_message["headers"]
+                            if name.lower() != b"x-cache"
+                        ],
+                        bytes(body),
+                        time.monotonic() + self.cache.ttl,
+                    )
+
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+        if (
+            response is not None
+            and response.status == 200
+            and "no-store" not in Headers(raw=response.headers).get("cache-control", "")
+            # Skip the response if the user wrote something while it was being fetched
+            and self.cache.generation(key[0]) == generation
+        ):
+            self.cache.set(key, response)
+
+        return response
+
+    @staticmethod
+    async def send_cached_response(response: CachedResponse, send: Send, source: bytes) -> None:
+        """Send a cached or shared response to the client.
+
+        Args:
+            response (CachedResponse): Cached response.
+            send (Send): ASGI send channel.
+            source (bytes): Value of the X-Cache header, HIT or COALESCED.
+        """
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status,
+                "headers": response.headers + [(b"x-cache", source)],
+            }
+        )
+        await send({"type": "http.response.body", "body": response.body})
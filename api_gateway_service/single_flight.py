@@ -0,0 +1,74 @@
+"""Request coalescing (single-flight) for the API gateway.
+
+When several identical calls are made at the same time, only the first one (the leader) runs. The
+others wait for it and share its result, so a retry storm or a client fan-out costs a single
+upstream and database call."""
+
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Any
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into a single in-flight call."""
+
+    def __init__(self) -> None:
+        self.calls: dict[Hashable, asyncio.Future] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, function: Callable[[], Awaitable[Any]]) -> tuple[Any, bool]:
+        """Run a function, unless a call with the same key is already in flight.
+
+        If the leader fails, the error is raised to every waiter. If the leader is cancelled, one
+        of the waiters takes over.
+
+        Args:
+            key (Hashable): Key identifying identical calls.
+            function (Callable[[], Awaitable[Any]]): Function to run.
+
+        Returns:
+            tuple[Any, bool]: Result of the call and whether it was shared by another caller.
+        """
+        if key in self.calls:
+            self.coalesced += 1
+
+        while key in self.calls:
+            future = self.calls[key]
+            try:
+                return await asyncio.shield(future), True
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise  # The waiter itself was cancelled
+
+        future = asyncio.get_running_loop().create_future()
+        self.calls[key] = future
+        self.leaders += 1
+
+        try:
+            result = await function()
+        except Exception as error:
+            future.set_exception(error)
+            # Avoid "exception was never retrieved" warnings when nobody was waiting
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self.calls[key]
+
+    def stats(self) -> dict:
+        """Get the coalescing statistics.
+
+        Returns:
+            dict: Number of calls that ran, calls that were coalesced and calls in flight.
+        """
+        return {
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "in_flight": len(self.calls),
+        }
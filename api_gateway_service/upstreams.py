@@ -0,0 +1,579 @@
+"""Upstream HTTP clients for the API gateway.
+
+It keeps one shared, keep-alive httpx.AsyncClient per microservice, so proxied requests reuse
+pooled TCP connections instead of paying a new DNS lookup and connect on every call. The clients
+are created and closed in the lifespan of the gateway application (see api_gateway.py).
+
+Pool limits, keep-alive expiry and timeouts are read per upstream from environment variables named
+after the service, e.g. TASKS_SERVICE_MAX_CONNECTIONS, with UPSTREAM_MAX_CONNECTIONS as a global
+fallback for every service.
+
+An upstream can be served by several replicas, listed as comma separated host:port pairs in
+{SERVICE}_SERVICE_ENDPOINTS. Requests are balanced between them by the load balancer, and are
+rejected early by the circuit breaker and concurrency limit of the upstream when it is overloaded
+(see resilience.py). Slow idempotent requests are hedged (see hedging.py).
+
+With {SERVICE}_SERVICE_HTTP2=true the client negotiates HTTP/2 (requires the h2 package), so many
+concurrent requests are multiplexed over a few connections. HTTP/2 is negotiated with ALPN, i.e.
+only over TLS. Plain-text upstreams served by an HTTP/2 capable server (e.g. hypercorn) need
+{SERVICE}_SERVICE_HTTP2_PRIOR_KNOWLEDGE=true as well."""
+
+import asyncio
+import importlib.util
+import logging
+import os
+import time
+
+import httpx
+
+from api_gateway_service.hedging import (
+    IDEMPOTENT_METHODS,
+    LatencyTracker,
+    RetryBudget,
+    retry_budget,
+)
+from api_gateway_service.load_balancer import Endpoint, LoadBalancer
+from api_gateway_service.resilience import (
+    AIMDConcurrencyLimit,
+    CircuitBreaker,
+    UpstreamOverloadedError,
+)
+
+logger = logging.getLogger(__name__)
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+def _get_setting(service: str, name: str, default: str) -> str:
+    """Get an upstream setting from the environment.
+
+    The per service variable ({SERVICE}_SERVICE_{NAME}) takes precedence over the global one
+    (UPSTREAM_{NAME}).
+
+    Args:
+        service (str): Service name, e.g. "tasks".
+        name (str): Setting name, e.g. "MAX_CONNECTIONS".
+        default (str): Default value if none of the variables is set.
+
+    Returns:
+        str: Setting value.
+    """
+    return os.environ.get(
+        f"{service.upper()}_SERVICE_{name}", os.environ.get(f"UPSTREAM_{name}", default)
+    )
+
+
+class UpstreamConfig:
+    """Connection pool and timeout configuration of an upstream service."""
+
+    def __init__(
+        self,
+        service: str,
+        base_url: str,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        connect_timeout: float = 2.0,
+        timeout: float = 10.0,
+        pool_timeout: float = 5.0,
+        endpoints: list[str] | None = None,
+        health_interval: float = 5.0,
+        unhealthy_threshold: int = 2,
+        healthy_threshold: int = 2,
+        breaker_failure_threshold: int = 5,
+        breaker_reset_timeout: float = 10.0,
+        concurrency_initial_limit: int = 20,
+        concurrency_min_limit: int = 1,
+        concurrency_max_limit: int | None = None,
+        concurrency_latency_threshold: float = 1.0,
+        concurrency_backoff_ratio: float = 0.9,
+        hedge_enabled: bool = True,
+        hedge_percentile: float = 95,
+        hedge_min_delay: float = 0.05,
+        hedge_min_samples: int = 20,
+        max_retries: int = 1,
+        http2: bool = False,
+        http2_prior_knowledge: bool = False,
+    ) -> None:
+        self.service = service
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.pool_timeout = pool_timeout
+
+        # Origins (scheme://host:port) of the replicas. All of them serve the base URL path.
+        url = httpx.URL(base_url)
+        self.endpoints = endpoints or [f"{url.scheme}://{url.netloc.decode('ascii')}"]
+        self.health_interval = health_interval
+        self.unhealthy_threshold = unhealthy_threshold
+        self.healthy_threshold = healthy_threshold
+
+        self.breaker_failure_threshold = breaker_failure_threshold
+        self.breaker_reset_timeout = breaker_reset_timeout
+        self.concurrency_initial_limit = concurrency_initial_limit
+        self.concurrency_min_limit = concurrency_min_limit
+        # More requests in flight than pooled connections would only queue in the pool
+        self.concurrency_max_limit = concurrency_max_limit or max_connections
+        self.concurrency_latency_threshold = concurrency_latency_threshold
+        self.concurrency_backoff_ratio = concurrency_backoff_ratio
+
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.max_retries = max_retries
+
+        self.http2 = http2
+        self.http2_prior_knowledge = http2_prior_knowledge
+
+    @classmethod
+    def from_env(cls, service: str, base_url: str) -> "UpstreamConfig":
+        """Build the configuration of an upstream from the environment.
+
+        Args:
+            service (str): Service name.
+            base_url (str): Base URL of the service.
+
+        Returns:
+            UpstreamConfig: Upstream configuration.
+        """
+        return cls(
+            service=service,
+            base_url=base_url,
+            max_connections=int(_get_setting(service, "MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(
+                _get_setting(service, "MAX_KEEPALIVE_CONNECTIONS", "20")
+            ),
+            keepalive_expiry=float(_get_setting(service, "KEEPALIVE_EXPIRY", "30")),
+            connect_timeout=float(_get_setting(service, "CONNECT_TIMEOUT", "2")),
+            timeout=float(_get_setting(service, "TIMEOUT", "10")),
+            pool_timeout=float(_get_setting(service, "POOL_TIMEOUT", "5")),
+            endpoints=[
+                endpoint if "://" in endpoint else f"http://{endpoint}"
+                for endpoint in _get_setting(service, "ENDPOINTS", "").replace(" ", "").split(",")
+                if endpoint
+            ],
+            health_interval=float(_get_setting(service, "HEALTH_INTERVAL", "5")),
+            unhealthy_threshold=int(_get_setting(service, "UNHEALTHY_THRESHOLD", "2")),
+            healthy_threshold=int(_get_setting(service, "HEALTHY_THRESHOLD", "2")),
+            breaker_failure_threshold=int(_get_setting(service, "BREAKER_FAILURE_THRESHOLD", "5")),
+            breaker_reset_timeout=float(_get_setting(service, "BREAKER_RESET_TIMEOUT", "10")),
+            concurrency_initial_limit=int(
+                _get_setting(service, "CONCURRENCY_INITIAL_LIMIT", "20")
+            ),
+            concurrency_min_limit=int(_get_setting(service, "CONCURRENCY_MIN_LIMIT", "1")),
+            concurrency_max_limit=int(_get_setting(service, "CONCURRENCY_MAX_LIMIT", "0")),
+            concurrency_latency_threshold=float(
+                _get_setting(service, "CONCURRENCY_LATENCY_THRESHOLD", "1")
+            ),
+            concurrency_backoff_ratio=float(
+                _get_setting(service, "CONCURRENCY_BACKOFF_RATIO", "0.9")
+            ),
+            hedge_enabled=_get_setting(service, "HEDGE_ENABLED", "true").lower() == "true",
+            hedge_percentile=float(_get_setting(service, "HEDGE_PERCENTILE", "95")),
+            hedge_min_delay=float(_get_setting(service, "HEDGE_MIN_DELAY", "0.05")),
+            hedge_min_samples=int(_get_setting(service, "HEDGE_MIN_SAMPLES", "20")),
+            max_retries=int(_get_setting(service, "MAX_RETRIES", "1")),
+            http2=_get_setting(service, "HTTP2", "false").lower() == "true",
+            http2_prior_knowledge=(
+                _get_setting(service, "HTTP2_PRIOR_KNOWLEDGE", "false").lower() == "true"
+            ),
+        )
+
+
+def has_body(request: httpx.Request) -> bool:
+    """Check whether a request has a body.
+
+    Args:
+        request (httpx.Request): Request to an upstream.
+
+    Returns:
+        bool: True if the request has a body.
+    """
+    return (
+        request.headers.get("content-length", "0") != "0" or "transfer-encoding" in request.headers
+    )
+
+
+def copy_request(request: httpx.Request) -> httpx.Request:
+    """Copy a request without a body, so it can be sent again.
+
+    Args:
+        request (httpx.Request): Request to an upstream.
+
+    Returns:
+        httpx.Request: New request with the same method, URL and headers.
+    """
+    return httpx.Request(
+        request.method, request.url, headers=request.headers.copy(), extensions=request.extensions
+    )
+
+
+class TrackedStream(httpx.AsyncByteStream):
+    """Response stream that notifies when it is closed, i.e. when the request is complete."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_close) -> None:
+        self.stream = stream
+        self.on_close = on_close
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self.stream.aclose()
+        finally:
+            if self.on_close:
+                self.on_close()
+                self.on_close = None
+
+
+class Upstream:
+    """A microservice reachable from the gateway through a shared, pooled HTTP client."""
+
+    def __init__(
+        self,
+        config: UpstreamConfig,
+        transport: httpx.AsyncBaseTransport | None = None,
+        budget: RetryBudget = retry_budget,
+    ) -> None:
+        self.config = config
+
+        http2 = config.http2 and HTTP2_AVAILABLE
+        if config.http2 and not HTTP2_AVAILABLE:
+            logger.warning(
+                "h2 is not installed, %s upstream falls back to HTTP/1.1", config.service
+            )
+
+        self.client = httpx.AsyncClient(
+            http1=not (http2 and config.http2_prior_knowledge),
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=config.max_connections,
+                max_keepalive_connections=config.max_keepalive_connections,
+                keepalive_expiry=config.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(
+                config.timeout, connect=config.connect_timeout, pool=config.pool_timeout
+            ),
+            transport=transport,
+        )
+        self.balancer = LoadBalancer(
+            config.endpoints,
+            health_path=f"{httpx.URL(config.base_url).path.rstrip('/')}/",
+            health_interval=config.health_interval,
+            unhealthy_threshold=config.unhealthy_threshold,
+            healthy_threshold=config.healthy_threshold,
+        )
+        self.health_checks: asyncio.Task | None = None
+        self.breaker = CircuitBreaker(
+            failure_threshold=config.breaker_failure_threshold,
+            reset_timeout=config.breaker_reset_timeout,
+        )
+        self.concurrency_limit = AIMDConcurrencyLimit(
+            initial_limit=config.concurrency_initial_limit,
+            min_limit=config.concurrency_min_limit,
+            max_limit=config.concurrency_max_limit,
+            latency_threshold=config.concurrency_latency_threshold,
+            backoff_ratio=config.concurrency_backoff_ratio,
+        )
+        self.latencies = LatencyTracker(
+            percentile=config.hedge_percentile,
+            min_delay=config.hedge_min_delay,
+            min_samples=config.hedge_min_samples,
+        )
+        self.budget = budget
+        self.hedges = 0
+        self.hedges_won = 0
+        self.retries = 0
+
+    def url(self, endpoint: str) -> str:
+        """Build the URL of an endpoint of the upstream service.
+
+        Args:
+            endpoint (str): Endpoint path, relative to the service base URL.
+
+        Returns:
+            str: Absolute URL.
+        """
+        return f"{self.config.base_url}/{endpoint.lstrip('/')}"
+
+    async def send(self, request: httpx.Request) -> httpx.Response:
+        """Send a request to the upstream service.
+
+        Idempotent requests without a body are hedged and retried within the retry budget. The
+        response body is not read, so it can be streamed back to the client. The caller must close
+        the response.
+
+        Args:
+            request (httpx.Request): Request built with the client of the upstream.
+
+        Raises:
+            UpstreamOverloadedError: If the circuit breaker is open or the concurrency limit of
+                the upstream is reached.
+
+        Returns:
+            httpx.Response: Upstream response.
+        """
+        if request.method not in IDEMPOTENT_METHODS or has_body(request):
+            return await self.send_once(request)
+
+        self.budget.deposit()
+
+        for attempt in range(self.config.max_retries + 1):
+            try:
+                return await self.send_hedged(request if attempt == 0 else copy_request(request))
+            except httpx.TransportError:
+                if attempt == self.config.max_retries or not self.budget.try_withdraw():
+                    raise
+                self.retries += 1
+
+    async def send_hedged(self, request: httpx.Request) -> httpx.Response:
+        """Send a request, and hedge it if it is slower than usual.
+
+        Args:
+            request (httpx.Request): Idempotent request.
+
+        Returns:
+            httpx.Response: First response received.
+        """
+        delay = self.latencies.hedge_delay() if self.config.hedge_enabled else None
+        primary = asyncio.create_task(self.send_once(request))
+
+        if delay is None:
+            return await primary
+
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or not self.budget.try_withdraw():
+            return await primary
+
+        self.hedges += 1
+        hedge = asyncio.create_task(self.send_once(copy_request(request)))
+
+        return await self.first_response(primary, hedge)
+
+    async def first_response(self, primary: asyncio.Task, hedge: asyncio.Task) -> httpx.Response:
+        """Wait for the first successful response of a request and its hedge.
+
+        The other request is cancelled, or its response is closed if it has already arrived.
+
+        Args:
+            primary (asyncio.Task): Task sending the original request.
+            hedge (asyncio.Task): Task sending the hedged request.
+
+        Raises:
+            Exception: The error of the original request, if both of them fail.
+
+        Returns:
+            httpx.Response: Response of the request that answered first.
+        """
+        pending = {primary, hedge}
+        winner = None
+
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                succeeded = [task for task in done if task.exception() is None]
+                if succeeded:
+                    winner = primary if primary in succeeded else hedge
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+            # Close the responses that lost the race
+            for task in (primary, hedge):
+                if task is not winner and task.done() and not task.cancelled():
+                    if task.exception() is None:
+                        await task.result().aclose()
+
+        if winner is None:
+            raise primary.exception() or hedge.exception()  # type: ignore
+
+        if winner is hedge:
+            self.hedges_won += 1
+
+        return winner.result()
+
+    async def send_once(self, request: httpx.Request) -> httpx.Response:
+        """Send a request to the upstream service once, with overload protection.
+
+        The request is routed to the endpoint picked by the load balancer. The response body is
+        not read, so it can be streamed back to the client. The caller must close the response.
+
+        Args:
+            request (httpx.Request): Request built with the client of the upstream.
+
+        Raises:
+            UpstreamOverloadedError: If the circuit breaker is open or the concurrency limit of
+                the upstream is reached.
+
+        Returns:
+            httpx.Response: Upstream response.
+        """
+        if not self.breaker.allow():
+            raise UpstreamOverloadedError(
+                self.config.service, "circuit open", self.breaker.retry_after()
+            )
+        if not self.concurrency_limit.try_acquire():
+            self.breaker.cancel()
+            raise UpstreamOverloadedError(self.config.service, "concurrency limit", 1)
+
+        endpoint = self.balancer.pick()
+        self.route(request, endpoint)
+
+        endpoint.outstanding += 1
+        started = time.perf_counter()
+        try:
+            response = await self.client.send(request, stream=True)
+        except BaseException as error:
+            latency = time.perf_counter() - started
+            failed = isinstance(error, httpx.HTTPError)
+            endpoint.outstanding -= 1
+            endpoint.record(latency, error=failed)
+            self.concurrency_limit.release(latency, failed=failed)
+            if failed:
+                self.breaker.record(failed=True)
+            else:
+                self.breaker.cancel()
+            raise
+
+        latency = time.perf_counter() - started
+        failed = response.status_code >= 500
+        endpoint.record(latency, error=failed)
+        self.breaker.record(failed=failed)
+        if not failed:
+            self.latencies.record(latency)
+
+        # The request is outstanding until its response has been fully streamed. Transports may
+        # return responses that are already read and closed.
+        def release() -> None:
+            endpoint.outstanding -= 1
+            self.concurrency_limit.release(latency, failed=failed)
+
+        if response.is_closed:
+            release()
+        else:
+            response.stream = TrackedStream(response.stream, release)
+
+        return response
+
+    @staticmethod
+    def route(request: httpx.Request, endpoint: Endpoint) -> None:
+        """Point a request to an endpoint of the upstream.
+
+        Args:
+            request (httpx.Request): Request to the upstream.
+            endpoint (Endpoint): Endpoint that will serve the request.
+        """
+        request.url = request.url.copy_with(
+            scheme=endpoint.origin.scheme, host=endpoint.origin.host, port=endpoint.origin.port
+        )
+        request.headers["Host"] = request.url.netloc.decode("ascii")
+
+    def stats(self) -> dict:
+        """Get the connection pool occupancy and endpoint statistics of the upstream.
+
+        Returns:
+            dict: Pool limits, number of open, active, idle and queued connections, endpoint
+                statistics and overload protection state.
+        """
+        # httpcore does not expose a public API for this, so read the pool defensively. Custom
+        # transports (e.g. in tests) have no pool at all.
+        pool = getattr(getattr(self.client, "_transport", None), "_pool", None)
+        connections = list(getattr(pool, "connections", []))
+        idle = sum(1 for connection in connections if connection.is_idle())
+
+        return {
+            "base_url": self.config.base_url,
+            "max_connections": self.config.max_connections,
+            "max_keepalive_connections": self.config.max_keepalive_connections,
+            "http2": self.config.http2 and HTTP2_AVAILABLE,
+            "connections": len(connections),
+            "active_connections": len(connections) - idle,
+            "idle_connections": idle,
+            "queued_requests": max(len(getattr(pool, "_requests", [])) - len(connections), 0),
+            "endpoints": self.balancer.stats(),
+            "circuit_breaker": self.breaker.stats(),
+            "concurrency_limit": self.concurrency_limit.stats(),
+            "hedging": {
+                "enabled": self.config.hedge_enabled,
+                "delay_ms": (
+                    round(self.latencies.delay * 1000, 3) if self.latencies.delay else None
+                ),
+                "hedges": self.hedges,
+                "hedges_won": self.hedges_won,
+                "retries": self.retries,
+            },
+        }
+
+    def start_health_checks(self) -> None:
+        """Start probing the endpoints of the upstream in the background."""
+        self.health_checks = asyncio.create_task(self.balancer.run_health_checks(self.client))
+
+    async def aclose(self) -> None:
+        """Stop the health checks and close the client and all its pooled connections."""
+        if self.health_checks:
+            self.health_checks.cancel()
+            try:
+                await self.health_checks
+            except asyncio.CancelledError:
+                pass
+
+        await self.client.aclose()
+
+
+class UpstreamRegistry:
+    """The upstreams of the gateway, indexed by service name."""
+
+    def __init__(self, upstreams: dict[str, Upstream]) -> None:
+        self.upstreams = upstreams
+
+    @classmethod
+    def from_service_urls(
+        cls, service_urls: dict[str, str], transport: httpx.AsyncBaseTransport | None = None
+    ) -> "UpstreamRegistry":
+        """Create one upstream per service.
+
+        Args:
+            service_urls (dict[str, str]): Base URL of each service, indexed by service name.
+            transport (httpx.AsyncBaseTransport, optional): Transport used by every client instead
+                of the default network one. Defaults to None.
+
+        Returns:
+            UpstreamRegistry: Upstream registry.
+        """
+        return cls(
+            {
+                service: Upstream(UpstreamConfig.from_env(service, base_url), transport=transport)
+                for service, base_url in service_urls.items()
+            }
+        )
+
+    def __getitem__(self, service: str) -> Upstream:
+        return self.upstreams[service]
+
+    def __contains__(self, service: str) -> bool:
+        return service in self.upstreams
+
+    def start_health_checks(self) -> None:
+        """Start probing the endpoints of every upstream in the background."""
+        for upstream in self.upstreams.values():
+            upstream.start_health_checks()
+
+    def stats(self) -> dict:
+        """Get the pool occupancy and endpoint statistics of every upstream.
+
+        Returns:
+            dict: Upstream stats, indexed by service name.
+        """
+        return {service: upstream.stats() for service, upstream in self.upstreams.items()}
+
+    async def aclose(self) -> None:
+        """Close the clients of every upstream."""
+        for upstream in self.upstreams.values():
+            await upstream.aclose()
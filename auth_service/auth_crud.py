@@ -3,22 +3,38 @@
 It contains the logic for authenticating users and creating access tokens."""
 
 
-from datetime import datetime, timedelta
-
-from fastapi import Depends, HTTPException
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from fastapi import Depends, Header, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from sqlalchemy.orm import Session
-from starlette.status import HTTP_401_UNAUTHORIZED
+from starlette.status import HTTP_401_UNAUTHORIZED, HTTP_403_FORBIDDEN
 
 import common_components.database.db as db
-from auth_service.auth_schemas import TokenData  # TODO: Coupling check
+from auth_service.auth_models import PersonalAccessToken, RefreshToken
+from auth_service.auth_schemas import Principal, TokenData  # TODO: Coupling check
+from auth_service.password_hashing import password_hasher
+from auth_service.principal_cache import principal_cache
+from auth_service.revocation import revocation_store
+from auth_service.token_keys import signing_keys, token_verifier
+from auth_service.token_usage import token_usage
+from common_components.database import settings
 from users_service.users_models import User  # TODO: Coupling check
 
 ########### HASHING ###########
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt runs in a dedicated process pool, see password_hashing.py. The async functions await the
+# hash without holding a thread of the threadpool, the sync ones block the calling thread.
 
 
 def verify_password(plain_password, hashed_password):
@@ -28,10 +44,30 @@ def verify_password(plain_password, hashed_password):
         plain_password: Plain password.
         hashed_password: Hashed password.
 
+    Raises:
+        HTTPException: If the password hashing queue is full.
+
     Returns:
         bool: True if password is valid, otherwise False.
     """
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_hasher.verify(plain_password, hashed_password)
+
+
+def verify_and_update_password(plain_password, hashed_password):
+    """Verify password, and rehash it if its hash doesn't use the current scheme and cost.
+
+    Args:
+        plain_password: Plain password.
+        hashed_password: Hashed password.
+
+    Raises:
+        HTTPException: If the password hashing queue is full.
+
+    Returns:
+        tuple[bool, str | None]: True if password is valid, otherwise False, and the new hash if
+            the password must be rehashed.
+    """
+    return password_hasher.verify_and_update(plain_password, hashed_password)
 
 
 def get_password_hash(password):
@@ -40,17 +76,69 @@ def get_password_hash(password):
     Args:
         password (str): Password.
 
+    Raises:
+        HTTPException: If the password hashing queue is full.
+
+    Returns:
+        str: Password hash.
+    """
+    return password_hasher.hash(password)
+
+
+async def verify_password_async(plain_password, hashed_password):
+    """Verify password, awaiting the password hashing pool.
+
+    Args:
+        plain_password: Plain password.
+        hashed_password: Hashed password.
+
+    Raises:
+        HTTPException: If the password hashing queue is full.
+
+    Returns:
+        bool: True if password is valid, otherwise False.
+    """
+    return await password_hasher.verify_async(plain_password, hashed_password)
+
+
+async def verify_and_update_password_async(plain_password, hashed_password):
+    """Verify password and rehash it if needed, awaiting the password hashing pool.
+
+    Args:
+        plain_password: Plain password.
+        hashed_password: Hashed password.
+
+    Raises:
+        HTTPException: If the password hashing queue is full.
+
+    Returns:
+        tuple[bool, str | None]: True if password is valid, otherwise False, and the new hash if
+            the password must be rehashed.
+    """
+    return await password_hasher.verify_and_update_async(plain_password, hashed_password)
+
+
+async def get_password_hash_async(password):
+    """Get password hash, awaiting the password hashing pool.
+
+    Args:
+        password (str): Password.
+
+    Raises:
+        HTTPException: If the password hashing queue is full.
+
     Returns:
         str: Password hash.
     """
-    return pwd_context.hash(password)
+    return await password_hasher.hash_async(password)
 
 
 ########### JWT ###########
 
-SECRET_KEY = "920b415199a51731fbdfead8b913bf1cbfd917b039f9259ee81ee0b494b58bdb "
-ALGORITHM = "HS256"
+# Tokens are signed with the private keys of the auth service and verified with the public ones,
+# see token_keys.py
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
 
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
@@ -67,11 +155,344 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
         expire = datetime.utcnow() + timedelta(minutes=15)
 
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = signing_keys.sign(to_encode)
 
     return encoded_jwt
 
 
+def decode_access_token(token: str) -> dict:
+    """Decode and verify an access token.
+
+    The token is verified locally, with the cached public keys of the auth service, and checked
+    against the revoked tokens.
+
+    Args:
+        token (str): JWT token.
+
+    Raises:
+        JWTError: If the token is invalid, expired, revoked, signed with an unknown key, or is a
+            refresh token.
+
+    Returns:
+        dict: Token claims.
+    """
+    claims = token_verifier.decode(token)
+
+    if claims.get("typ") == "refresh":
+        raise JWTError("Not an access token")
+    if "jti" in claims and revocation_store.is_revoked(claims["jti"]):
+        raise JWTError("Token revoked")
+    if "fam" in claims and revocation_store.is_revoked(f"fam:{claims['fam']}"):
+        raise JWTError("Token revoked")
+
+    return claims
+
+
+########### INTERNAL IDENTITY ###########
+
+# The gateway verifies the access token once and forwards the identity of the user to the
+# services in this header, signed with a secret shared by the gateway and the services only.
+# Anyone knowing the secret can act as any user, so it has no default.
+INTERNAL_IDENTITY_HEADER = "X-Internal-Identity"
+INTERNAL_IDENTITY_SECRET = settings.get_required_setting("INTERNAL_IDENTITY_SECRET").encode()
+
+
+def _b64encode(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def _sign(data: bytes) -> bytes:
+    return _b64encode(hmac.new(INTERNAL_IDENTITY_SECRET, data, hashlib.sha256).digest())
+
+
+def sign_internal_identity(claims: dict) -> str | None:
+    """Build the internal identity header of a verified access token.
+
+    Args:
+        claims (dict): Claims of the access token.
+
+    Returns:
+        str | None: Signed identity, or None if the token has no user id (tokens issued before
+            the user id claim was added), so the services look the user up themselves.
+    """
+    if "uid" not in claims or "sub" not in claims or "exp" not in claims:
+        return None
+
+    payload = json.dumps(
+        {
+            "uid": claims["uid"],
+            "sub": claims["sub"],
+            "disabled": claims.get("disabled", False),
+            "exp": claims["exp"],
+            # So the services can reject a token revoked after the gateway verified it
+            "jti": claims.get("jti"),
+            "fam": claims.get("fam"),
+            # Scopes of a personal access token, checked by the services
+            "scopes": claims.get("scopes"),
+        },
+        separators=(",", ":"),
+    ).encode()
+    encoded_payload = _b64encode(payload)
+
+    return (encoded_payload + b"." + _sign(encoded_payload)).decode("ascii")
+
+
+def verify_internal_identity(identity: str) -> Principal | None:
+    """Verify an internal identity header.
+
+    Args:
+        identity (str): Signed identity.
+
+    Returns:
+        Principal | None: Principal, or None if the signature is invalid or the access token
+            the identity was built from has expired or was revoked, e.g. when its user was
+            disabled or deleted.
+    """
+    encoded_payload, _, signature = identity.encode("ascii", errors="replace").partition(b".")
+
+    if not hmac.compare_digest(signature, _sign(encoded_payload)):
+        return None
+
+    payload = json.loads(
+        base64.urlsafe_b64decode(encoded_payload + b"=" * (-len(encoded_payload) % 4))
+    )
+    if payload["exp"] <= time.time():
+        return None
+    if payload.get("jti") and revocation_store.is_revoked(payload["jti"]):
+        return None
+    if payload.get("fam") and revocation_store.is_revoked(f"fam:{payload['fam']}"):
+        return None
+
+    return Principal(
+        id=payload["uid"],
+        username=payload["sub"],
+        disabled=payload["disabled"],
+        scopes=payload.get("scopes"),
+    )
+
+
+########### PERSONAL ACCESS TOKENS ###########
+
+# Long lived tokens for machine clients. They are random, so they are stored as an HMAC digest
+# rather than a slow password hash, and looked up by digest.
+# The secret has no default, anyone knowing it could compute the digests of the tokens. Rotating
+# it invalidates every stored digest: all the personal access tokens must be created again.
+PAT_PREFIX = "pat_"
+PAT_SECRET = settings.get_required_setting("PAT_SECRET").encode()
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+def get_token_digest(token: str) -> str:
+    return hmac.new(PAT_SECRET, token.encode(), hashlib.sha256).hexdigest()
+
+
+def create_personal_access_token(
+    db: Session, user_id: int, name: str, scopes: list[str], expires_in_days: int | None = None
+) -> tuple[PersonalAccessToken, str]:
+    """Create a personal access token.
+
+    Args:
+        db (Session): Database session.
+        user_id (int): ID of the owner of the token.
+        name (str): Name of the token.
+        scopes (list[str]): Scopes granted to the token.
+        expires_in_days (int | None): Lifetime of the token. Defaults to None, never expiring.
+
+    Returns:
+        tuple[PersonalAccessToken, str]: Token SQLAlchemy model, and the token itself, which is
+            not stored and can't be shown again.
+    """
+    token = PAT_PREFIX + secrets.token_urlsafe(32)
+    db_token = PersonalAccessToken(
+        user_id=user_id,
+        name=name,
+        digest=get_token_digest(token),
+        scopes=" ".join(sorted(set(scopes))),
+        expires_at=datetime.utcnow() + timedelta(days=expires_in_days)
+        if expires_in_days is not None
+        else None,
+    )
+
+    db.add(db_token)
+    db.commit()
+    db.refresh(db_token)
+
+    return db_token, token
+
+
+def get_personal_access_tokens(db: Session, user_id: int) -> list[PersonalAccessToken]:
+    """Get the personal access tokens of a user.
+
+    Args:
+        db (Session): Database session.
+        user_id (int): User ID.
+
+    Returns:
+        list[PersonalAccessToken]: Token SQLAlchemy models.
+    """
+    return (
+        db.query(PersonalAccessToken)
+        .filter(PersonalAccessToken.user_id == user_id)
+        .order_by(PersonalAccessToken.id)
+        .all()
+    )
+
+
+def delete_personal_access_token(db: Session, user_id: int, token_id: int) -> bool:
+    """Revoke a personal access token.
+
+    Args:
+        db (Session): Database session.
+        user_id (int): ID of the owner of the token.
+        token_id (int): Token ID.
+
+    Returns:
+        bool: True if the token was deleted, False if the user has no such token.
+    """
+    deleted = (
+        db.query(PersonalAccessToken)
+        .filter(PersonalAccessToken.id == token_id, PersonalAccessToken.user_id == user_id)
+        .delete()
+    )
+    db.commit()
+
+    # The principals of the token may be cached
+    principal_cache.invalidate(user_id)
+
+    return bool(deleted)
+
+
+def get_personal_access_token(db: Session, token: str) -> tuple[PersonalAccessToken, User] | None:
+    """Get a valid personal access token and its user, in one indexed SELECT.
+
+    Args:
+        db (Session): Database session.
+        token (str): Personal access token.
+
+    Returns:
+        tuple[PersonalAccessToken, User] | None: Token and user SQLAlchemy models, or None if the
+            token doesn't exist or has expired.
+    """
+    row = (
+        db.query(PersonalAccessToken, User)
+        .join(User, User.id == PersonalAccessToken.user_id)
+        .filter(PersonalAccessToken.digest == get_token_digest(token))
+        .first()
+    )
+
+    if row is None or (row[0].expires_at is not None and row[0].expires_at <= datetime.utcnow()):
+        return None
+
+    return row[0], row[1]
+
+
+def check_token_scopes(scopes: list[str], request: Request | None) -> None:
+    """Check that the scopes of a token allow a request.
+
+    Args:
+        scopes (list[str]): Scopes of the token.
+        request (Request | None): Request. None when called outside of a request.
+
+    Raises:
+        HTTPException: If the scopes don't allow the request.
+    """
+    if request is None:
+        return
+
+    # /api/<service>/... through the gateway, /<service>/... on the service itself
+    segments = [segment for segment in request.url.path.split("/") if segment]
+    if segments and segments[0] == "api":
+        segments = segments[1:]
+    service = segments[0] if segments else ""
+
+    # A write scope also grants the reads of its service. There are no scopes for the auth
+    # service, so a personal access token can't manage the tokens.
+    allowed = f"{service}:write" in scopes or (
+        request.method in READ_METHODS and f"{service}:read" in scopes
+    )
+    if not allowed:
+        raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail="Not enough permissions")
+
+
+async def record_token_use(token: str, db: Session) -> None:
+    """Record the use of a personal access token, and write the pending uses when due.
+
+    Args:
+        token (str): Personal access token.
+        db (Session): Database session.
+    """
+    token_usage.record(get_token_digest(token))
+
+    if token_usage.due():
+        await run_in_threadpool(token_usage.flush, db)
+
+
+async def get_personal_access_token_principal(token: str, db: Session) -> Principal | None:
+    """Get the principal of a personal access token, cached until the token expires.
+
+    Used by the services and by the gateway, which forwards the identity of the token's user.
+
+    Args:
+        token (str): Personal access token.
+        db (Session): Database session.
+
+    Returns:
+        Principal | None: Principal, with the scopes of the token, or None if the token doesn't
+            exist or has expired.
+    """
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+
+    generation = principal_cache.generation
+    row = await run_in_threadpool(get_personal_access_token, db, token)
+    if row is None:
+        return None
+
+    db_token, user = row
+    principal = Principal(
+        id=user.id, username=user.username, disabled=user.disabled, scopes=db_token.scopes.split()
+    )
+    expiry = (
+        db_token.expires_at.replace(tzinfo=timezone.utc).timestamp()
+        if db_token.expires_at is not None
+        else float("inf")
+    )
+    principal_cache.set(token, principal, expiry, generation)
+
+    return principal
+
+
+async def authenticate_personal_access_token(
+    token: str, db: Session, request: Request | None
+) -> tuple[PersonalAccessToken, User]:
+    """Authenticate a request with a personal access token.
+
+    Args:
+        token (str): Personal access token.
+        db (Session): Database session.
+        request (Request | None): Request, to check the scopes of the token.
+
+    Raises:
+        HTTPException: If the token is invalid or expired, or its scopes don't allow the request.
+
+    Returns:
+        tuple[PersonalAccessToken, User]: Token and user SQLAlchemy models.
+    """
+    row = await run_in_threadpool(get_personal_access_token, db, token)
+    if row is None:
+        raise HTTPException(
+            status_code=HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    check_token_scopes(row[0].scopes.split(), request)
+    await record_token_use(token, db)
+
+    return row
+
+
 #### AUTH SERVICE ###########
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/token")
@@ -92,42 +513,66 @@ def get_user(username: str, db: Session = Depends(db.get_db)):
         return user
 
 
-def authenticate_user(username: str, password: str, db: Session = Depends(db.get_db)):
+async def authenticate_user(username: str, password: str, db: Session = Depends(db.get_db)):
     """Authenticate user.
 
+    The queries run in the threadpool, and the password is verified in the password hashing pool
+    without holding a thread while it waits. The password hash is upgraded if it doesn't use the
+    current scheme and cost.
+
     Args:
         username (str): Username.
         password (str): Password.
         db (Session): DB dependency injection. Defaults to Depends(db.get_db).
 
+    Raises:
+        HTTPException: If the password hashing queue is full.
+
     Returns:
         User: User SQLAlchemy model.
     """
-    user = get_user(username, db)
+    user = await run_in_threadpool(get_user, username, db)
 
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+
+    valid, new_hash = await verify_and_update_password_async(password, user.hashed_password)
+    if not valid:
         return False
+    if new_hash is not None:
+        user.hashed_password = new_hash
+        await run_in_threadpool(db.commit)
     return user
 
 
 async def get_current_user(
+    request: Request,
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(db.get_db),
+    read_db: Session = Depends(db.get_read_db),
 ):
     """Get current user.
 
+    A personal access token records its use, so it is looked up in the primary. The user of an
+    access token is only read, from a replica when there is one.
+
     Args:
-        token (str): JWT token. Defaults to Depends(oauth2_scheme).
+        request (Request): Request, to check the scopes of a personal access token.
+        token (str): JWT token or personal access token. Defaults to Depends(oauth2_scheme).
         db (Session): DB dependency injection. Defaults to Depends(db.get_db).
+        read_db (Session): Read-only DB dependency injection. Defaults to
+            Depends(db.get_read_db).
 
     Raises:
-        HTTPException: If credentials are invalid.
+        HTTPException: If credentials are invalid, or the token scopes don't allow the request.
 
     Returns:
         User: User SQLAlchemy model.
     """
+    if token.startswith(PAT_PREFIX):
+        _, user = await authenticate_personal_access_token(token, db, request)
+        return user
+
     credentials_exception = HTTPException(
         status_code=HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -135,7 +580,7 @@ async def get_current_user(
     )
 
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_access_token(token)
         username: str = payload.get("sub")  # type: ignore
         if username is None:
             raise credentials_exception
@@ -143,7 +588,8 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
 
-    user = get_user(username=token_data.username, db=db)  # type: ignore
+    # The query is synchronous, run it in the threadpool so it does not block the event loop
+    user = await run_in_threadpool(get_user, username=token_data.username, db=read_db)  # type: ignore
     if user is None:
         raise credentials_exception
 
@@ -165,3 +611,252 @@ async def get_current_active_user(current_user: User = Depends(get_current_user)
     if current_user.disabled:  # type: ignore
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
+
+
+async def get_principal_from_token(
+    request: Request, token: str, db: Session, read_db: Session
+) -> Principal:
+    """Get the principal of a JWT token or personal access token, cached until it expires.
+
+    Args:
+        request (Request): Request.
+        token (str): JWT token or personal access token.
+        db (Session): Database session.
+        read_db (Session): Read-only database session.
+
+    Raises:
+        HTTPException: If the credentials are invalid.
+
+    Returns:
+        Principal: Principal.
+    """
+    if token.startswith(PAT_PREFIX):
+        principal = await get_personal_access_token_principal(token, db)
+        if principal is None:
+            raise HTTPException(
+                status_code=HTTP_401_UNAUTHORIZED,
+                detail="Could not validate credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        return principal
+
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+
+    generation = principal_cache.generation
+    user = await get_current_user(request, token, db, read_db)
+    principal = Principal(id=user.id, username=user.username, disabled=user.disabled)
+    # The token was just verified by get_current_user
+    principal_cache.set(token, principal, jwt.get_unverified_claims(token)["exp"], generation)
+
+    return principal
+
+
+async def get_current_principal(
+    request: Request,
+    identity: str
+    | None = Header(default=None, alias=INTERNAL_IDENTITY_HEADER, include_in_schema=False),
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(db.get_db),
+    read_db: Session = Depends(db.get_read_db),
+) -> Principal:
+    """Get the current principal.
+
+    Requests coming through the gateway carry the identity of the user, already verified from the
+    token, so neither the token is decoded nor the user is loaded from the database. Other
+    requests fall back to get_principal_from_token. The scopes of a personal access token are
+    checked either way.
+
+    Args:
+        request (Request): Request, to check the scopes of a personal access token.
+        identity (str | None): Signed identity forwarded by the gateway. Defaults to None.
+        token (str): JWT token or personal access token. Defaults to Depends(oauth2_scheme).
+        db (Session): DB dependency injection. Defaults to Depends(db.get_db).
+        read_db (Session): Read-only DB dependency injection. Defaults to
+            Depends(db.get_read_db).
+
+    Raises:
+        HTTPException: If the identity or the credentials are invalid, or the token scopes don't
+            allow the request.
+
+    Returns:
+        Principal: Current principal.
+    """
+    if identity is not None:
+        principal = verify_internal_identity(identity)
+        if principal is None:
+            raise HTTPException(
+                status_code=HTTP_401_UNAUTHORIZED,
+                detail="Could not validate credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+    else:
+        principal = await get_principal_from_token(request, token, db, read_db)
+
+    if principal.scopes is not None:
+        check_token_scopes(principal.scopes, request)
+        await record_token_use(token, db)
+
+    return principal
+
+
+async def get_current_active_principal(
+    current_principal: Principal = Depends(get_current_principal),
+) -> Principal:
+    """Get current active principal.
+
+    Args:
+        current_principal (Principal): Current principal.
+
+    Raises:
+        HTTPException: If user is inactive.
+
+    Returns:
+        Principal: Current principal.
+    """
+    if current_principal.disabled:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    return current_principal
+
+
+########### REFRESH TOKENS ###########
+
+
+def create_tokens(db: Session, user: User, family_id: str | None = None) -> dict:
+    """Issue an access token and a refresh token for a user.
+
+    Args:
+        db (Session): Database session.
+        user (User): User SQLAlchemy model.
+        family_id (str | None): Family of the refresh token being rotated. Defaults to None, to
+            start a new family on login.
+
+    Returns:
+        dict: Access token, token type and refresh token.
+    """
+    family_id = family_id or uuid.uuid4().hex
+
+    access_token = create_access_token(
+        # The user id and status let the gateway forward the identity without a database lookup
+        data={
+            "sub": user.username,
+            "uid": user.id,
+            "disabled": user.disabled,
+            "jti": uuid.uuid4().hex,
+            "fam": family_id,
+        },
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
+    )
+
+    jti = uuid.uuid4().hex
+    expires_at = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    refresh_token = signing_keys.sign(
+        {"sub": user.username, "jti": jti, "fam": family_id, "typ": "refresh", "exp": expires_at}
+    )
+
+    db.add(RefreshToken(jti=jti, family_id=family_id, user_id=user.id, expires_at=expires_at))
+    db.commit()
+
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+
+def rotate_refresh_token(db: Session, refresh_token: str) -> dict:
+    """Exchange a refresh token for new tokens.
+
+    The refresh token can only be used once. If it is used again, it was stolen (or the client
+    leaked it), and the whole family is revoked, logging out both the attacker and the user.
+
+    Args:
+        db (Session): Database session.
+        refresh_token (str): Refresh token.
+
+    Raises:
+        HTTPException: If the refresh token is invalid, expired, revoked or reused, or its user
+            no longer exists or is inactive.
+
+    Returns:
+        dict: Access token, token type and refresh token.
+    """
+    credentials_exception = HTTPException(
+        status_code=HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+    try:
+        claims = token_verifier.decode(refresh_token)
+    except JWTError:
+        raise credentials_exception
+    if claims.get("typ") != "refresh":
+        raise credentials_exception
+
+    # Locked, so a token used twice concurrently is detected as reused
+    db_token = (
+        db.query(RefreshToken)
+        .filter(RefreshToken.jti == claims.get("jti"))
+        .with_for_update()
+        .first()
+    )
+    if db_token is None or db_token.revoked:
+        raise credentials_exception
+    if db_token.used:
+        revoke_token_family(db, db_token.family_id, db_token.user_id)  # type: ignore
+        raise credentials_exception
+
+    user = db.get(User, db_token.user_id)
+    if user is None or user.disabled:
+        raise credentials_exception
+
+    db_token.used = True  # type: ignore
+    return create_tokens(db, user, db_token.family_id)  # type: ignore
+
+
+def revoke_token_family(db: Session, family_id: str, user_id: int) -> None:
+    """Revoke the refresh tokens of a family and the access tokens issued with them.
+
+    Args:
+        db (Session): Database session.
+        family_id (str): Token family ID.
+        user_id (int): User ID.
+    """
+    db.query(RefreshToken).filter(RefreshToken.family_id == family_id).update({"revoked": True})
+    db.commit()
+
+    # The access tokens issued from now on are from other families, so the family can be
+    # forgotten once the ones issued until now have expired
+    revocation_store.revoke(f"fam:{family_id}", time.time() + ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+    principal_cache.invalidate(user_id)
+
+
+def revoke_user_tokens(db: Session, user_id: int) -> None:
+    """Revoke all the token families of a user, e.g. when the password changes.
+
+    Args:
+        db (Session): Database session.
+        user_id (int): User ID.
+    """
+    family_ids = [
+        family_id
+        for (family_id,) in db.query(RefreshToken.family_id)
+        .filter(RefreshToken.user_id == user_id, RefreshToken.revoked.is_(False))
+        .distinct()
+    ]
+
+    for family_id in family_ids:
+        revoke_token_family(db, family_id, user_id)
+
+
+def revoke_access_token(db: Session, claims: dict) -> None:
+    """Revoke an access token and its token family, to log out.
+
+    Args:
+        db (Session): Database session.
+        claims (dict): Claims of the verified access token.
+    """
+    if "jti" in claims:
+        revocation_store.revoke(claims["jti"], claims["exp"])
+    if "fam" in claims:
+        revoke_token_family(db, claims["fam"], claims["uid"])
+    elif "uid" in claims:
+        principal_cache.invalidate(claims["uid"])
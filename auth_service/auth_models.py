@@ -0,0 +1,44 @@
+"""SQLAlchemy models for auth service.
+
+SQLAlchemy models are used to define the structure of the data that is stored in the database."""
+
+from datetime import datetime
+
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, String
+
+from common_components.database.db import Base
+
+
+class RefreshToken(Base):
+    """Refresh token model.
+
+    Every refresh token can be used once. Using it issues a new one in the same family, so a
+    refresh token used twice means it was stolen and the whole family is revoked."""
+
+    __tablename__ = "refresh_tokens"
+
+    jti = Column(String, primary_key=True)
+    family_id = Column(String, index=True, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    expires_at = Column(DateTime, nullable=False)
+    used = Column(Boolean, default=False, nullable=False)
+    revoked = Column(Boolean, default=False, nullable=False)
+
+
+class PersonalAccessToken(Base):
+    """Personal access token model.
+
+    Only the HMAC digest of the token is stored, indexed, so a token is looked up with one SELECT
+    and a leaked database doesn't leak usable tokens."""
+
+    __tablename__ = "personal_access_tokens"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    name = Column(String, nullable=False)
+    digest = Column(String, unique=True, index=True, nullable=False)
+    # Space separated, as in OAuth2
+    scopes = Column(String, nullable=False, default="")
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=True)
+    last_used_at = Column(DateTime, nullable=True)
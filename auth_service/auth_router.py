@@ -2,45 +2,82 @@
 
 It contains the API routes for authenticating users and creating access tokens."""
 
-from datetime import timedelta
-
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
+from jose import JWTError
 from sqlalchemy.orm import Session
-from starlette.status import HTTP_401_UNAUTHORIZED
+from starlette.status import (
+    HTTP_201_CREATED,
+    HTTP_204_NO_CONTENT,
+    HTTP_401_UNAUTHORIZED,
+    HTTP_404_NOT_FOUND,
+)
 
 import common_components.database.db as db
 from auth_service.auth_crud import (
-    ACCESS_TOKEN_EXPIRE_MINUTES,
     authenticate_user,
-    create_access_token,
+    create_personal_access_token,
+    create_tokens,
+    decode_access_token,
+    delete_personal_access_token,
+    get_current_active_principal,
+    get_personal_access_tokens,
+    oauth2_scheme,
+    revoke_access_token,
+    rotate_refresh_token,
+)
+from auth_service.auth_models import PersonalAccessToken as PersonalAccessTokenModel
+from auth_service.auth_schemas import (
+    PersonalAccessToken,
+    PersonalAccessTokenCreate,
+    PersonalAccessTokenCreated,
+    Principal,
+    RefreshTokenRequest,
+    Token,
 )
-from auth_service.auth_schemas import Token
+from auth_service.login_throttle import login_throttle
+from auth_service.token_keys import JWKS_MIN_REFRESH_INTERVAL, signing_keys
 
 router = APIRouter(tags=["Auth"], prefix="/auth")
 
 
+# Async, so a login waiting for the password hashing pool doesn't hold a thread of the threadpool
 @router.post("/token", response_model=Token)
-def login_for_access_token(
-    db: Session = Depends(db.get_db), form_data: OAuth2PasswordRequestForm = Depends()
+async def login_for_access_token(
+    request: Request,
+    db: Session = Depends(db.get_db),
+    form_data: OAuth2PasswordRequestForm = Depends(),
 ):
     """Login for access token.
 
     Args:
+        request (Request): Request, to get the client IP.
         db (Session, optional): Database session. Defaults to Depends(db.get_db).
         form_data (OAuth2PasswordRequestForm, optional): Form data. Defaults to Depends().
 
     Raises:
-        HTTPException: If user is not authenticated.
+        HTTPException: If user is not authenticated, or too many logins failed.
 
     Returns:
-        Token: Access token.
+        Token: Access token and refresh token.
     """
-    user = authenticate_user(
-        form_data.username.lower(),
-        form_data.password,
-        db,
-    )
+    username = form_data.username.lower()
+    ip = request.client.host if request.client else None
+
+    # Before the user is loaded and the password hashed, counted as a failure until it succeeds.
+    # The throttle may query Redis.
+    attempt = await run_in_threadpool(login_throttle.attempt, username, ip)
+
+    try:
+        user = await authenticate_user(
+            username,
+            form_data.password,
+            db,
+        )
+    except Exception:
+        await run_in_threadpool(login_throttle.cancel, username, ip, attempt)
+        raise
 
     if not user:
         raise HTTPException(
@@ -49,9 +86,136 @@ def login_for_access_token(
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+    await run_in_threadpool(login_throttle.record_success, username, ip, attempt)
+    return await run_in_threadpool(create_tokens, db, user)
+
+
+@router.post("/refresh", response_model=Token)
+def refresh_access_token(request: RefreshTokenRequest, db: Session = Depends(db.get_db)):
+    """Exchange a refresh token for a new access token and refresh token.
+
+    Args:
+        request (RefreshTokenRequest): Refresh token.
+        db (Session, optional): Database session. Defaults to Depends(db.get_db).
+
+    Raises:
+        HTTPException: If the refresh token is invalid, expired, revoked or reused.
+
+    Returns:
+        Token: Access token and refresh token.
+    """
+    return rotate_refresh_token(db, request.refresh_token)
+
+
+@router.post("/logout", status_code=HTTP_204_NO_CONTENT)
+def logout(token: str = Depends(oauth2_scheme), db: Session = Depends(db.get_db)):
+    """Revoke the access token and the refresh tokens of its session.
+
+    Args:
+        token (str): JWT token. Defaults to Depends(oauth2_scheme).
+        db (Session, optional): Database session. Defaults to Depends(db.get_db).
+
+    Raises:
+        HTTPException: If the access token is invalid.
+    """
+    try:
+        claims = decode_access_token(token)
+    except JWTError:
+        raise HTTPException(
+            status_code=HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    revoke_access_token(db, claims)
+
+
+@router.get("/.well-known/jwks.json")
+def get_jwks(response: Response) -> dict:
+    """Get the public keys verifying the access tokens.
+
+    Args:
+        response (Response): Response, to set its cache headers.
+
+    Returns:
+        dict: JSON Web Key Set.
+    """
+    # A new key must reach the verifiers before it becomes active, so keep the caching short
+    response.headers["Cache-Control"] = f"public, max-age={int(JWKS_MIN_REFRESH_INTERVAL)}"
+
+    return signing_keys.jwks()
+
+
+#### PERSONAL ACCESS TOKENS ####
+def to_personal_access_token(db_token: PersonalAccessTokenModel) -> dict:
+    return {
+        "id": db_token.id,
+        "name": db_token.name,
+        "scopes": db_token.scopes.split(),
+        "created_at": db_token.created_at,
+        "expires_at": db_token.expires_at,
+        "last_used_at": db_token.last_used_at,
+    }
+
+
+@router.post("/tokens", status_code=HTTP_201_CREATED, response_model=PersonalAccessTokenCreated)
+def create_token(
+    token: PersonalAccessTokenCreate,
+    db: Session = Depends(db.get_db),
+    current_user: Principal = Depends(get_current_active_principal),
+):
+    """Create a personal access token for a machine client.
+
+    Args:
+        token (PersonalAccessTokenCreate): Token name, scopes and lifetime.
+        db (Session, optional): Database session. Defaults to Depends(db.get_db).
+        current_user (Principal, optional): Current user. Defaults to Depends(get_current_active_principal).
+
+    Returns:
+        PersonalAccessTokenCreated: Token data, with the token itself, which can't be shown again.
+    """
+    db_token, secret = create_personal_access_token(
+        db, current_user.id, token.name, token.scopes, token.expires_in_days  # type: ignore
     )
 
-    return {"access_token": access_token, "token_type": "bearer"}
+    return {**to_personal_access_token(db_token), "token": secret}
+
+
+@router.get("/tokens", response_model=list[PersonalAccessToken])
+def read_tokens(
+    db: Session = Depends(db.get_read_db),
+    current_user: Principal = Depends(get_current_active_principal),
+):
+    """Get the personal access tokens of the current user.
+
+    Args:
+        db (Session, optional): Database session. Defaults to Depends(db.get_read_db).
+        current_user (Principal, optional): Current user. Defaults to Depends(get_current_active_principal).
+
+    Returns:
+        list[PersonalAccessToken]: Tokens data, without the tokens themselves.
+    """
+    return [
+        to_personal_access_token(db_token)
+        for db_token in get_personal_access_tokens(db, current_user.id)
+    ]
+
+
+@router.delete("/tokens/{token_id}", status_code=HTTP_204_NO_CONTENT)
+def delete_token(
+    token_id: int,
+    db: Session = Depends(db.get_db),
+    current_user: Principal = Depends(get_current_active_principal),
+) -> None:
+    """Revoke a personal access token.
+
+    Args:
+        token_id (int): Token ID.
+        db (Session, optional): Database session. Defaults to Depends(db.get_db).
+        current_user (Principal, optional): Current user. Defaults to Depends(get_current_active_principal).
+
+    Raises:
+        HTTPException: If the current user has no such token.
+    """
+    if not delete_personal_access_token(db, current_user.id, token_id):
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Token not found")
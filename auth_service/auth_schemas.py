@@ -2,7 +2,10 @@
 
 The schemas are used to define the structure of the data that is sent between the services."""
 
-from pydantic import BaseModel
+from datetime import datetime
+from typing import Literal
+
+from pydantic import BaseModel, Field
 
 
 class Token(BaseModel):
@@ -10,9 +13,60 @@ class Token(BaseModel):
 
     access_token: str
     token_type: str
+    refresh_token: str | None = None
+
+
+class RefreshTokenRequest(BaseModel):
+    """Refresh token request schema."""
+
+    refresh_token: str
 
 
 class TokenData(BaseModel):
     """Token data schema."""
 
     username: str | None = None
+
+
+class Principal(BaseModel):
+    """Principal schema. The authenticated user, without loading it from the database."""
+
+    id: int
+    username: str
+    disabled: bool = False
+    # Scopes of a personal access token, None for the user's own session
+    scopes: list[str] | None = None
+
+
+class PersonalAccessTokenCreate(BaseModel):
+    """Personal access token schema. Used to validate the input data when creating a token."""
+
+    name: str
+    scopes: list[
+        Literal[
+            "users:read",
+            "users:write",
+            "tasks:read",
+            "tasks:write",
+            "projects:read",
+            "projects:write",
+        ]
+    ]
+    expires_in_days: int | None = Field(default=None, gt=0)
+
+
+class PersonalAccessToken(BaseModel):
+    """Personal access token schema. Used to return the token data, without the token itself."""
+
+    id: int
+    name: str
+    scopes: list[str]
+    created_at: datetime
+    expires_at: datetime | None = None
+    last_used_at: datetime | None = None
+
+
+class PersonalAccessTokenCreated(PersonalAccessToken):
+    """Created personal access token schema. The token is only returned once, on creation."""
+
+    token: str
@@ -0,0 +1,395 @@
+"""Throttling of the failed logins.
+
+Every login attempt costs a bcrypt verification, so credential stuffing and password guessing are
+as much a CPU attack as a security one. The failed logins are counted per username and per client
+IP over a sliding window of LOGIN_THROTTLE_WINDOW seconds, and checked before the user is loaded
+or the password hashed. Each attempt is counted as a failure when it starts, atomically with the
+check, so attempts sent in parallel see each other instead of all passing the check before any of
+them fails:
+
+- After LOGIN_THROTTLE_{USERNAME,IP}_FREE_FAILURES failures, each attempt must wait a delay since
+  the last failure, starting at LOGIN_THROTTLE_BASE_DELAY seconds and doubling with every failure
+  up to LOGIN_THROTTLE_MAX_DELAY.
+- After LOGIN_THROTTLE_{USERNAME,IP}_LOCKOUT failures, the username or IP is locked out until the
+  oldest failure leaves the window.
+
+Throttled attempts get a 429 with a Retry-After header, and are not counted. A successful login
+clears the failures of the username, not the ones of the IP, so an attacker can't reset its counter
+with its own account. The attempt itself is not counted against the IP.
+
+The failures live in memory, bounded to LOGIN_THROTTLE_MAX_KEYS usernames and IPs, the least
+recently failed being evicted first. With several auth service replicas, LOGIN_THROTTLE_REDIS_URL
+moves them to Redis (requires the redis package), so the counters are shared. If Redis can't be
+reached the logins are let through."""
+
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from fastapi import HTTPException
+from starlette.status import HTTP_429_TOO_MANY_REQUESTS
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - optional dependency
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+LOGIN_THROTTLE_ENABLED = os.getenv("LOGIN_THROTTLE_ENABLED", "true").lower() == "true"
+LOGIN_THROTTLE_WINDOW = float(os.getenv("LOGIN_THROTTLE_WINDOW", "900"))
+LOGIN_THROTTLE_BASE_DELAY = float(os.getenv("LOGIN_THROTTLE_BASE_DELAY", "1"))
+LOGIN_THROTTLE_MAX_DELAY = float(os.getenv("LOGIN_THROTTLE_MAX_DELAY", "60"))
+LOGIN_THROTTLE_USERNAME_FREE_FAILURES = int(
+    os.getenv("LOGIN_THROTTLE_USERNAME_FREE_FAILURES", "3")
+)
+LOGIN_THROTTLE_USERNAME_LOCKOUT = int(os.getenv("LOGIN_THROTTLE_USERNAME_LOCKOUT", "10"))
+LOGIN_THROTTLE_IP_FREE_FAILURES = int(os.getenv("LOGIN_THROTTLE_IP_FREE_FAILURES", "10"))
+LOGIN_THROTTLE_IP_LOCKOUT = int(os.getenv("LOGIN_THROTTLE_IP_LOCKOUT", "100"))
+LOGIN_THROTTLE_MAX_KEYS = int(os.getenv("LOGIN_THROTTLE_MAX_KEYS", "100000"))
+LOGIN_THROTTLE_REDIS_URL = os.getenv("LOGIN_THROTTLE_REDIS_URL", "")
+
+
+class Policy:
+    """Free failures and lockout threshold of a kind of key."""
+
+    def __init__(self, free_failures: int, lockout: int) -> None:
+        self.free_failures = free_failures
+        self.lockout = lockout
+
+
+class MemoryStore:
+    """Failure timestamps per key, in memory."""
+
+    def __init__(self, window: float, max_keys: int = LOGIN_THROTTLE_MAX_KEYS) -> None:
+        self.window = window
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        self.clear()
+
+    def failures(self, key: str, now: float) -> list[float]:
+        """Get the failures of a key within the window.
+
+        Args:
+            key (str): Username or IP key.
+            now (float): Current time.
+
+        Returns:
+            list[float]: Failure timestamps, oldest first.
+        """
+        with self.lock:
+            failures = self.entries.get(key)
+            if failures is None:
+                return []
+
+            while failures and failures[0] <= now - self.window:
+                failures.popleft()
+            if not failures:
+                del self.entries[key]
+
+            return list(failures)
+
+    def reserve(self, key: str, now: float, max_failures: int) -> list[float]:
+        """Record a failure, and get the failures recorded before it.
+
+        Args:
+            key (str): Username or IP key.
+            now (float): Current time.
+            max_failures (int): Failures to keep, the older ones no longer matter.
+
+        Returns:
+            list[float]: Failure timestamps within the window before this one, oldest first.
+        """
+        with self.lock:
+            failures = self.entries.pop(key, None)
+            if failures is None:
+                # One more than needed, so releasing a failure doesn't lose an older one
+                failures = deque(maxlen=max_failures + 1)
+
+            while failures and failures[0] <= now - self.window:
+                failures.popleft()
+            previous = list(failures)
+
+            failures.append(now)
+            self.entries[key] = failures
+
+            while len(self.entries) > self.max_keys:
+                self.entries.popitem(last=False)
+
+            return previous
+
+    def release(self, key: str, now: float) -> None:
+        """Remove a failure recorded by reserve.
+
+        Args:
+            key (str): Username or IP key.
+            now (float): Time of the failure.
+        """
+        with self.lock:
+            failures = self.entries.get(key)
+            if failures is None or now not in failures:
+                return
+
+            failures.remove(now)
+            if not failures:
+                del self.entries[key]
+
+    def delete(self, key: str) -> None:
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries: OrderedDict[str, deque[float]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class RedisStore:
+    """Failure timestamps per key, shared by every auth service replica through Redis."""
+
+    def __init__(self, url: str, window: float, prefix: str = "login_throttle:") -> None:
+        if redis is None:
+            raise RuntimeError(
+                "LOGIN_THROTTLE_REDIS_URL is set, but the redis package is not installed"
+            )
+
+        self.client = redis.from_url(url)
+        self.window = window
+        self.prefix = prefix
+
+    def failures(self, key: str, now: float) -> list[float]:
+        """Get the failures of a key within the window.
+
+        Args:
+            key (str): Username or IP key.
+            now (float): Current time.
+
+        Returns:
+            list[float]: Failure timestamps, oldest first.
+        """
+        return [
+            float(failure)
+            for failure in self.client.zrangebyscore(self.prefix + key, now - self.window, "+inf")
+        ]
+
+    def reserve(self, key: str, now: float, max_failures: int) -> list[float]:
+        """Record a failure, and get the failures recorded before it.
+
+        The commands run in a MULTI/EXEC transaction, so the replicas see each other's failures.
+
+        Args:
+            key (str): Username or IP key.
+            now (float): Current time.
+            max_failures (int): Failures to keep, the older ones no longer matter.
+
+        Returns:
+            list[float]: Failure timestamps within the window before this one, oldest first.
+        """
+        pipeline = self.client.pipeline(transaction=True)
+        pipeline.zremrangebyscore(self.prefix + key, "-inf", now - self.window)
+        pipeline.zrange(self.prefix + key, 0, -1, withscores=True)
+        pipeline.zadd(self.prefix + key, {repr(now): now})
+        # One more than needed, so releasing a failure doesn't lose an older one
+        pipeline.zremrangebyrank(self.prefix + key, 0, -max_failures - 2)
+        pipeline.expire(self.prefix + key, math.ceil(self.window))
+        _, failures, *_ = pipeline.execute()
+
+        return [score for _, score in failures]
+
+    def release(self, key: str, now: float) -> None:
+        """Remove a failure recorded by reserve.
+
+        Args:
+            key (str): Username or IP key.
+            now (float): Time of the failure.
+        """
+        self.client.zrem(self.prefix + key, repr(now))
+
+    def delete(self, key: str) -> None:
+        self.client.delete(self.prefix + key)
+
+    def clear(self) -> None:
+        """Failures in Redis expire on their own, there is nothing to clear locally."""
+
+    def __len__(self) -> int:
+        return 0
+
+
+class LoginThrottle:
+    """Sliding window failed login counters per username and per IP."""
+
+    def __init__(
+        self,
+        store: MemoryStore | RedisStore | None = None,
+        window: float = LOGIN_THROTTLE_WINDOW,
+        base_delay: float = LOGIN_THROTTLE_BASE_DELAY,
+        max_delay: float = LOGIN_THROTTLE_MAX_DELAY,
+        username: Policy = Policy(
+            LOGIN_THROTTLE_USERNAME_FREE_FAILURES, LOGIN_THROTTLE_USERNAME_LOCKOUT
+        ),
+        ip: Policy = Policy(LOGIN_THROTTLE_IP_FREE_FAILURES, LOGIN_THROTTLE_IP_LOCKOUT),
+        enabled: bool = LOGIN_THROTTLE_ENABLED,
+    ) -> None:
+        if store is None:
+            store = (
+                RedisStore(LOGIN_THROTTLE_REDIS_URL, window)
+                if LOGIN_THROTTLE_REDIS_URL
+                else MemoryStore(window)
+            )
+
+        self.store = store
+        self.window = window
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.policies = {"username": username, "ip": ip}
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self) -> None:
+        """Remove every failure and reset the counters."""
+        self.store.clear()
+        self.throttled = 0
+        self.locked_out = 0
+        self.errors = 0
+
+    @staticmethod
+    def keys(username: str, ip: str | None) -> dict[str, str]:
+        return {"username": f"username:{username.lower()}", "ip": f"ip:{ip or 'unknown'}"}
+
+    def retry_after(self, failures: list[float], policy: Policy, now: float) -> float:
+        """Get how long a key must wait before its next attempt.
+
+        Args:
+            failures (list[float]): Failure timestamps within the window, oldest first.
+            policy (Policy): Policy of the key.
+            now (float): Current time.
+
+        Returns:
+            float: Seconds to wait, 0 or less if the attempt is allowed.
+        """
+        if len(failures) >= policy.lockout:
+            # Locked out until enough failures leave the window
+            return failures[-policy.lockout] + self.window - now
+        if len(failures) > policy.free_failures:
+            delay = min(
+                self.base_delay * 2 ** (len(failures) - policy.free_failures - 1), self.max_delay
+            )
+            return failures[-1] + delay - now
+        return 0
+
+    def attempt(self, username: str, ip: str | None) -> float | None:
+        """Count a login attempt as a failure, before any password is verified.
+
+        The check and the count are atomic per key, so concurrent attempts are throttled as if
+        they had failed one after the other.
+
+        Args:
+            username (str): Username of the attempt.
+            ip (str | None): Client IP of the attempt.
+
+        Raises:
+            HTTPException: If the username or the IP must wait before another attempt.
+
+        Returns:
+            float | None: Time of the attempt, to pass to record_success or cancel, or None if it
+                was not counted.
+        """
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        retry_after = 0.0
+        locked_out = False
+        keys = self.keys(username, ip)
+
+        try:
+            for kind, key in keys.items():
+                policy = self.policies[kind]
+                failures = self.store.reserve(key, now, policy.lockout)
+                retry_after = max(retry_after, self.retry_after(failures, policy, now))
+                locked_out = locked_out or len(failures) >= policy.lockout
+
+            if retry_after > 0:
+                # No password is verified, a throttled attempt is not a failure
+                for key in keys.values():
+                    self.store.release(key, now)
+        except Exception:
+            # Don't turn an outage of the shared backend into an outage of the logins
+            logger.exception("Login throttle backend failed, letting the login through")
+            self.errors += 1
+            return None
+
+        if retry_after > 0:
+            self.throttled += 1
+            self.locked_out += locked_out
+            raise HTTPException(
+                status_code=HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many failed login attempts",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+        return now
+
+    def record_success(self, username: str, ip: str | None, attempt: float | None) -> None:
+        """Clear the failures of a username after a successful login.
+
+        Args:
+            username (str): Username of the login.
+            ip (str | None): Client IP of the login.
+            attempt (float | None): Time of the attempt, returned by attempt.
+        """
+        if not self.enabled:
+            return
+
+        keys = self.keys(username, ip)
+        try:
+            self.store.delete(keys["username"])
+            if attempt is not None:
+                self.store.release(keys["ip"], attempt)
+        except Exception:
+            logger.exception("Login throttle backend failed, the failures are not cleared")
+            self.errors += 1
+
+    def cancel(self, username: str, ip: str | None, attempt: float | None) -> None:
+        """Stop counting an attempt that ended before the password was verified, e.g. when the
+        password hashing queue is full.
+
+        Args:
+            username (str): Username of the attempt.
+            ip (str | None): Client IP of the attempt.
+            attempt (float | None): Time of the attempt, returned by attempt.
+        """
+        if not self.enabled or attempt is None:
+            return
+
+        try:
+            for key in self.keys(username, ip).values():
+                self.store.release(key, attempt)
+        except Exception:
+            logger.exception("Login throttle backend failed, the attempt is still counted")
+            self.errors += 1
+
+    def stats(self) -> dict:
+        """Get the login throttling statistics.
+
+        Returns:
+            dict: Settings, tracked keys, throttled and locked out attempts, and backend errors.
+        """
+        return {
+            "enabled": self.enabled,
+            "backend": type(self.store).__name__,
+            "window": self.window,
+            "tracked_keys": len(self.store),
+            "throttled": self.throttled,
+            "locked_out": self.locked_out,
+            "backend_errors": self.errors,
+        }
+
+
+# Throttle shared by the login routes of the process
+login_throttle = LoginThrottle()
@@ -0,0 +1,292 @@
+"""Password hashing worker pool.
+
+bcrypt costs hundreds of milliseconds of CPU per hash. Running it in the threadpool shared with
+every sync route would let a burst of logins starve all the other requests (and the GIL), so the
+hashes are computed in a dedicated pool of PASSWORD_HASHING_WORKERS processes. The login and
+registration routes are async and await the hashes with run_async, so a queued hash doesn't hold
+a thread of the threadpool either while it waits.
+
+At most PASSWORD_HASHING_MAX_QUEUE hashes wait for a free worker. Beyond that, the request is
+rejected with a 429 right away instead of queueing for seconds. Queue depth and hash latency are
+exposed by stats().
+
+New hashes use PASSWORD_HASHING_SCHEME (bcrypt or argon2) with the configured cost. Hashes made
+with another scheme or cost are still verified, and reported as needing an update so they can be
+upgraded on the next login.
+
+This module is imported by every worker process, so it must not import the database or the
+services."""
+
+import asyncio
+import importlib.util
+import logging
+import math
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+from starlette.status import HTTP_429_TOO_MANY_REQUESTS
+
+from common_components.metrics import percentile
+
+PASSWORD_HASHING_WORKERS = int(os.getenv("PASSWORD_HASHING_WORKERS", str(os.cpu_count() or 2)))
+PASSWORD_HASHING_MAX_QUEUE = int(os.getenv("PASSWORD_HASHING_MAX_QUEUE", "32"))
+PASSWORD_HASHING_SCHEME = os.getenv("PASSWORD_HASHING_SCHEME", "bcrypt")
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536"))  # KiB
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "1"))
+
+# argon2 is optional, it needs the argon2-cffi backend
+ARGON2_AVAILABLE = importlib.util.find_spec("argon2") is not None
+
+logger = logging.getLogger(__name__)
+
+
+def make_context(
+    scheme: str = PASSWORD_HASHING_SCHEME,
+    bcrypt_rounds: int = BCRYPT_ROUNDS,
+    argon2_time_cost: int = ARGON2_TIME_COST,
+    argon2_memory_cost: int = ARGON2_MEMORY_COST,
+    argon2_parallelism: int = ARGON2_PARALLELISM,
+) -> CryptContext:
+    """Make the context hashing the passwords.
+
+    Both schemes are always verified. The hashes that don't use the given scheme and cost, whether
+    weaker or stronger, need an update.
+
+    Args:
+        scheme (str): Scheme of the new hashes, bcrypt or argon2.
+        bcrypt_rounds (int): bcrypt cost, as a log2 of the number of rounds.
+        argon2_time_cost (int): argon2 number of iterations.
+        argon2_memory_cost (int): argon2 memory, in KiB.
+        argon2_parallelism (int): argon2 number of lanes.
+
+    Raises:
+        ValueError: If the scheme is unknown.
+
+    Returns:
+        CryptContext: Password hashing context.
+    """
+    if scheme not in ("bcrypt", "argon2"):
+        raise ValueError(f"Unknown password hashing scheme {scheme}")
+    if scheme == "argon2" and not ARGON2_AVAILABLE:
+        logger.warning("argon2-cffi is not installed, hashing the passwords with bcrypt")
+        scheme = "bcrypt"
+
+    return CryptContext(
+        schemes=["bcrypt", "argon2"],
+        default=scheme,
+        deprecated="auto",
+        bcrypt__default_rounds=bcrypt_rounds,
+        bcrypt__min_rounds=bcrypt_rounds,
+        bcrypt__max_rounds=bcrypt_rounds,
+        argon2__time_cost=argon2_time_cost,
+        argon2__memory_cost=argon2_memory_cost,
+        argon2__parallelism=argon2_parallelism,
+    )
+
+
+pwd_context = make_context()
+
+
+def _hash(password: str) -> tuple[str, float]:
+    started = time.perf_counter()
+    return pwd_context.hash(password), time.perf_counter() - started
+
+
+def _verify(password: str, hashed_password: str) -> tuple[bool, float]:
+    started = time.perf_counter()
+    return pwd_context.verify(password, hashed_password), time.perf_counter() - started
+
+
+def _verify_and_update(
+    password: str, hashed_password: str
+) -> tuple[tuple[bool, str | None], float]:
+    started = time.perf_counter()
+    return pwd_context.verify_and_update(password, hashed_password), time.perf_counter() - started
+
+
+class PasswordHasher:
+    """Bounded process pool computing the password hashes."""
+
+    def __init__(
+        self, workers: int = PASSWORD_HASHING_WORKERS, max_queue: int = PASSWORD_HASHING_MAX_QUEUE
+    ) -> None:
+        self.workers = workers
+        self.max_queue = max_queue
+        self.executor: ProcessPoolExecutor | None = None
+        self.lock = threading.Lock()
+
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.hash_latencies: deque[float] = deque(maxlen=1000)
+        self.wait_times: deque[float] = deque(maxlen=1000)
+
+    def submit(self, function, *args) -> Future:
+        """Queue a hashing function in the pool.
+
+        Args:
+            function: Hashing function.
+            *args: Arguments of the function.
+
+        Raises:
+            HTTPException: If the queue is full.
+
+        Returns:
+            Future: Future of the result and hash latency of the function. Its place in the queue
+                is released once it is done.
+        """
+        with self.lock:
+            if self.pending >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Too many requests",
+                    headers={"Retry-After": str(self.retry_after())},
+                )
+            self.pending += 1
+
+            if self.executor is None:
+                # Spawned workers don't inherit the threads and connections of the service
+                self.executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            executor = self.executor
+
+        try:
+            future = executor.submit(function, *args)
+        except Exception:
+            with self.lock:
+                self.pending -= 1
+            raise
+
+        # Released when the worker is done, not when the caller stops waiting (e.g. a client that
+        # disconnected), so the queue never holds more hashes than it allows
+        started = time.perf_counter()
+        future.add_done_callback(lambda future: self.complete(started, future))
+        return future
+
+    def complete(self, started: float, future: Future) -> None:
+        """Release the place of a hash in the queue, and record its latency.
+
+        Args:
+            started (float): When the hash was queued.
+            future (Future): Future of the hash, done.
+        """
+        hash_latency = None
+        if not future.cancelled() and future.exception() is None:
+            _, hash_latency = future.result()
+
+        with self.lock:
+            self.pending -= 1
+            if hash_latency is None:
+                return
+
+            self.completed += 1
+            self.hash_latencies.append(hash_latency)
+            self.wait_times.append(max(time.perf_counter() - started - hash_latency, 0.0))
+
+    def run(self, function, *args):
+        """Run a hashing function in the pool and wait for its result.
+
+        The calling thread is blocked until the hash is done, so the routes use run_async.
+
+        Args:
+            function: Hashing function.
+            *args: Arguments of the function.
+
+        Raises:
+            HTTPException: If the queue is full.
+
+        Returns:
+            Any: Result of the function.
+        """
+        result, _ = self.submit(function, *args).result()
+        return result
+
+    async def run_async(self, function, *args):
+        """Run a hashing function in the pool and await its result, without holding a thread.
+
+        Args:
+            function: Hashing function.
+            *args: Arguments of the function.
+
+        Raises:
+            HTTPException: If the queue is full.
+
+        Returns:
+            Any: Result of the function.
+        """
+        result, _ = await asyncio.wrap_future(self.submit(function, *args))
+        return result
+
+    def hash(self, password: str) -> str:
+        return self.run(_hash, password)
+
+    def verify(self, password: str, hashed_password: str) -> bool:
+        return self.run(_verify, password, hashed_password)
+
+    def verify_and_update(self, password: str, hashed_password: str) -> tuple[bool, str | None]:
+        return self.run(_verify_and_update, password, hashed_password)
+
+    async def hash_async(self, password: str) -> str:
+        return await self.run_async(_hash, password)
+
+    async def verify_async(self, password: str, hashed_password: str) -> bool:
+        return await self.run_async(_verify, password, hashed_password)
+
+    async def verify_and_update_async(
+        self, password: str, hashed_password: str
+    ) -> tuple[bool, str | None]:
+        return await self.run_async(_verify_and_update, password, hashed_password)
+
+    def retry_after(self) -> int:
+        """Estimate when the queue will have room again.
+
+        Returns:
+            int: Seconds.
+        """
+        latency = sum(self.hash_latencies) / len(self.hash_latencies) if self.hash_latencies else 1
+        return max(math.ceil(latency * self.pending / self.workers), 1)
+
+    def stats(self) -> dict:
+        """Get the pool statistics.
+
+        Returns:
+            dict: Pool size, queue depth, counters and hash and queue wait latencies.
+        """
+        hash_latencies = list(self.hash_latencies)
+        wait_times = list(self.wait_times)
+
+        return {
+            "workers": self.workers,
+            "scheme": pwd_context.default_scheme(),
+            "max_queue": self.max_queue,
+            "in_flight": min(self.pending, self.workers),
+            "queued": max(self.pending - self.workers, 0),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "hash_latency_p50_ms": percentile(hash_latencies, 50),
+            "hash_latency_p99_ms": percentile(hash_latencies, 99),
+            "queue_wait_p50_ms": percentile(wait_times, 50),
+            "queue_wait_p99_ms": percentile(wait_times, 99),
+        }
+
+    def shutdown(self) -> None:
+        """Stop the worker processes. They are started again on the next hash."""
+        with self.lock:
+            executor, self.executor = self.executor, None
+
+        if executor is not None:
+            executor.shutdown()
+
+
+# Pool shared by the routes of the process
+password_hasher = PasswordHasher()
@@ -0,0 +1,111 @@
+"""Cache of the authenticated principals.
+
+A token is reused for every request of a user during its whole lifetime, so verifying it and
+loading its user from the database on every request is wasted work. The principal resolved from a
+token is cached, keyed by a digest of the token, until the token expires or for at most
+PRINCIPAL_CACHE_TTL seconds. The cache is bounded in entries, evicting the least recently used
+ones first.
+
+Any change of a user that affects its principal (username, password, status or deletion) must
+invalidate its entries, see users_crud. Invalidations only apply to the current process, so the
+TTL bounds how long other processes may keep a stale principal."""
+
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+from auth_service.auth_schemas import Principal
+
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
+
+
+class PrincipalCache:
+    """TTL and LRU cache of principals, keyed by token digest and indexed by user id."""
+
+    def __init__(
+        self, ttl: float = PRINCIPAL_CACHE_TTL, max_entries: int = PRINCIPAL_CACHE_MAX_ENTRIES
+    ) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clear()
+
+    def clear(self) -> None:
+        """Remove all the entries."""
+        self.entries: OrderedDict[str, tuple[Principal, float]] = OrderedDict()
+        self.keys_by_user: dict[int, set[str]] = {}
+        # Incremented on every invalidation, to discard principals that were being resolved
+        self.generation = 0
+
+    @staticmethod
+    def key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> Principal | None:
+        """Get the cached principal of a token.
+
+        Args:
+            token (str): Access token.
+
+        Returns:
+            Principal | None: Principal, or None if missing or expired.
+        """
+        key = self.key(token)
+        entry = self.entries.get(key)
+
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            self._remove(key)
+            return None
+
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def set(self, token: str, principal: Principal, token_expiry: float, generation: int) -> None:
+        """Cache the principal of a token.
+
+        Args:
+            token (str): Access token.
+            principal (Principal): Principal resolved from the token.
+            token_expiry (float): Expiry of the token, as a UNIX timestamp.
+            generation (int): Generation read before resolving the principal. The principal is
+                not cached if an invalidation happened since then.
+        """
+        ttl = min(self.ttl, token_expiry - time.time())
+        if ttl <= 0 or generation != self.generation:
+            return
+
+        key = self.key(token)
+        if key in self.entries:
+            self._remove(key)
+
+        self.entries[key] = (principal, time.monotonic() + ttl)
+        self.keys_by_user.setdefault(principal.id, set()).add(key)
+
+        while len(self.entries) > self.max_entries:
+            self._remove(next(iter(self.entries)))
+
+    def invalidate(self, user_id: int) -> None:
+        """Remove the cached principals of a user.
+
+        Args:
+            user_id (int): User ID.
+        """
+        self.generation += 1
+
+        for key in list(self.keys_by_user.get(user_id, ())):
+            self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        principal, _ = self.entries.pop(key)
+
+        keys = self.keys_by_user[principal.id]
+        keys.discard(key)
+        if not keys:
+            del self.keys_by_user[principal.id]
+
+
+# Cache shared by the routes of the process
+principal_cache = PrincipalCache()
@@ -0,0 +1,152 @@
+"""Store of the revoked tokens.
+
+A revoked token must be rejected until it expires, and can be forgotten afterwards. The ids of the
+revoked tokens (jti) and token families are kept in sets bucketed by expiry time, REVOCATION_BUCKET
+seconds wide, and a whole bucket is dropped once all its tokens have expired. Memory is bounded by
+the number of tokens revoked during the lifetime of a token, with no per-entry expiry bookkeeping.
+
+Nearly all the checks are for tokens that are not revoked. A Bloom filter in front of the buckets
+answers those with a few bit lookups, and only its false positives (REVOCATION_BLOOM_ERROR_RATE)
+and the revoked tokens go through the buckets. The filter is rebuilt from the remaining ids when
+a bucket is dropped, since a Bloom filter can't forget an entry.
+
+Revocations only apply to the current process. Refresh tokens are also revoked in the database,
+so the access tokens of a revoked session stay valid in other processes until they expire."""
+
+import hashlib
+import math
+import os
+import threading
+import time
+
+REVOCATION_BUCKET = int(os.getenv("REVOCATION_BUCKET", "300"))
+REVOCATION_BLOOM_FILTER = os.getenv("REVOCATION_BLOOM_FILTER", "true").lower() == "true"
+REVOCATION_BLOOM_CAPACITY = int(os.getenv("REVOCATION_BLOOM_CAPACITY", "100000"))
+REVOCATION_BLOOM_ERROR_RATE = float(os.getenv("REVOCATION_BLOOM_ERROR_RATE", "0.01"))
+
+
+class BloomFilter:
+    """Bloom filter of strings, sized for a capacity and a false positive rate."""
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str) -> list[int]:
+        # Double hashing: the k positions are derived from two 64 bits hashes
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:], "big")
+
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item)
+        )
+
+
+class RevocationStore:
+    """Revoked ids, bucketed by expiry time, with an optional Bloom filter in front."""
+
+    def __init__(
+        self,
+        bucket: int = REVOCATION_BUCKET,
+        bloom_filter: bool = REVOCATION_BLOOM_FILTER,
+        bloom_capacity: int = REVOCATION_BLOOM_CAPACITY,
+        bloom_error_rate: float = REVOCATION_BLOOM_ERROR_RATE,
+    ) -> None:
+        self.bucket = bucket
+        self.bloom_filter = bloom_filter
+        self.bloom_capacity = bloom_capacity
+        self.bloom_error_rate = bloom_error_rate
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self) -> None:
+        """Remove all the revocations."""
+        # Buckets indexed by the end of their time range, divided by the bucket width
+        self.buckets: dict[int, set[str]] = {}
+        self.oldest_bucket = math.inf
+        self.bloom = (
+            BloomFilter(self.bloom_capacity, self.bloom_error_rate) if self.bloom_filter else None
+        )
+        self.bloom_skips = 0
+        self.bloom_false_positives = 0
+
+    def revoke(self, item: str, expires_at: float) -> None:
+        """Revoke an id until its token expires.
+
+        Args:
+            item (str): Token or token family id.
+            expires_at (float): Expiry of the token, as a UNIX timestamp.
+        """
+        if expires_at <= time.time():
+            return
+
+        with self.lock:
+            bucket = math.ceil(expires_at / self.bucket)
+            self.buckets.setdefault(bucket, set()).add(item)
+            self.oldest_bucket = min(self.oldest_bucket, bucket)
+            if self.bloom is not None:
+                self.bloom.add(item)
+
+    def is_revoked(self, item: str) -> bool:
+        """Check whether an id is revoked.
+
+        Args:
+            item (str): Token or token family id.
+
+        Returns:
+            bool: True if the id is revoked and its token has not expired.
+        """
+        self.expire()
+
+        if self.bloom is not None and item not in self.bloom:
+            self.bloom_skips += 1
+            return False
+
+        revoked = any(item in items for items in list(self.buckets.values()))
+        if self.bloom is not None and not revoked:
+            self.bloom_false_positives += 1
+
+        return revoked
+
+    def expire(self) -> None:
+        """Drop the buckets whose tokens have all expired."""
+        current = int(time.time() // self.bucket)
+        if self.oldest_bucket > current:
+            return
+
+        with self.lock:
+            for bucket in [bucket for bucket in self.buckets if bucket <= current]:
+                del self.buckets[bucket]
+            self.oldest_bucket = min(self.buckets, default=math.inf)
+
+            if self.bloom is not None:
+                self.bloom = BloomFilter(self.bloom_capacity, self.bloom_error_rate)
+                for items in self.buckets.values():
+                    for item in items:
+                        self.bloom.add(item)
+
+    def stats(self) -> dict:
+        """Get the store statistics.
+
+        Returns:
+            dict: Number of buckets and revoked ids, and Bloom filter counters.
+        """
+        return {
+            "buckets": len(self.buckets),
+            "revoked": sum(len(items) for items in self.buckets.values()),
+            "bloom_filter": self.bloom is not None,
+            "bloom_skips": self.bloom_skips,
+            "bloom_false_positives": self.bloom_false_positives,
+        }
+
+
+# Store shared by the routes of the process
+revocation_store = RevocationStore()
@@ -0,0 +1,233 @@
+"""Keys of the access tokens.
+
+The access tokens are signed by the auth service with an RSA private key, and verified by the
+other services with the public keys only, published as a JSON Web Key Set (JWKS). No secret is
+shared between the services.
+
+The private keys are read from JWT_KEYS_DIR, one <kid>.pem file per key. Tokens are signed with the
+JWT_ACTIVE_KID key (the last kid in sorted order by default) and carry its kid in their header.
+To rotate the keys, add a new key, make it active once the verifiers have had time to fetch it, and
+remove the old one when the tokens it signed have expired. Without JWT_KEYS_DIR, an ephemeral key
+is generated, which only suits a single process (e.g. development and tests).
+
+The verifier of a service gets the public keys from the auth service at JWKS_URL, or from the
+local signing keys when JWKS_URL is not set, and keeps them parsed in memory. The key set is
+refreshed in the background every JWKS_REFRESH_INTERVAL seconds, and right away when a token has an
+unknown kid, at most every JWKS_MIN_REFRESH_INTERVAL seconds so forged kids can't be used to flood
+the auth service."""
+
+import logging
+import os
+import threading
+import time
+import uuid
+from collections.abc import Callable
+from pathlib import Path
+
+import httpx
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import JWTError, jwk, jwt
+from jose.backends.base import Key
+
+JWT_ALGORITHM = "RS256"
+JWT_KEYS_DIR = os.getenv("JWT_KEYS_DIR")
+JWT_ACTIVE_KID = os.getenv("JWT_ACTIVE_KID")
+JWKS_URL = os.getenv("JWKS_URL")
+JWKS_REFRESH_INTERVAL = float(os.getenv("JWKS_REFRESH_INTERVAL", "300"))
+JWKS_MIN_REFRESH_INTERVAL = float(os.getenv("JWKS_MIN_REFRESH_INTERVAL", "30"))
+JWKS_TIMEOUT = float(os.getenv("JWKS_TIMEOUT", "5"))
+
+logger = logging.getLogger(__name__)
+
+
+def generate_private_key() -> str:
+    """Generate an RSA private key.
+
+    Returns:
+        str: Private key, in PEM format.
+    """
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+    return private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+
+
+class SigningKeys:
+    """Private keys of the auth service, indexed by kid. They are loaded on first use."""
+
+    def __init__(
+        self, keys_dir: str | None = JWT_KEYS_DIR, active_kid: str | None = JWT_ACTIVE_KID
+    ) -> None:
+        self.keys_dir = keys_dir
+        self.active_kid = active_kid
+        self.keys: dict[str, Key] | None = None
+        self.lock = threading.Lock()
+
+    def load(self) -> dict[str, Key]:
+        """Load the private keys.
+
+        Raises:
+            ValueError: If the active kid has no key.
+
+        Returns:
+            dict[str, Key]: Private keys, indexed by kid.
+        """
+        with self.lock:
+            if self.keys is not None:
+                return self.keys
+
+            if self.keys_dir:
+                pems = {path.stem: path.read_text() for path in Path(self.keys_dir).glob("*.pem")}
+            else:
+                logger.warning("JWT_KEYS_DIR is not set, signing the tokens with an ephemeral key")
+                pems = {uuid.uuid4().hex: generate_private_key()}
+
+            if self.active_kid is None and pems:
+                self.active_kid = sorted(pems)[-1]
+            if self.active_kid not in pems:
+                raise ValueError(f"No signing key for kid {self.active_kid}")
+
+            self.keys = {kid: jwk.construct(pem, JWT_ALGORITHM) for kid, pem in pems.items()}
+            return self.keys
+
+    def sign(self, claims: dict) -> str:
+        """Sign a token with the active key.
+
+        Args:
+            claims (dict): Token claims.
+
+        Returns:
+            str: JWT token.
+        """
+        keys = self.load()
+
+        return jwt.encode(
+            claims,
+            keys[self.active_kid],
+            algorithm=JWT_ALGORITHM,
+            headers={"kid": self.active_kid},
+        )
+
+    def jwks(self) -> dict:
+        """Get the public keys.
+
+        Returns:
+            dict: JSON Web Key Set.
+        """
+        return {
+            "keys": [
+                {**key.public_key().to_dict(), "kid": kid, "use": "sig"}
+                for kid, key in self.load().items()
+            ]
+        }
+
+
+def fetch_jwks(url: str) -> dict:
+    """Fetch a JSON Web Key Set.
+
+    Args:
+        url (str): URL of the key set.
+
+    Raises:
+        httpx.HTTPError: If the key set can't be fetched.
+
+    Returns:
+        dict: JSON Web Key Set.
+    """
+    response = httpx.get(url, timeout=JWKS_TIMEOUT)
+    response.raise_for_status()
+
+    return response.json()
+
+
+class TokenVerifier:
+    """Verifier of the access tokens, caching the parsed public keys by kid."""
+
+    def __init__(
+        self,
+        get_jwks: Callable[[], dict],
+        refresh_interval: float = JWKS_REFRESH_INTERVAL,
+        min_refresh_interval: float = JWKS_MIN_REFRESH_INTERVAL,
+    ) -> None:
+        self.get_jwks = get_jwks
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+        self.keys: dict[str, Key] = {}
+        self.refreshed_at = float("-inf")
+        self.refreshes = 0
+        self.lock = threading.Lock()
+
+    def refresh(self) -> None:
+        """Fetch and parse the public keys. The current keys are kept if the fetch fails."""
+        with self.lock:
+            try:
+                jwks = self.get_jwks()
+                self.keys = {
+                    key["kid"]: jwk.construct(key, key.get("alg", JWT_ALGORITHM))
+                    for key in jwks["keys"]
+                }
+            except Exception:
+                logger.exception("Could not refresh the token verification keys")
+            finally:
+                self.refreshed_at = time.monotonic()
+                self.refreshes += 1
+
+    def get_key(self, kid: str) -> Key | None:
+        """Get the public key of a kid.
+
+        Args:
+            kid (str): Key ID.
+
+        Returns:
+            Key | None: Public key, or None if unknown.
+        """
+        age = time.monotonic() - self.refreshed_at
+
+        if kid in self.keys:
+            # Known keys are refreshed in the background, so the requests don't wait for it
+            if age > self.refresh_interval and not self.lock.locked():
+                threading.Thread(target=self.refresh, daemon=True).start()
+            return self.keys[kid]
+
+        if age > self.min_refresh_interval:
+            self.refresh()
+
+        return self.keys.get(kid)
+
+    def decode(self, token: str) -> dict:
+        """Decode and verify a token.
+
+        Args:
+            token (str): JWT token.
+
+        Raises:
+            JWTError: If the token is invalid, expired or signed with an unknown key.
+
+        Returns:
+            dict: Token claims.
+        """
+        kid = jwt.get_unverified_header(token).get("kid")
+        key = self.get_key(kid) if isinstance(kid, str) else None
+        if key is None:
+            raise JWTError("Unknown signing key")
+
+        return jwt.decode(token, key, algorithms=[JWT_ALGORITHM])
+
+    def stats(self) -> dict:
+        """Get the verifier statistics.
+
+        Returns:
+            dict: Cached kids and number of refreshes of the key set.
+        """
+        return {"kids": sorted(self.keys), "refreshes": self.refreshes}
+
+
+# Keys and verifier shared by the routes of the process
+signing_keys = SigningKeys()
+token_verifier = TokenVerifier(
+    (lambda: fetch_jwks(JWKS_URL)) if JWKS_URL else signing_keys.jwks  # type: ignore[arg-type]
+)
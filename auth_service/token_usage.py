@@ -0,0 +1,74 @@
+"""Last use of the personal access tokens.
+
+Machine clients send a request every few seconds with the same token, so writing its last use on
+every request would turn every read into a write. The uses are recorded in memory, keyed by token
+digest, and written to the database in one batched UPDATE at most every
+PAT_LAST_USED_FLUSH_INTERVAL seconds, by the first request authenticated with a token after the
+interval has elapsed. last_used_at is therefore up to that interval late, and the uses recorded
+since the last flush are lost if the process stops."""
+
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import bindparam
+from sqlalchemy.orm import Session
+
+from auth_service.auth_models import PersonalAccessToken
+
+PAT_LAST_USED_FLUSH_INTERVAL = float(os.getenv("PAT_LAST_USED_FLUSH_INTERVAL", "60"))
+
+
+class TokenUsage:
+    """Last use of the tokens, waiting to be written to the database."""
+
+    def __init__(self, flush_interval: float = PAT_LAST_USED_FLUSH_INTERVAL) -> None:
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self) -> None:
+        """Forget the uses not written yet."""
+        self.pending: dict[str, datetime] = {}
+        self.flushed_at = time.monotonic()
+        self.flushes = 0
+
+    def record(self, digest: str) -> None:
+        """Record the use of a token.
+
+        Args:
+            digest (str): Digest of the token.
+        """
+        with self.lock:
+            self.pending[digest] = datetime.utcnow()
+
+    def due(self) -> bool:
+        return bool(self.pending) and time.monotonic() - self.flushed_at >= self.flush_interval
+
+    def flush(self, db: Session) -> None:
+        """Write the last use of the tokens, in one batched UPDATE.
+
+        Args:
+            db (Session): Database session.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.flushed_at = time.monotonic()
+
+        if not pending:
+            return
+
+        table = PersonalAccessToken.__table__
+        db.execute(
+            table.update()
+            .where(table.c.digest == bindparam("token_digest"))
+            .values(last_used_at=bindparam("used_at")),
+            [{"token_digest": digest, "used_at": used_at} for digest, used_at in pending.items()],
+        )
+        db.commit()
+        self.flushes += 1
+
+
+# Uses shared by the routes of the process
+token_usage = TokenUsage()
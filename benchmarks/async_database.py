@@ -0,0 +1,148 @@
+"""Load test of the threadpool database layer against the async one.
+
+The same route, listing the tasks of a user with their nested subtasks, is served twice:
+
+- sync: a def route, run in the anyio threadpool, with get_db and tasks_crud.
+- async: an async def route, run on the event loop, with get_async_db and tasks_async_crud.
+
+The requests are sent in-process to both applications, against the database configured in
+common_components.database.settings, and the throughput and latency percentiles are reported for
+each concurrency. The sync design is capped by the threadpool size (40 threads by default) and the
+pool size of the engine, so compare the two at concurrencies above them as well. When all the
+threads wait for a connection, the connections of the finished requests can't be released (that
+also needs a thread) until the checkouts time out, which shows up as errors.
+
+Usage:
+    python -m benchmarks.async_database --requests 1000 --concurrency 1 10 50 100
+"""
+
+import argparse
+import asyncio
+import time
+
+import httpx
+from fastapi import Depends, FastAPI
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+import projects_service.projects_models  # noqa: F401 - every model must be mapped
+import tasks_service.tasks_async_crud as tasks_async_crud
+import tasks_service.tasks_crud as tasks_crud
+from auth_service.auth_crud import get_user
+from common_components.database.db import SessionLocal, async_engine, get_async_db, get_db
+from common_components.metrics import percentile
+from tasks_service.tasks_schemas import Task, TaskCreateModify
+from users_service.users_crud import create_user
+from users_service.users_schemas import UserInDB
+
+BENCHMARK_USER = UserInDB(
+    username="benchmark",
+    email="benchmark@example.com",
+    hashed_password="Benchmark1!",
+)
+BENCHMARK_TASKS = 10
+
+sync_app = FastAPI()
+async_app = FastAPI()
+
+
+@sync_app.get("/tasks/{owner_id}", response_model=list[Task])
+def read_tasks_sync(owner_id: int, db: Session = Depends(get_db)):
+    return tasks_crud.get_all_own_tasks(db, owner_id=owner_id)
+
+
+@async_app.get("/tasks/{owner_id}", response_model=list[Task])
+async def read_tasks_async(owner_id: int, db: AsyncSession = Depends(get_async_db)):
+    return await tasks_async_crud.get_all_own_tasks(db, owner_id=owner_id)
+
+
+def get_benchmark_user_id() -> int:
+    """Create the benchmark user and its tasks, each with a subtask, if needed.
+
+    Returns:
+        int: ID of the benchmark user.
+    """
+    with SessionLocal() as db:
+        db_user = get_user(BENCHMARK_USER.username, db)
+        if db_user is None:
+            db_user = create_user(db, BENCHMARK_USER)
+            for number in range(BENCHMARK_TASKS):
+                db_task = tasks_crud.create_task(
+                    db, TaskCreateModify(title=f"Task {number}"), user_id=db_user.id
+                )
+                tasks_crud.create_task(
+                    db,
+                    TaskCreateModify(title=f"Subtask {number}", parent_id=db_task.id),
+                    user_id=db_user.id,
+                )
+
+        return db_user.id
+
+
+async def run(app: FastAPI, user_id: int, requests: int, concurrency: int) -> dict:
+    """Send requests to the tasks route of an application.
+
+    Args:
+        app (FastAPI): Sync or async application.
+        user_id (int): ID of the benchmark user.
+        requests (int): Number of requests.
+        concurrency (int): Number of requests in flight at the same time.
+
+    Returns:
+        dict: Throughput, latency percentiles in milliseconds, and failed requests.
+    """
+    remaining = iter(range(requests))
+    latencies: list[float] = []
+    errors = 0
+
+    # Errors, e.g. pool checkout timeouts, are counted as 500 responses instead of aborting the run
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app, raise_app_exceptions=False),
+        base_url="http://benchmark",
+    ) as client:
+
+        async def worker() -> None:
+            nonlocal errors
+            for _ in remaining:
+                started = time.perf_counter()
+                response = await client.get(f"/tasks/{user_id}")
+                latencies.append(time.perf_counter() - started)
+                errors += response.is_error
+
+        # Connect once before the load: the first connection initializes the dialect under a
+        # thread lock, which concurrent first checkouts on the event loop would deadlock on
+        async with async_engine.connect():
+            pass
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    # The pooled async connections belong to the event loop closed by asyncio.run
+    await async_engine.dispose()
+
+    return {
+        "concurrency": concurrency,
+        "requests_per_second": round(requests / elapsed, 1),
+        "latency_p50_ms": percentile(latencies, 50),
+        "latency_p99_ms": percentile(latencies, 99),
+        "errors": errors,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50, 100])
+    args = parser.parse_args()
+
+    user_id = get_benchmark_user_id()
+
+    for concurrency in args.concurrency:
+        for design, app in (("threadpool", sync_app), ("async", async_app)):
+            result = asyncio.run(run(app, user_id, args.requests, concurrency))
+            print({"design": design, **result})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Load test of the event loop lag of the gateway under concurrent GET /api/users/me traffic.
+
+A ticker task sleeps for a fixed interval on the event loop of the application and records how
+late it wakes up. Any synchronous work done on the loop (e.g. a database query in an async
+dependency) delays the ticker, so the lag should stay flat when the concurrency grows.
+
+The requests are sent in-process to the gateway application, against the database configured in
+common_components.database.settings. The token has no user id claim, so the services resolve the
+user from the database through get_current_user, which is the path being measured.
+
+Usage:
+    python -m benchmarks.event_loop_lag --requests 500 --concurrency 1 10 50
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+from api_gateway_service.api_gateway import app
+from api_gateway_service.rate_limiter import rate_limiter
+from auth_service.auth_crud import create_access_token, get_user
+from common_components.database.db import SessionLocal
+from users_service.users_crud import create_user
+from users_service.users_schemas import UserInDB
+
+BENCHMARK_USER = UserInDB(
+    username="benchmark",
+    email="benchmark@example.com",
+    hashed_password="Benchmark1!",
+)
+TICK_INTERVAL = 0.005
+
+
+def get_benchmark_token() -> str:
+    """Create the benchmark user if needed and get a token for it.
+
+    Returns:
+        str: Access token.
+    """
+    with SessionLocal() as db:
+        if get_user(BENCHMARK_USER.username, db) is None:
+            create_user(db, BENCHMARK_USER)
+
+    return create_access_token({"sub": BENCHMARK_USER.username})
+
+
+async def measure_lag(stop: asyncio.Event, lags: list[float]) -> None:
+    """Record how late the event loop wakes up a sleeping task.
+
+    Args:
+        stop (asyncio.Event): Event set when the load test is over.
+        lags (list[float]): List where the lags are appended, in seconds.
+    """
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK_INTERVAL)
+        lags.append(time.perf_counter() - started - TICK_INTERVAL)
+
+
+async def run(token: str, requests: int, concurrency: int) -> dict:
+    """Send requests to GET /api/users/me while measuring the event loop lag.
+
+    Args:
+        token (str): Access token.
+        requests (int): Number of requests.
+        concurrency (int): Number of requests in flight at the same time.
+
+    Returns:
+        dict: Throughput and lag percentiles, in milliseconds.
+    """
+    headers = {"Authorization": f"Bearer {token}", "Cache-Control": "no-cache"}
+    remaining = iter(range(requests))
+    lags: list[float] = []
+    stop = asyncio.Event()
+
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://gateway"
+    ) as client:
+
+        async def worker() -> None:
+            for _ in remaining:
+                response = await client.get("/api/users/me", headers=headers)
+                response.raise_for_status()
+
+        ticker = asyncio.create_task(measure_lag(stop, lags))
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await ticker
+
+    lags.sort()
+    return {
+        "concurrency": concurrency,
+        "requests_per_second": round(requests / elapsed, 1),
+        "lag_p50_ms": round(statistics.median(lags) * 1000, 2),
+        "lag_p99_ms": round(lags[int(len(lags) * 0.99)] * 1000, 2),
+        "lag_max_ms": round(lags[-1] * 1000, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    args = parser.parse_args()
+
+    # Measure the application, not the protections in front of it
+    rate_limiter.enabled = False
+    token = get_benchmark_token()
+
+    for concurrency in args.concurrency:
+        print(asyncio.run(run(token, args.requests, concurrency)))
+
+
+if __name__ == "__main__":
+    main()
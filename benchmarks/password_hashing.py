@@ -0,0 +1,107 @@
+"""Throughput of the password hashing settings, to size the auth service.
+
+Each setting hashes passwords in a pool of worker processes, one per core, like the password
+hashing pool of the service. The throughput per core gives the number of logins per second a core
+can sustain, and the latency the time a login spends hashing.
+
+Usage:
+    python -m benchmarks.password_hashing --bcrypt-rounds 10 11 12 13 --argon2 3,65536,1
+"""
+
+import argparse
+import multiprocessing
+import os
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from auth_service.password_hashing import ARGON2_AVAILABLE, make_context
+
+PASSWORD = "Benchmark1!"
+
+
+def hash_passwords(settings: dict, hashes: int) -> list[float]:
+    """Hash a password repeatedly.
+
+    Args:
+        settings (dict): Arguments of make_context.
+        hashes (int): Number of hashes.
+
+    Returns:
+        list[float]: Latency of each hash, in seconds.
+    """
+    context = make_context(**settings)
+    latencies = []
+
+    for _ in range(hashes):
+        started = time.perf_counter()
+        context.hash(PASSWORD)
+        latencies.append(time.perf_counter() - started)
+
+    return latencies
+
+
+def run(settings: dict, workers: int, hashes: int) -> dict:
+    """Measure the throughput of a setting.
+
+    Args:
+        settings (dict): Arguments of make_context.
+        workers (int): Number of worker processes.
+        hashes (int): Number of hashes per worker.
+
+    Returns:
+        dict: Throughput in hashes per second, and latency percentiles in milliseconds.
+    """
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        # Warm up the workers, so the process start up isn't measured
+        list(pool.map(hash_passwords, [settings] * workers, [1] * workers))
+
+        started = time.perf_counter()
+        results = list(pool.map(hash_passwords, [settings] * workers, [hashes] * workers))
+        elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for result in results for latency in result)
+    return {
+        **settings,
+        "workers": workers,
+        "hashes_per_second": round(len(latencies) / elapsed, 1),
+        "hashes_per_second_per_core": round(len(latencies) / elapsed / workers, 1),
+        "latency_p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "latency_p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--hashes", type=int, default=20, help="Hashes per worker")
+    parser.add_argument("--bcrypt-rounds", type=int, nargs="*", default=[10, 11, 12, 13])
+    parser.add_argument(
+        "--argon2",
+        nargs="*",
+        default=["2,19456,1", "3,65536,1"],
+        metavar="TIME,MEMORY_KIB,PARALLELISM",
+    )
+    args = parser.parse_args()
+
+    settings = [{"scheme": "bcrypt", "bcrypt_rounds": rounds} for rounds in args.bcrypt_rounds]
+    if ARGON2_AVAILABLE:
+        for argon2 in args.argon2:
+            time_cost, memory_cost, parallelism = (int(value) for value in argon2.split(","))
+            settings.append(
+                {
+                    "scheme": "argon2",
+                    "argon2_time_cost": time_cost,
+                    "argon2_memory_cost": memory_cost,
+                    "argon2_parallelism": parallelism,
+                }
+            )
+    elif args.argon2:
+        print("argon2-cffi is not installed, skipping the argon2 settings")
+
+    for setting in settings:
+        print(run(setting, args.workers, args.hashes))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,110 @@
-from sqlalchemy import create_engine
+from fastapi import Request
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 from common_components.database import settings
+from common_components.database.pool import InstrumentedQueuePool
+from common_components.database.replicas import get_client_key, replica_router
 
 DATABASE_USERNAME = settings.DATABASE_USERNAME
 DATABASE_PASSWORD = settings.DATABASE_PASSWORD
 DATABASE_HOST = settings.DATABASE_HOST
 DATABASE_NAME = settings.DATABASE_NAME
 
-engine = create_engine(settings.DATABASE_URL)
+engine = create_engine(
+    settings.DATABASE_URL,
+    poolclass=InstrumentedQueuePool,
+    pool_size=settings.DATABASE_POOL_SIZE,
+    max_overflow=settings.DATABASE_MAX_OVERFLOW,
+    pool_timeout=settings.DATABASE_POOL_TIMEOUT,
+    pool_recycle=settings.DATABASE_POOL_RECYCLE,
+    # Check the connections before using them, so the ones dropped by the server are replaced
+    pool_pre_ping=settings.DATABASE_POOL_PRE_PING,
+    # Runaway queries are cancelled by the server instead of holding a connection forever
+    connect_args={"options": f"-c statement_timeout={settings.DATABASE_STATEMENT_TIMEOUT}"},
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Async engine (asyncpg) for the async routes, with its own pool and the same settings. The
+# sessions don't expire the objects on commit, since an expired attribute can't be lazily
+# reloaded in async code.
+async_engine = create_async_engine(
+    settings.ASYNC_DATABASE_URL,
+    pool_size=settings.DATABASE_POOL_SIZE,
+    max_overflow=settings.DATABASE_MAX_OVERFLOW,
+    pool_timeout=settings.DATABASE_POOL_TIMEOUT,
+    pool_recycle=settings.DATABASE_POOL_RECYCLE,
+    pool_pre_ping=settings.DATABASE_POOL_PRE_PING,
+    connect_args={
+        "server_settings": {"statement_timeout": str(settings.DATABASE_STATEMENT_TIMEOUT)}
+    },
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 
+# The reads of a client go to the primary for a while after it wrote (see replicas), so the primary
+# sessions record the commits that wrote something, per client
+@event.listens_for(SessionLocal, "after_flush")
+def _mark_flush_write(session, flush_context) -> None:
+    session.info["wrote"] = True
+
+
+@event.listens_for(SessionLocal, "do_orm_execute")
+def _mark_statement_write(orm_execute_state) -> None:
+    # Bulk statements, e.g. db.execute(update(...)), are not flushed
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["wrote"] = True
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _record_write(session) -> None:
+    if session.info.pop("wrote", False) and session.info.get("client_key"):
+        replica_router.record_write(session.info["client_key"])
+
+
 # Dependency
-def get_db():
+def get_db(request: Request):
     # Independent database session for each request
-    db = SessionLocal()
+    db = SessionLocal(info={"client_key": get_client_key(request)})
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_read_db(request: Request):
+    # Session for the read-only routes, bound to a replica unless the client wrote recently or
+    # every replica lags, in which case it is bound to the primary
+    engine = replica_router.choose(get_client_key(request))
+    db = SessionLocal() if engine is None else SessionLocal(bind=engine)
     try:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    # Independent async database session for each request
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def get_pool_stats() -> dict:
+    """Get the statistics of the connection pool of the process.
+
+    Returns:
+        dict: Pool size, checked out and idle connections, checkout counters and wait times.
+    """
+    return engine.pool.stats()  # type: ignore[attr-defined]
+
+
+def get_replica_stats() -> dict:
+    """Get the statistics of the routing of the reads to the replicas.
+
+    Returns:
+        dict: Lag of each replica, reads per destination and replicas skipped.
+    """
+    return replica_router.stats()
@@ -1,5 +1,5 @@
 """Declares the many-to-many relationship between different models."""
-from sqlalchemy import Column, ForeignKey, Integer, Table
+from sqlalchemy import Column, ForeignKey, Index, Integer, Table
 
 from common_components.database.db import Base
 
@@ -7,6 +7,8 @@ ProjectCollaborators = Table(
     "project_collaborators",
     Base.metadata,
     Column("id", Integer, primary_key=True),
-    Column("project_id", Integer, ForeignKey("projects.id")),
+    Column("project_id", Integer, ForeignKey("projects.id"), index=True),
     Column("user_id", Integer, ForeignKey("users.id")),
+    # A user collaborates once on a project, and the collaborated projects are looked up by user
+    Index("ix_project_collaborators_user_id_project_id", "user_id", "project_id", unique=True),
 )
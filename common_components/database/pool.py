@@ -0,0 +1,83 @@
+"""Instrumented connection pool.
+
+A request waiting for a database connection is invisible until it fails with a QueuePool timeout.
+The pool records how long each checkout waited (including opening a new connection when the pool
+grows) and how many checkouts failed or timed out, so an exhausted pool shows up in the
+statistics before it shows up as errors."""
+
+import threading
+import time
+from collections import deque
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+from common_components.metrics import percentile
+
+
+class PoolMetrics:
+    """Checkout counters and recent wait times of a pool."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.wait_times: deque[float] = deque(maxlen=1000)
+
+    def record_checkout(self, wait_time: float) -> None:
+        with self.lock:
+            self.checkouts += 1
+            self.wait_times.append(wait_time)
+
+    def record_failure(self, timeout: bool) -> None:
+        with self.lock:
+            self.failures += 1
+            self.timeouts += timeout
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool recording the checkout wait times and failures."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception as error:
+            self.metrics.record_failure(isinstance(error, PoolTimeoutError))
+            raise
+
+        self.metrics.record_checkout(time.perf_counter() - started)
+        return connection
+
+    def recreate(self) -> "InstrumentedQueuePool":
+        # Keep the metrics when the engine is disposed
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+    def stats(self) -> dict:
+        """Get the pool statistics.
+
+        Returns:
+            dict: Pool size, checked out and idle connections, checkout counters and wait times.
+        """
+        wait_times = list(self.metrics.wait_times)
+
+        return {
+            "size": self.size(),
+            "max_overflow": self._max_overflow,
+            "timeout": self.timeout(),
+            "checked_out": self.checkedout(),
+            "idle": self.checkedin(),
+            "overflow": max(self.overflow(), 0),
+            "checkouts": self.metrics.checkouts,
+            "checkout_failures": self.metrics.failures,
+            "checkout_timeouts": self.metrics.timeouts,
+            "wait_p50_ms": percentile(wait_times, 50),
+            "wait_p99_ms": percentile(wait_times, 99),
+        }
@@ -0,0 +1,289 @@
+"""Routing of the reads to the read replicas.
+
+The read-only routes get their session from get_read_db, bound to a replica instead of the
+primary. Two things would make a replica return stale data, so the primary is used instead:
+
+- Replication lag. The lag of each replica is checked every DATABASE_REPLICA_LAG_CHECK_INTERVAL
+  seconds, in a background thread started by the first request choosing it after the interval
+  has elapsed, and the replicas lagging more than DATABASE_REPLICA_MAX_LAG seconds, or that can't
+  be reached, are skipped. The requests only read the last known lag, they never wait for a
+  replica that is down, and the connections to the replicas time out after
+  DATABASE_REPLICA_CONNECT_TIMEOUT seconds.
+- Read-your-writes. A client that just wrote to the primary must see its own writes. The commits
+  of the primary sessions are recorded per client, and the reads of a client go to the primary
+  for DATABASE_READ_YOUR_WRITES_WINDOW seconds after its last write.
+
+The client is the subject of its access token, read without verifying the token: the key only
+decides where the reads of the request go, the token is verified by the routes as usual. The
+recent writes are kept in memory, bounded to REPLICA_ROUTER_MAX_CLIENTS clients, so with several
+replicas of a service a client may read from another process before the replica caught up."""
+
+import hashlib
+import itertools
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import Request
+from jose import JWTError, jwt
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+
+from common_components.database import settings
+from common_components.database.pool import InstrumentedQueuePool
+
+logger = logging.getLogger(__name__)
+
+REPLICA_ROUTER_MAX_CLIENTS = 100000
+
+# Seconds since the last replayed transaction, 0 when everything received has been replayed (an
+# idle primary sends nothing to replay) or when the server is not a replica
+REPLICATION_LAG_QUERY = text(
+    """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+    """
+)
+
+
+def create_replica_engine(url: str) -> Engine:
+    """Create the engine of a replica, with the pool settings of the primary.
+
+    Args:
+        url (str): Database URL of the replica.
+
+    Returns:
+        Engine: SQLAlchemy engine, whose transactions are read-only.
+    """
+    return create_engine(
+        url,
+        poolclass=InstrumentedQueuePool,
+        pool_size=settings.DATABASE_POOL_SIZE,
+        max_overflow=settings.DATABASE_MAX_OVERFLOW,
+        pool_timeout=settings.DATABASE_POOL_TIMEOUT,
+        pool_recycle=settings.DATABASE_POOL_RECYCLE,
+        pool_pre_ping=settings.DATABASE_POOL_PRE_PING,
+        # A write sent to a replica session fails, instead of only failing on a real replica
+        connect_args={
+            "options": f"-c statement_timeout={settings.DATABASE_STATEMENT_TIMEOUT}"
+            " -c default_transaction_read_only=on",
+            "connect_timeout": settings.DATABASE_REPLICA_CONNECT_TIMEOUT,
+        },
+    )
+
+
+def get_client_key(request: Request) -> str | None:
+    """Get the key of the client of a request, to route its reads after its writes.
+
+    Args:
+        request (Request): Request.
+
+    Returns:
+        str | None: Subject of the access token, a digest of a personal access token, or None if
+            the request is not authenticated.
+    """
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+
+    try:
+        subject = jwt.get_unverified_claims(token).get("sub")
+    except JWTError:
+        subject = None
+
+    if subject is None:
+        # Personal access tokens are not JWTs
+        return "token:" + hashlib.sha256(token.encode()).hexdigest()
+
+    return f"user:{subject}"
+
+
+class Replica:
+    """Read replica and its last known replication lag."""
+
+    def __init__(self, engine: Engine) -> None:
+        self.engine = engine
+        # None when the lag is unknown, e.g. the replica can't be reached
+        self.lag: float | None = None
+        self.checked_at = -math.inf
+        self.lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self.engine.url.host or str(self.engine.url)
+
+    def check_lag(self) -> float | None:
+        """Measure the replication lag of the replica.
+
+        Returns:
+            float | None: Lag in seconds, or None if the replica can't be reached.
+        """
+        try:
+            with self.engine.connect() as connection:
+                lag = connection.execute(REPLICATION_LAG_QUERY).scalar()
+        except Exception:
+            logger.warning("Read replica %s can't be reached, skipping it", self.name)
+            lag = None
+
+        self.lag = float(lag) if lag is not None else None
+        self.checked_at = time.monotonic()
+
+        return self.lag
+
+
+class ReplicaRouter:
+    """Chooses the engine of the reads: a replica, or the primary (None)."""
+
+    def __init__(
+        self,
+        replicas: list[Replica],
+        max_lag: float = settings.DATABASE_REPLICA_MAX_LAG,
+        lag_check_interval: float = settings.DATABASE_REPLICA_LAG_CHECK_INTERVAL,
+        read_your_writes_window: float = settings.DATABASE_READ_YOUR_WRITES_WINDOW,
+        max_clients: int = REPLICA_ROUTER_MAX_CLIENTS,
+    ) -> None:
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self.read_your_writes_window = read_your_writes_window
+        self.max_clients = max_clients
+        self.lock = threading.Lock()
+        self.next_replica = itertools.count()
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget the recent writes and reset the counters."""
+        with self.lock:
+            self.writes: OrderedDict[str, float] = OrderedDict()
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self.recent_write_reads = 0
+        self.lagging_skips = 0
+
+    def record_write(self, client_key: str) -> None:
+        """Record that a client wrote to the primary.
+
+        Args:
+            client_key (str): Key of the client.
+        """
+        with self.lock:
+            self.writes.pop(client_key, None)
+            self.writes[client_key] = time.monotonic()
+
+            while len(self.writes) > self.max_clients:
+                self.writes.popitem(last=False)
+
+    def wrote_recently(self, client_key: str | None) -> bool:
+        """Check whether a client wrote to the primary within the read-your-writes window.
+
+        Args:
+            client_key (str | None): Key of the client.
+
+        Returns:
+            bool: True if the reads of the client must go to the primary.
+        """
+        if client_key is None:
+            return False
+
+        written_at = self.writes.get(client_key)
+        return written_at is not None and (
+            time.monotonic() - written_at < self.read_your_writes_window
+        )
+
+    def is_available(self, replica: Replica) -> bool:
+        """Check whether a replica can serve reads, from its last known lag.
+
+        If the lag is due, it is measured in the background and the request doesn't wait for it.
+
+        Args:
+            replica (Replica): Replica.
+
+        Returns:
+            bool: True if the replica can be reached and doesn't lag too much.
+        """
+        due = time.monotonic() - replica.checked_at >= self.lag_check_interval
+        # A single thread checks the lag, the requests use the last known one meanwhile
+        if due and replica.lock.acquire(blocking=False):
+            threading.Thread(
+                target=self.refresh_lag,
+                args=(replica,),
+                name=f"replica-lag-{replica.name}",
+                daemon=True,
+            ).start()
+
+        return replica.lag is not None and replica.lag <= self.max_lag
+
+    @staticmethod
+    def refresh_lag(replica: Replica) -> None:
+        """Measure the lag of a replica whose lock is held, and release the lock.
+
+        Args:
+            replica (Replica): Replica.
+        """
+        try:
+            replica.check_lag()
+        finally:
+            replica.lock.release()
+
+    def check_lags(self) -> None:
+        """Measure the lag of every replica now, e.g. before the first requests."""
+        for replica in self.replicas:
+            with replica.lock:
+                replica.check_lag()
+
+    def choose(self, client_key: str | None) -> Engine | None:
+        """Choose the engine of the reads of a request.
+
+        Args:
+            client_key (str | None): Key of the client of the request.
+
+        Returns:
+            Engine | None: Engine of an available replica, or None to read from the primary.
+        """
+        if not self.replicas:
+            self.primary_reads += 1
+            return None
+
+        if self.wrote_recently(client_key):
+            self.recent_write_reads += 1
+            self.primary_reads += 1
+            return None
+
+        # Round robin, starting from the next replica
+        start = next(self.next_replica)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            if self.is_available(replica):
+                self.replica_reads += 1
+                return replica.engine
+            self.lagging_skips += 1
+
+        self.primary_reads += 1
+        return None
+
+    def stats(self) -> dict:
+        """Get the routing statistics.
+
+        Returns:
+            dict: Lag of each replica, reads per destination and replicas skipped.
+        """
+        return {
+            "replicas": {replica.name: replica.lag for replica in self.replicas},
+            "max_lag": self.max_lag,
+            "replica_reads": self.replica_reads,
+            "primary_reads": self.primary_reads,
+            "recent_write_reads": self.recent_write_reads,
+            "lagging_skips": self.lagging_skips,
+            "recent_writers": len(self.writes),
+        }
+
+
+# Router shared by the routes of the process
+replica_router = ReplicaRouter(
+    [Replica(create_replica_engine(url)) for url in settings.DATABASE_REPLICA_URLS]
+)
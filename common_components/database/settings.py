@@ -1,10 +1,77 @@
 import os
 
+
+def get_required_setting(name: str) -> str:
+    """Get a setting that has no default value, e.g. a secret, from the environment.
+
+    Args:
+        name (str): Setting name.
+
+    Raises:
+        RuntimeError: If the setting is not set, so the service fails on startup.
+
+    Returns:
+        str: Setting value.
+    """
+    value = os.getenv(name)
+    if not value:
+        raise RuntimeError(f"The {name} environment variable must be set")
+
+    return value
+
+
 DATABASE_USERNAME = os.getenv("DATABASE_USERNAME", "todo_app")
 DATABASE_PASSWORD = os.getenv("DATABASE_PASSWORD", "This Is A Password!1%_")
 DATABASE_HOST = os.getenv("DATABASE_HOST", "localhost")
 DATABASE_NAME = os.getenv("DATABASE_NAME", "todo_app")
 DATABASE_URL = f"postgresql://{DATABASE_USERNAME}:{DATABASE_PASSWORD}@{DATABASE_HOST}/{DATABASE_NAME}"
+ASYNC_DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
+
+# Each service has its own traffic profile (e.g. short bursts of logins for auth, many small
+# queries for tasks), so the pool settings can be set per service, e.g. AUTH_DATABASE_POOL_SIZE,
+# with DATABASE_POOL_SIZE as the fallback. The service is selected by SERVICE_NAME.
+SERVICE_NAME = os.getenv("SERVICE_NAME", "")
+
+
+def _get_database_setting(name: str, default: str) -> str:
+    """Get a database setting of the current service from the environment.
+
+    Args:
+        name (str): Setting name, e.g. "DATABASE_POOL_SIZE".
+        default (str): Default value if none of the variables is set.
+
+    Returns:
+        str: Setting value.
+    """
+    return os.environ.get(f"{SERVICE_NAME.upper()}_{name}", os.environ.get(name, default))
+
+
+DATABASE_POOL_SIZE = int(_get_database_setting("DATABASE_POOL_SIZE", "5"))
+DATABASE_MAX_OVERFLOW = int(_get_database_setting("DATABASE_MAX_OVERFLOW", "10"))
+# Seconds to wait for a connection when the pool and its overflow are exhausted
+DATABASE_POOL_TIMEOUT = float(_get_database_setting("DATABASE_POOL_TIMEOUT", "30"))
+# Seconds after which a connection is replaced, before the server or a proxy drops it
+DATABASE_POOL_RECYCLE = int(_get_database_setting("DATABASE_POOL_RECYCLE", "1800"))
+DATABASE_POOL_PRE_PING = _get_database_setting("DATABASE_POOL_PRE_PING", "true").lower() == "true"
+# Milliseconds, 0 disables it
+DATABASE_STATEMENT_TIMEOUT = int(_get_database_setting("DATABASE_STATEMENT_TIMEOUT", "30000"))
+
+# Read replicas, comma separated hosts with the same database and credentials as the primary. The
+# read-only routes use them through get_read_db, unless they lag more than DATABASE_REPLICA_MAX_LAG
+# seconds, checked every DATABASE_REPLICA_LAG_CHECK_INTERVAL seconds. A client that wrote to the
+# primary reads from it for DATABASE_READ_YOUR_WRITES_WINDOW seconds, which should be longer than
+# the maximum lag. The replicas must answer within DATABASE_REPLICA_CONNECT_TIMEOUT seconds.
+DATABASE_REPLICA_HOSTS = [
+    host.strip() for host in os.getenv("DATABASE_REPLICA_HOSTS", "").split(",") if host.strip()
+]
+DATABASE_REPLICA_URLS = [
+    f"postgresql://{DATABASE_USERNAME}:{DATABASE_PASSWORD}@{host}/{DATABASE_NAME}"
+    for host in DATABASE_REPLICA_HOSTS
+]
+DATABASE_REPLICA_MAX_LAG = float(os.getenv("DATABASE_REPLICA_MAX_LAG", "5"))
+DATABASE_REPLICA_LAG_CHECK_INTERVAL = float(os.getenv("DATABASE_REPLICA_LAG_CHECK_INTERVAL", "5"))
+DATABASE_REPLICA_CONNECT_TIMEOUT = int(os.getenv("DATABASE_REPLICA_CONNECT_TIMEOUT", "2"))
+DATABASE_READ_YOUR_WRITES_WINDOW = float(os.getenv("DATABASE_READ_YOUR_WRITES_WINDOW", "10"))
 
 FASTAPI_KWARGS = {
     "title": "TODO App",
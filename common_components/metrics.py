@@ -0,0 +1,18 @@
+"""Helpers for the statistics exposed by the monitoring endpoints."""
+
+
+def percentile(samples: list[float], value: float) -> float | None:
+    """Get a percentile of a list of samples.
+
+    Args:
+        samples (list[float]): Samples, in seconds.
+        value (float): Percentile, e.g. 99.
+
+    Returns:
+        float | None: Percentile in milliseconds, or None if there are no samples.
+    """
+    if not samples:
+        return None
+
+    ordered = sorted(samples)
+    return round(ordered[min(int(len(ordered) * value / 100), len(ordered) - 1)] * 1000, 3)
@@ -1,6 +1,13 @@
 #!/bin/bash
 # 2 - Run in root folder > ./devops/scripts/helm_install_microservices.sh
 
+# Secrets shared by the services, they have no default. Generate them once, e.g. with
+# `openssl rand -hex 32`, keep them in a secret store and export them before running the script.
+# Changing PAT_SECRET invalidates every personal access token, their digests are keyed with it.
+: "${INTERNAL_IDENTITY_SECRET:?Set INTERNAL_IDENTITY_SECRET, the same for every service}"
+: "${PAT_SECRET:?Set PAT_SECRET, the same for every service}"
+: "${MONITORING_TOKEN:?Set MONITORING_TOKEN, sent by the monitoring system to the gateway}"
+
 # List of service names
 services=("api-gateway-service" "auth-service" "projects-service" "tasks-service" "users-service")
 
@@ -15,7 +22,10 @@ do
   helm uninstall "$service"
   
   echo "Installing $service..."
-  helm install "$service" ./devops/"$service"-chart
+  helm install "$service" ./devops/"$service"-chart \
+    --set-string secrets.internalIdentitySecret="$INTERNAL_IDENTITY_SECRET" \
+    --set-string secrets.patSecret="$PAT_SECRET" \
+    --set-string secrets.monitoringToken="$MONITORING_TOKEN"
 done
 
 echo "All services have been installed."
@@ -4,6 +4,7 @@ from alembic import context
 from sqlalchemy import engine_from_config, pool
 
 # Need to import all models here to ensure they are available for Alembic to detect.
+from auth_service import auth_models as auth_models
 from common_components.database import settings
 from common_components.database.db import Base
 from projects_service import projects_models as project_models
@@ -0,0 +1,114 @@
+"""Baseline
+
+Schema of the models of the baseline commit 94c88c6, before any change of this series: the users,
+projects, project_collaborators and tasks tables, as Base.metadata.create_all created them. A
+database created by that code already has it and is marked as migrated with `alembic stamp 0001`,
+then upgraded as usual with `alembic upgrade head`.
+
+A database created with create_all by the commits of this series before the migrations were added
+also has the refresh_tokens table (from c302c43) and the personal_access_tokens table (from
+437f20a), and nothing else. It is stamped 0001 and upgraded the same way: migration 0005 only
+creates the token tables that don't exist yet, and keeps the rows of the others. A database
+created with create_all by code that has the migrations already has the schema of head, and is
+marked with `alembic stamp head`.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 04:56:13.344888
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("username", sa.String(), nullable=True),
+        sa.Column("email", sa.String(), nullable=True),
+        sa.Column("hashed_password", sa.String(), nullable=True),
+        sa.Column("disabled", sa.Boolean(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("username"),
+    )
+    op.create_index(op.f("ix_users_email"), "users", ["email"], unique=True)
+    op.create_index(op.f("ix_users_id"), "users", ["id"], unique=False)
+    op.create_table(
+        "projects",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("name", sa.String(), nullable=True),
+        sa.Column("description", sa.String(), nullable=True),
+        sa.Column("owner_id", sa.Integer(), nullable=True),
+        sa.Column("is_active", sa.Boolean(), nullable=True),
+        sa.Column("created_at", sa.String(), nullable=True),
+        sa.Column("updated_at", sa.String(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["owner_id"],
+            ["users.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_projects_id"), "projects", ["id"], unique=False)
+    op.create_table(
+        "project_collaborators",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("project_id", sa.Integer(), nullable=True),
+        sa.Column("user_id", sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["project_id"],
+            ["projects.id"],
+        ),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["users.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "tasks",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("title", sa.String(), nullable=True),
+        sa.Column("description", sa.String(), nullable=True),
+        sa.Column("priority", sa.Integer(), nullable=True),
+        sa.Column("owner_id", sa.Integer(), nullable=True),
+        sa.Column("project_id", sa.Integer(), nullable=True),
+        sa.Column("parent_id", sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["owner_id"],
+            ["users.id"],
+        ),
+        sa.ForeignKeyConstraint(
+            ["parent_id"],
+            ["tasks.id"],
+        ),
+        sa.ForeignKeyConstraint(
+            ["project_id"],
+            ["projects.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_tasks_description"), "tasks", ["description"], unique=False)
+    op.create_index(op.f("ix_tasks_id"), "tasks", ["id"], unique=False)
+    op.create_index(op.f("ix_tasks_title"), "tasks", ["title"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_tasks_title"), table_name="tasks")
+    op.drop_index(op.f("ix_tasks_id"), table_name="tasks")
+    op.drop_index(op.f("ix_tasks_description"), table_name="tasks")
+    op.drop_table("tasks")
+    op.drop_table("project_collaborators")
+    op.drop_index(op.f("ix_projects_id"), table_name="projects")
+    op.drop_table("projects")
+    op.drop_index(op.f("ix_users_id"), table_name="users")
+    op.drop_index(op.f("ix_users_email"), table_name="users")
+    op.drop_table("users")
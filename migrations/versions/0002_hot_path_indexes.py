@@ -0,0 +1,93 @@
+"""Hot path indexes
+
+Index the columns the routes filter and join on, and drop the index on tasks.description, which
+no query filters on:
+
+- tasks.owner_id, tasks.parent_id and tasks.project_id, for the tasks of a user, the subtasks of
+  a task and the tasks of a project.
+- tasks.owner_id of the top level tasks (no parent nor project), partial, for get_all_own_tasks.
+- projects (owner_id, name), for the projects of a user and check_valid_project_name.
+- project_collaborators (user_id, project_id), unique, for the projects a user collaborates on,
+  and project_collaborators.project_id, for the collaborators of a project.
+
+The indexes are built with CREATE INDEX CONCURRENTLY, which doesn't block the writes to the
+tables, so the migration can run against a live database. It can't run in a transaction, so each
+statement is committed on its own: if a build fails, it leaves an invalid index behind, which is
+dropped and rebuilt when the migration is run again.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 04:58:12.481532
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Name, table, columns and options of each index
+INDEXES = [
+    ("ix_tasks_owner_id", "tasks", ["owner_id"], {}),
+    ("ix_tasks_parent_id", "tasks", ["parent_id"], {}),
+    ("ix_tasks_project_id", "tasks", ["project_id"], {}),
+    (
+        "ix_tasks_owner_id_top_level",
+        "tasks",
+        ["owner_id"],
+        {"postgresql_where": sa.text("parent_id IS NULL AND project_id IS NULL")},
+    ),
+    ("ix_projects_owner_id_name", "projects", ["owner_id", "name"], {}),
+    ("ix_project_collaborators_project_id", "project_collaborators", ["project_id"], {}),
+    (
+        "ix_project_collaborators_user_id_project_id",
+        "project_collaborators",
+        ["user_id", "project_id"],
+        {"unique": True},
+    ),
+]
+
+
+def upgrade() -> None:
+    # The unique index can't be built over duplicated collaborators, keep the first of each
+    op.execute(
+        """
+        DELETE FROM project_collaborators duplicate
+        USING project_collaborators original
+        WHERE duplicate.project_id = original.project_id
+            AND duplicate.user_id = original.user_id
+            AND duplicate.id > original.id
+        """
+    )
+
+    with op.get_context().autocommit_block():
+        for name, table, columns, options in INDEXES:
+            # Left by a previous run that failed, the build may not have completed
+            op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
+            op.create_index(name, table, columns, postgresql_concurrently=True, **options)
+
+        op.drop_index(
+            "ix_tasks_description",
+            table_name="tasks",
+            if_exists=True,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_tasks_description",
+            "tasks",
+            ["description"],
+            if_not_exists=True,
+            postgresql_concurrently=True,
+        )
+
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
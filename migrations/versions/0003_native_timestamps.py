@@ -0,0 +1,143 @@
+"""Native timestamps, expand
+
+Store the creation and update times of the projects as timestamptz instead of strings, add them
+to the tasks, and index them for the recently updated listings and the time range filters.
+
+The change is online, in three steps, the application keeps writing during each of them:
+
+1. This migration (expand) only adds: the code running before it keeps working.
+2. Deploy the code that reads and writes the created_at_tz and updated_at_tz columns of the
+   projects. During the rolling deployment, both versions of the code write the projects.
+3. Once no instance runs the previous code, migration 0004 (contract) drops the strings.
+
+- The tasks columns are added with NOT NULL DEFAULT now(), which PostgreSQL stores in the catalog
+  without rewriting the table. The existing tasks get the time of the migration.
+- The projects strings are converted into new created_at_tz and updated_at_tz columns. A trigger
+  keeps both in sync: the strings written by the previous code are converted, and the strings of
+  the rows written by the new code are filled, so the previous code can still read them. The
+  existing rows are backfilled in batches of BACKFILL_BATCH_SIZE, each committed on its own, so
+  no lock is held for long. The strings were written from naive local times, and are read in the
+  time zone of the database.
+- The backfill is proven complete by CHECK constraints, validated without blocking the writes, so
+  setting NOT NULL in the contract migration doesn't scan the table.
+- The indexes are built with CREATE INDEX CONCURRENTLY.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 05:08:41.203877
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_BATCH_SIZE = 1000
+
+BACKFILL = """
+    UPDATE projects
+    SET created_at_tz = COALESCE(created_at::timestamptz, now()),
+        updated_at_tz = COALESCE(updated_at::timestamptz, now())
+    WHERE {condition}
+"""
+
+COLUMNS = ["created_at", "updated_at"]
+INDEXES = [(f"ix_projects_{column}_tz", "projects", f"{column}_tz") for column in COLUMNS] + [
+    (f"ix_tasks_{column}", "tasks", column) for column in COLUMNS
+]
+
+# Written by the previous code (a string changed) or by the new code (a timestamp changed)
+SYNC_FUNCTION = """
+    CREATE FUNCTION projects_timestamps_tz() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' AND NEW.created_at IS NOT NULL
+                OR TG_OP = 'UPDATE' AND NEW.created_at IS DISTINCT FROM OLD.created_at THEN
+            NEW.created_at_tz := COALESCE(NEW.created_at::timestamptz, now());
+        ELSIF TG_OP = 'INSERT' OR NEW.created_at_tz IS DISTINCT FROM OLD.created_at_tz THEN
+            NEW.created_at := to_char(NEW.created_at_tz, 'YYYY-MM-DD HH24:MI:SS.US');
+        END IF;
+
+        IF TG_OP = 'INSERT' AND NEW.updated_at IS NOT NULL
+                OR TG_OP = 'UPDATE' AND NEW.updated_at IS DISTINCT FROM OLD.updated_at THEN
+            NEW.updated_at_tz := COALESCE(NEW.updated_at::timestamptz, now());
+        ELSIF TG_OP = 'INSERT' OR NEW.updated_at_tz IS DISTINCT FROM OLD.updated_at_tz THEN
+            NEW.updated_at := to_char(NEW.updated_at_tz, 'YYYY-MM-DD HH24:MI:SS.US');
+        END IF;
+
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+"""
+SYNC_TRIGGER = """
+    CREATE TRIGGER projects_timestamps_tz BEFORE INSERT OR UPDATE ON projects
+    FOR EACH ROW EXECUTE FUNCTION projects_timestamps_tz()
+"""
+
+
+def upgrade() -> None:
+    for column in COLUMNS:
+        op.add_column(
+            "tasks",
+            sa.Column(
+                column, sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False
+            ),
+        )
+        # The default is set afterwards, so the existing rows are left NULL for the backfill
+        op.add_column("projects", sa.Column(f"{column}_tz", sa.DateTime(timezone=True)))
+        op.alter_column("projects", f"{column}_tz", server_default=sa.func.now())
+
+    op.execute(SYNC_FUNCTION)
+    op.execute(SYNC_TRIGGER)
+
+    with op.get_context().autocommit_block():
+        if op.get_context().as_sql:
+            # An offline SQL script can't read the ids, it converts every row at once
+            op.execute(BACKFILL.format(condition="created_at_tz IS NULL"))
+        else:
+            # Batches of primary key ranges, the rows inserted since are converted by the trigger
+            connection = op.get_bind()
+            max_id = connection.execute(sa.text("SELECT max(id) FROM projects")).scalar() or 0
+            for start in range(0, max_id, BACKFILL_BATCH_SIZE):
+                connection.execute(
+                    sa.text(
+                        BACKFILL.format(
+                            condition="id > :start AND id <= :end AND created_at_tz IS NULL"
+                        )
+                    ),
+                    {"start": start, "end": start + BACKFILL_BATCH_SIZE},
+                )
+
+        for column in COLUMNS:
+            op.create_check_constraint(
+                f"ck_projects_{column}_tz_not_null",
+                "projects",
+                f"{column}_tz IS NOT NULL",
+                postgresql_not_valid=True,
+            )
+            op.execute(
+                f"ALTER TABLE projects VALIDATE CONSTRAINT ck_projects_{column}_tz_not_null"
+            )
+
+        for name, table, column in INDEXES:
+            # Left by a previous run that failed, the build may not have completed
+            op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
+            op.create_index(name, table, [column], postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
+
+    op.execute("DROP TRIGGER projects_timestamps_tz ON projects")
+    op.execute("DROP FUNCTION projects_timestamps_tz()")
+    for column in COLUMNS:
+        op.drop_column("tasks", column)
+        # Drops its check constraint too
+        op.drop_column("projects", f"{column}_tz")
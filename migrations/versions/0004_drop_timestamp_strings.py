@@ -0,0 +1,83 @@
+"""Native timestamps, contract
+
+Drop the timestamp strings of the projects, replaced by the created_at_tz and updated_at_tz
+columns in migration 0003. Run it only once every instance of the application runs the code that
+reads and writes the new columns: the previous code would fail on the missing strings.
+
+Every step only takes a short lock. NOT NULL is set from the CHECK constraints validated by 0003,
+so the table is not scanned, and the trigger that kept the strings in sync is dropped with them.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 10:41:12.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0004"
+down_revision: Union[str, None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = ["created_at", "updated_at"]
+
+# Same trigger as in 0003, to restore the state between the two migrations
+SYNC_FUNCTION = """
+    CREATE FUNCTION projects_timestamps_tz() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' AND NEW.created_at IS NOT NULL
+                OR TG_OP = 'UPDATE' AND NEW.created_at IS DISTINCT FROM OLD.created_at THEN
+            NEW.created_at_tz := COALESCE(NEW.created_at::timestamptz, now());
+        ELSIF TG_OP = 'INSERT' OR NEW.created_at_tz IS DISTINCT FROM OLD.created_at_tz THEN
+            NEW.created_at := to_char(NEW.created_at_tz, 'YYYY-MM-DD HH24:MI:SS.US');
+        END IF;
+
+        IF TG_OP = 'INSERT' AND NEW.updated_at IS NOT NULL
+                OR TG_OP = 'UPDATE' AND NEW.updated_at IS DISTINCT FROM OLD.updated_at THEN
+            NEW.updated_at_tz := COALESCE(NEW.updated_at::timestamptz, now());
+        ELSIF TG_OP = 'INSERT' OR NEW.updated_at_tz IS DISTINCT FROM OLD.updated_at_tz THEN
+            NEW.updated_at := to_char(NEW.updated_at_tz, 'YYYY-MM-DD HH24:MI:SS.US');
+        END IF;
+
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+"""
+SYNC_TRIGGER = """
+    CREATE TRIGGER projects_timestamps_tz BEFORE INSERT OR UPDATE ON projects
+    FOR EACH ROW EXECUTE FUNCTION projects_timestamps_tz()
+"""
+
+
+def upgrade() -> None:
+    op.execute("DROP TRIGGER projects_timestamps_tz ON projects")
+    op.execute("DROP FUNCTION projects_timestamps_tz()")
+
+    for column in COLUMNS:
+        op.alter_column("projects", f"{column}_tz", nullable=False)
+        op.drop_constraint(f"ck_projects_{column}_tz_not_null", "projects")
+        op.drop_column("projects", column)
+
+
+def downgrade() -> None:
+    for column in COLUMNS:
+        op.add_column("projects", sa.Column(column, sa.String()))
+        op.create_check_constraint(
+            f"ck_projects_{column}_tz_not_null", "projects", f"{column}_tz IS NOT NULL"
+        )
+        op.alter_column("projects", f"{column}_tz", nullable=True)
+
+    # Back to the format the strings were written in, in the time zone of the database
+    op.execute(
+        """
+        UPDATE projects
+        SET created_at = to_char(created_at_tz, 'YYYY-MM-DD HH24:MI:SS.US'),
+            updated_at = to_char(updated_at_tz, 'YYYY-MM-DD HH24:MI:SS.US')
+        """
+    )
+    op.execute(SYNC_FUNCTION)
+    op.execute(SYNC_TRIGGER)
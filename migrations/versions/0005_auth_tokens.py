@@ -0,0 +1,93 @@
+"""Auth tokens
+
+Add the refresh_tokens and personal_access_tokens tables of the auth service.
+
+A database created with create_all before the migrations were added may already have one or both
+of them, see 0001: the existing tables are kept with their rows, only the missing ones are created.
+An offline SQL script can't inspect the database, it creates both.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 11:02:47.190354
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0005"
+down_revision: Union[str, None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def get_existing_tables() -> set[str]:
+    if op.get_context().as_sql:
+        return set()
+
+    return set(sa.inspect(op.get_bind()).get_table_names())
+
+
+def upgrade() -> None:
+    existing_tables = get_existing_tables()
+
+    if "refresh_tokens" not in existing_tables:
+        op.create_table(
+            "refresh_tokens",
+            sa.Column("jti", sa.String(), nullable=False),
+            sa.Column("family_id", sa.String(), nullable=False),
+            sa.Column("user_id", sa.Integer(), nullable=True),
+            sa.Column("expires_at", sa.DateTime(), nullable=False),
+            sa.Column("used", sa.Boolean(), nullable=False),
+            sa.Column("revoked", sa.Boolean(), nullable=False),
+            sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+            sa.PrimaryKeyConstraint("jti"),
+        )
+        op.create_index(
+            op.f("ix_refresh_tokens_family_id"), "refresh_tokens", ["family_id"], unique=False
+        )
+        op.create_index(
+            op.f("ix_refresh_tokens_user_id"), "refresh_tokens", ["user_id"], unique=False
+        )
+
+    if "personal_access_tokens" not in existing_tables:
+        op.create_table(
+            "personal_access_tokens",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("user_id", sa.Integer(), nullable=True),
+            sa.Column("name", sa.String(), nullable=False),
+            sa.Column("digest", sa.String(), nullable=False),
+            sa.Column("scopes", sa.String(), nullable=False),
+            sa.Column("created_at", sa.DateTime(), nullable=False),
+            sa.Column("expires_at", sa.DateTime(), nullable=True),
+            sa.Column("last_used_at", sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index(
+            op.f("ix_personal_access_tokens_digest"),
+            "personal_access_tokens",
+            ["digest"],
+            unique=True,
+        )
+        op.create_index(
+            op.f("ix_personal_access_tokens_id"), "personal_access_tokens", ["id"], unique=False
+        )
+        op.create_index(
+            op.f("ix_personal_access_tokens_user_id"),
+            "personal_access_tokens",
+            ["user_id"],
+            unique=False,
+        )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_personal_access_tokens_user_id"), table_name="personal_access_tokens")
+    op.drop_index(op.f("ix_personal_access_tokens_id"), table_name="personal_access_tokens")
+    op.drop_index(op.f("ix_personal_access_tokens_digest"), table_name="personal_access_tokens")
+    op.drop_table("personal_access_tokens")
+    op.drop_index(op.f("ix_refresh_tokens_user_id"), table_name="refresh_tokens")
+    op.drop_index(op.f("ix_refresh_tokens_family_id"), table_name="refresh_tokens")
+    op.drop_table("refresh_tokens")
@@ -0,0 +1,176 @@
+"""Async variants of the projects functions of the projects_crud module, for the async routes.
+
+An AsyncSession can't lazy load a relationship, so the tasks serialized by the Project schema
+are eagerly loaded with the projects, refreshing the ones already in the session."""
+
+from sqlalchemy import select, union
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+import projects_service.projects_models as models
+import projects_service.projects_schemas as schemas
+from common_components.database.models_relationships import ProjectCollaborators
+from tasks_service.tasks_async_crud import load_subtasks
+from users_service.users_models import User
+
+
+def load_project_tasks():
+    return selectinload(models.Project.tasks).options(load_subtasks())
+
+
+async def get_project(db: AsyncSession, project_id: int) -> models.Project | None:
+    """Get project by ID.
+
+    Args:
+        db (AsyncSession): Async database session.
+        project_id (int): Project ID.
+
+    Returns:
+        models.Project: SQL Alchemy Project model.
+    """
+    return await db.scalar(
+        select(models.Project)
+        .options(load_project_tasks())
+        .filter(models.Project.id == project_id)
+        .execution_options(populate_existing=True)
+    )
+
+
+async def get_project_by_name(db: AsyncSession, name: str) -> models.Project | None:
+    """Get project by name.
+
+    Args:
+        db (AsyncSession): Async database session.
+        name (str): Project name.
+
+    Returns:
+        models.Project: SQL Alchemy Project model.
+    """
+    return await db.scalar(
+        select(models.Project)
+        .options(load_project_tasks())
+        .filter(models.Project.name == name)
+        .execution_options(populate_existing=True)
+    )
+
+
+async def get_owned_and_collaborated_projects(
+    db: AsyncSession,
+    user_id: int,
+    skip: int = 0,
+    limit: int = 100,
+) -> list[models.Project]:
+    """Get owned and collaborated projects.
+
+    Args:
+        db (AsyncSession): Async database session.
+        user_id (int): User ID.
+        skip (int, optional): Number of projects to skip. Defaults to 0.
+        limit (int, optional): Number of projects to return. Defaults to 100.
+
+    Returns:
+        list[Project]: List of SQL Alchemy Project models.
+    """
+    owned_projects = (
+        select(models.Project).filter(models.Project.owner_id == user_id).offset(skip).limit(limit)
+    )
+    collaborated_projects = (
+        select(models.Project)
+        .join(ProjectCollaborators, models.Project.id == ProjectCollaborators.c.project_id)
+        .filter(ProjectCollaborators.c.user_id == user_id)
+        .offset(skip)
+        .limit(limit)
+    )
+
+    result = await db.scalars(
+        select(models.Project)
+        .options(load_project_tasks())
+        .from_statement(union(owned_projects, collaborated_projects))
+        .execution_options(populate_existing=True)
+    )
+
+    return list(result.all())
+
+
+async def create_project(
+    db: AsyncSession, project: schemas.ProjectBase, user_id: int
+) -> models.Project:
+    """Create project.
+
+    Args:
+        db (AsyncSession): Async database session.
+        project (schemas.ProjectBase): Project data.
+        user_id (int): User ID.
+
+    Returns:
+        models.Project: SQL Alchemy Project model.
+    """
+    # The timestamps are set by the database
+    db_project = models.Project(
+        **project.model_dump(),
+        owner_id=user_id,
+    )
+
+    db.add(db_project)
+    await db.commit()
+
+    return await get_project(db, project_id=db_project.id)  # type: ignore
+
+
+async def delete_project(db: AsyncSession, project_id: int) -> None:
+    """Delete project.
+
+    Args:
+        db (AsyncSession): Async database session.
+        project_id (int): Project ID.
+    """
+    db_project = await get_project(db, project_id=project_id)
+
+    await db.delete(db_project)
+    await db.commit()
+
+
+async def update_project_information(
+    db: AsyncSession, project_id: int, project: schemas.ProjectBase
+) -> models.Project:
+    """Update project information.
+
+    Args:
+        db (AsyncSession): Async database session.
+        project_id (int): Project ID.
+        project (schemas.ProjectBase): Project data.
+
+    Returns:
+        models.Project: SQL Alchemy Project model.
+    """
+    db_project = await get_project(db, project_id=project_id)
+
+    db_project.name = project.name  # type: ignore
+    db_project.description = project.description  # type: ignore
+
+    await db.commit()
+
+    return await get_project(db, project_id=project_id)  # type: ignore
+
+
+async def add_collaborator(db: AsyncSession, project_id: int, user_id: int) -> models.Project:
+    """Add collaborator to project.
+
+    Args:
+        db (AsyncSession): Async database session.
+        project_id (int): Project ID.
+        user_id (int): User ID.
+
+    Returns:
+        models.Project: SQL Alchemy Project model.
+    """
+    db_project = await db.scalar(
+        select(models.Project)
+        .options(selectinload(models.Project.collaborators))
+        .filter(models.Project.id == project_id)
+    )
+
+    db_project.collaborators.append(await db.get(User, user_id))  # type: ignore
+    await db.commit()
+
+    return await get_project(db, project_id=project_id)  # type: ignore
@@ -3,8 +3,6 @@
 The functions are used by the API routes to perform CRUD operations in the database. Validation of 
 the input data is performed by the validators in the input_validators module."""
 
-from datetime import datetime
-
 from sqlalchemy.orm import Session
 
 import projects_service.projects_models as models
@@ -94,11 +92,10 @@ def create_project(db: Session, project: schemas.ProjectBase, user_id: int) -> m
         HTTPException: If the project name already exists.
     """
 
+    # The timestamps are set by the database
     db_project = models.Project(
         **project.model_dump(),
         owner_id=user_id,
-        created_at=datetime.now(),
-        updated_at=datetime.now(),
     )
 
     db.add(db_project)
@@ -143,7 +140,6 @@ def update_project_information(
 
     db_project.name = project.name  # type: ignore
     db_project.description = project.description  # type: ignore
-    db_project.updated_at = datetime.now()  # type: ignore
 
     db.commit()
     db.refresh(db_project)
@@ -2,7 +2,7 @@
 
 SQLAlchemy models are used to define the structure of the data that is stored in the database."""
 
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Index, Integer, String, func
 from sqlalchemy.orm import relationship
 
 from common_components.database.db import Base
@@ -20,8 +20,22 @@ class Project(Base):
     owner_id = Column(Integer, ForeignKey("users.id"))
 
     is_active = Column(Boolean, default=True)
-    created_at = Column(String)
-    updated_at = Column(String)
+    # The columns replaced the strings of the same names, see migrations 0003 and 0004
+    created_at = Column(
+        "created_at_tz",
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.now(),
+        index=True,
+    )
+    updated_at = Column(
+        "updated_at_tz",
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.now(),
+        onupdate=func.now(),
+        index=True,
+    )
 
     tasks = relationship("Task", back_populates="project")
 
@@ -34,3 +48,8 @@ class Project(Base):
         secondary=ProjectCollaborators,
         back_populates="collaborated_projects",
     )
+
+    __table_args__ = (
+        # Projects of a user, and lookup by name in check_valid_project_name
+        Index("ix_projects_owner_id_name", owner_id, name),
+    )
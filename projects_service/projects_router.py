@@ -11,8 +11,8 @@ from starlette.status import HTTP_200_OK, HTTP_201_CREATED, HTTP_204_NO_CONTENT
 import common_components.database.db as db
 import projects_service.projects_crud as project_crud
 import projects_service.projects_schemas as project_schema
-import users_service.users_schemas as user_schema
-from auth_service.auth_crud import get_current_active_user
+from auth_service.auth_crud import get_current_active_principal
+from auth_service.auth_schemas import Principal
 from common_components.input_validators import validate_project
 from projects_service.projects_models import Project as project_model
 
@@ -23,16 +23,16 @@ router = APIRouter(tags=["Projects"], prefix="/projects")
 def get_owned_and_collaborated_projects(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(db.get_db),
-    current_user: user_schema.User = Depends(get_current_active_user),
+    db: Session = Depends(db.get_read_db),
+    current_user: Principal = Depends(get_current_active_principal),
 ) -> list[project_model]:
     """Get owned and collaborated projects.
 
     Args:
         skip (int, optional): Number of projects to skip. Defaults to 0.
         limit (int, optional): Number of projects to return. Defaults to 100.
-        db (Session, optional): Database session. Defaults to Depends(db.get_db).
-        current_user (user_schema.User, optional): Current user. Defaults to Depends(get_current_active_user).
+        db (Session, optional): Database session. Defaults to Depends(db.get_read_db).
+        current_user (Principal, optional): Current user. Defaults to Depends(get_current_active_principal).
 
     Returns:
         list[Project]: List of SQL Alchemy Project models.
@@ -46,14 +46,14 @@ def get_owned_and_collaborated_projects(
 def create_project(
     project: project_schema.ProjectBase,
     db: Session = Depends(db.get_db),
-    current_user: user_schema.User = Depends(get_current_active_user),
+    current_user: Principal = Depends(get_current_active_principal),
 ) -> project_model:
     """Create project.
 
     Args:
         project (project_schema.ProjectBase): Project data.
         db (Session, optional): Database session. Defaults to Depends(db.get_db).
-        current_user (user_schema.User, optional): Current user. Defaults to Depends(get_current_active_user).
+        current_user (Principal, optional): Current user. Defaults to Depends(get_current_active_principal).
 
     Returns:
         project_model: SQL Alchemy Project model.
@@ -69,14 +69,14 @@ def create_project(
 def delete_project(
     project_id: int,
     db: Session = Depends(db.get_db),
-    current_user: user_schema.User = Depends(get_current_active_user),
+    current_user: Principal = Depends(get_current_active_principal),
 ) -> None:
     """Delete project.
 
     Args:
         project_id (int): Project ID.
         db (Session, optional): Database session. Defaults to Depends(db.get_db).
-        current_user (user_schema.User, optional): Current user. Defaults to Depends(get_current_active_user).
+        current_user (Principal, optional): Current user. Defaults to Depends(get_current_active_principal).
 
     Raises:
         HTTPException: If the project does not exist.
@@ -91,7 +91,7 @@ def update_project(
     project_id: int,
     project: project_schema.ProjectBase,
     db: Session = Depends(db.get_db),
-    current_user: user_schema.User = Depends(get_current_active_user),
+    current_user: Principal = Depends(get_current_active_principal),
 ) -> project_model:
     """Update project.
 
@@ -99,7 +99,7 @@ def update_project(
         project_id (int): Project ID.
         project (project_schema.ProjectBase): Project data.
         db (Session, optional): Database session. Defaults to Depends(db.get_db).
-        current_user (user_schema.User, optional): Current user. Defaults to Depends(get_current_active_user).
+        current_user (Principal, optional): Current user. Defaults to Depends(get_current_active_principal).
 
     Returns:
         project_model: SQL Alchemy Project model.
@@ -0,0 +1,97 @@
+"""Async variants of the tasks functions of the tasks_crud module, for the async routes.
+
+An AsyncSession can't lazy load a relationship, so the nested subtasks serialized by the Task
+schema are eagerly loaded with the tasks, with one SELECT per level of nesting. The sessions don't
+expire the objects on commit, so the queries refresh the ones already loaded (populate_existing)
+instead of returning them with stale relationships."""
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+import tasks_service.tasks_models as models
+import tasks_service.tasks_schemas as schemas
+
+
+def load_subtasks():
+    # Load the subtasks of the subtasks until there are none left. Built on use, since building
+    # it configures the mappers, which needs every model to be imported.
+    return selectinload(models.Task.subtasks, recursion_depth=-1)
+
+
+async def get_all_own_tasks(
+    db: AsyncSession, owner_id: int, skip: int = 0, limit: int = 100
+) -> list[models.Task]:
+    result = await db.scalars(
+        select(models.Task)
+        .options(load_subtasks())
+        .filter(models.Task.owner_id == owner_id)
+        # Subtasks and project tasks are already nested in their parent task or project
+        .filter(models.Task.parent_id.is_(None))
+        .filter(models.Task.project_id.is_(None))
+        .offset(skip)
+        .limit(limit)
+        .execution_options(populate_existing=True)
+    )
+
+    return list(result.all())
+
+
+async def get_task(db: AsyncSession, owner_id: int, task_id: int) -> models.Task | None:
+    """Get task by task_id and owner_id, with all its nested subtasks.
+
+    Args:
+        db (AsyncSession): Async database session.
+        owner_id (int): Owner ID.
+        task_id (int): Task ID.
+
+    Returns:
+        models.Task: SQL Alchemy Task model, or None if the user has no such task.
+    """
+    return await db.scalar(
+        select(models.Task)
+        .options(load_subtasks())
+        .filter(models.Task.owner_id == owner_id)
+        .filter(models.Task.id == task_id)
+        .execution_options(populate_existing=True)
+    )
+
+
+async def create_task(
+    db: AsyncSession,
+    task: schemas.TaskCreateModify,
+    user_id: int,
+) -> models.Task:
+    db_task = models.Task(
+        **task.model_dump(),
+        owner_id=user_id,
+    )  # type: ignore
+
+    db.add(db_task)
+    await db.commit()
+
+    return await get_task(db, owner_id=user_id, task_id=db_task.id)  # type: ignore
+
+
+async def update_task(
+    db: AsyncSession, owner_id: int, task: schemas.TaskCreateModify, task_id: int
+) -> models.Task:
+    db_task = await get_task(db, owner_id=owner_id, task_id=task_id)
+
+    db_task.title = task.title  # type: ignore
+    db_task.description = task.description  # type: ignore
+    db_task.priority = task.priority  # type: ignore
+    db_task.parent_id = task.parent_id  # type: ignore
+    db_task.project_id = task.project_id  # type: ignore
+
+    await db.commit()
+
+    return await get_task(db, owner_id=owner_id, task_id=task_id)  # type: ignore
+
+
+async def delete_task(db: AsyncSession, owner_id: int, task_id: int) -> None:
+    # The subtasks are loaded by get_task, so they are deleted with it
+    db_task = await get_task(db, owner_id=owner_id, task_id=task_id)
+
+    await db.delete(db_task)
+    await db.commit()
@@ -2,7 +2,7 @@
 
 SQLAlchemy models are used to define the structure of the data that is stored in the database."""
 
-from sqlalchemy import Column, ForeignKey, Integer, String
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, String, func
 from sqlalchemy.orm import relationship
 
 from common_components.database.db import Base
@@ -15,19 +15,29 @@ class Task(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True)
-    description = Column(String, index=True)
+    description = Column(String)
     priority = Column(Integer)
+    created_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now(), index=True
+    )
+    updated_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=func.now(),
+        onupdate=func.now(),
+        index=True,
+    )
 
     # User tasks
-    owner_id = Column(Integer, ForeignKey("users.id"))
+    owner_id = Column(Integer, ForeignKey("users.id"), index=True)
     owner = relationship("User", back_populates="tasks")
 
     # Project tasks
-    project_id = Column(Integer, ForeignKey("projects.id"))
+    project_id = Column(Integer, ForeignKey("projects.id"), index=True)
     project = relationship("Project", back_populates="tasks")
 
     # Subtasks
-    parent_id = Column(Integer, ForeignKey("tasks.id"))
+    parent_id = Column(Integer, ForeignKey("tasks.id"), index=True)
 
     parent = relationship(
         "Task",
@@ -42,3 +52,12 @@ class Task(Base):
         remote_side=[parent_id],
         cascade="all, delete-orphan",
     )
+
+    __table_args__ = (
+        # Top level tasks of a user, listed by get_all_own_tasks
+        Index(
+            "ix_tasks_owner_id_top_level",
+            owner_id,
+            postgresql_where=parent_id.is_(None) & project_id.is_(None),
+        ),
+    )
@@ -10,8 +10,8 @@ from starlette.status import HTTP_200_OK, HTTP_201_CREATED, HTTP_404_NOT_FOUND
 
 import common_components.database.db as db
 import tasks_service.tasks_crud as crud
-import users_service.users_schemas as user_schema
-from auth_service.auth_crud import get_current_active_user
+from auth_service.auth_crud import get_current_active_principal
+from auth_service.auth_schemas import Principal
 from common_components.input_validators import validate_task
 from tasks_service import tasks_crud as task_crud
 from tasks_service.tasks_models import Task as task_model
@@ -24,16 +24,16 @@ router = APIRouter(tags=["Tasks"], prefix="/tasks")
 def get_own_tasks(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(db.get_db),
-    current_user: task_model = Depends(get_current_active_user),
+    db: Session = Depends(db.get_read_db),
+    current_user: Principal = Depends(get_current_active_principal),
 ) -> list[task_model]:
     """Get own tasks.
 
     Args:
         skip (int, optional): Number of tasks to skip. Defaults to 0.
         limit (int, optional): Number of tasks to return. Defaults to 100.
-        db (Session, optional): Database session. Defaults to Depends(db.get_db).
-        current_user (task_model, optional): Current user. Defaults to Depends(get_current_active_user).
+        db (Session, optional): Database session. Defaults to Depends(db.get_read_db).
+        current_user (Principal, optional): Current user. Defaults to Depends(get_current_active_principal).
 
     Returns:
         list[Task]: List of SQL Alchemy Task models.
@@ -49,14 +49,14 @@ def get_own_tasks(
 def create_own_task(
     task: TaskCreateModify,
     db: Session = Depends(db.get_db),
-    current_user: user_schema.User = Depends(get_current_active_user),
+    current_user: Principal = Depends(get_current_active_principal),
 ):
     """Create task.
 
     Args:
         task (TaskCreateModify): Task data.
         db (Session, optional): Database session. Defaults to Depends(db.get_db).
-        current_user (user_schema.User, optional): Current user. Defaults to Depends(get_current_active_user).
+        current_user (Principal, optional): Current user. Defaults to Depends(get_current_active_principal).
 
     Returns:
         Task: SQL Alchemy Task model.
@@ -77,7 +77,7 @@ def update_task(
     task_id: int,
     task: TaskCreateModify,
     db: Session = Depends(db.get_db),
-    current_user: user_schema.User = Depends(get_current_active_user),
+    current_user: Principal = Depends(get_current_active_principal),
 ) -> task_model:
     """Update task.
 
@@ -85,7 +85,7 @@ def update_task(
         task_id (int): Task ID.
         task (TaskCreateModify): Task data.
         db (Session, optional): Database session. Defaults to Depends(db.get_db).
-        current_user (user_schema.User, optional): Current user. Defaults to Depends(get_current_active_user).
+        current_user (Principal, optional): Current user. Defaults to Depends(get_current_active_principal).
 
     Returns:
         task_model: SQL Alchemy Task model.
@@ -109,14 +109,14 @@ def update_task(
 def delete_task(
     task_id: int,
     db: Session = Depends(db.get_db),
-    current_user: user_schema.User = Depends(get_current_active_user),
+    current_user: Principal = Depends(get_current_active_principal),
 ):
     """Delete task.
 
     Args:
         task_id (int): Task ID.
         db (Session, optional): Database session. Defaults to Depends(db.get_db).
-        current_user (user_schema.User, optional): Current user. Defaults to Depends(get_current_active_user).
+        current_user (Principal, optional): Current user. Defaults to Depends(get_current_active_principal).
 
     Raises:
         HTTPException: If the task does not exist.
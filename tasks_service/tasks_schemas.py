@@ -5,6 +5,8 @@ The schemas are used to define the structure of the data that is sent between th
 # https://docs.pydantic.dev/latest/usage/postponed_annotations/
 from __future__ import annotations
 
+from datetime import datetime
+
 from pydantic import BaseModel
 
 
@@ -26,6 +28,8 @@ class Task(TaskCreateModify):
 
     id: int
     owner_id: int
+    created_at: datetime
+    updated_at: datetime
     subtasks: list[Task] = []
 
     class Config:
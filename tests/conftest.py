@@ -1,10 +1,27 @@
+import os
+import secrets
+from contextlib import nullcontext
+
+# Secrets that have no default, set before the services are imported
+os.environ.setdefault("INTERNAL_IDENTITY_SECRET", secrets.token_hex(32))
+os.environ.setdefault("PAT_SECRET", secrets.token_hex(32))
+os.environ.setdefault("MONITORING_TOKEN", secrets.token_hex(32))
+
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 
+import api_gateway_service.identity as identity
 from api_gateway_service.api_gateway import app
-from common_components.database.db import Base, get_db, settings
+from api_gateway_service.rate_limiter import rate_limiter
+from api_gateway_service.response_cache import response_cache
+from auth_service.login_throttle import login_throttle
+from auth_service.principal_cache import principal_cache
+from auth_service.revocation import revocation_store
+from auth_service.token_usage import token_usage
+from common_components.database.db import Base, get_db, get_read_db, settings
+from common_components.database.replicas import replica_router
 from tests.test_utils import USERS
 from users_service.users_crud import create_user
 
@@ -49,7 +66,7 @@ def session():
 
 
 @pytest.fixture()
-def client(session):
+def client(session, monkeypatch):
     def override_get_db():
         return session
 
@@ -58,10 +75,29 @@ def client(session):
     create_user(session, USERS["second_user_create"])
 
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_read_db] = override_get_db
+    # The gateway looks the personal access tokens up in the test transaction too
+    monkeypatch.setattr(identity, "database_session", lambda: nullcontext(session))
+
+    # The DB is rolled back after each test, so cached responses, principals and revocations must
+    # not outlive it
+    response_cache.clear()
+    rate_limiter.reset()
+    principal_cache.clear()
+    revocation_store.clear()
+    login_throttle.reset()
+    token_usage.clear()
+    replica_router.reset()
 
     yield TestClient(app)
 
     del app.dependency_overrides[get_db]
+    del app.dependency_overrides[get_read_db]
+
+
+@pytest.fixture()
+def monitoring_headers():
+    return {"X-Monitoring-Token": os.environ["MONITORING_TOKEN"]}
 
 
 @pytest.fixture()
@@ -1,16 +1,45 @@
 """Tests for the authentication service."""
 
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import httpx
 import pytest
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
+from jose import JWTError, jwt
 
+import auth_service.auth_crud as auth_crud
+import auth_service.login_throttle as login_throttle_module
+import auth_service.revocation as revocation
+from api_gateway_service.api_gateway import app
+from api_gateway_service.rate_limiter import rate_limiter
+from auth_service.auth_schemas import Principal
+from auth_service.login_throttle import LoginThrottle, MemoryStore, Policy, login_throttle
+from auth_service.password_hashing import (
+    BCRYPT_ROUNDS,
+    PasswordHasher,
+    make_context,
+    password_hasher,
+)
+from auth_service.principal_cache import PrincipalCache
+from auth_service.revocation import RevocationStore
+from auth_service.token_keys import SigningKeys, TokenVerifier, generate_private_key
+from auth_service.token_usage import token_usage
+from common_components.database import settings
 from tests.test_utils import (
     AUTH_URL,
     PROJECTS_URL,
     TASKS_URL,
     USERS,
+    USERS_URL,
     get_auth_token_second_user,
     mock_test_data,
 )
+from users_service.users_crud import set_user_disabled
+from users_service.users_models import User
 
 PERMISSIONS_ERROR = {"detail": "Not enough permissions"}
 
@@ -79,6 +108,31 @@ def test_login_for_auth_token_wrong_credentials(
     assert response.json() == {"detail": "Incorrect username or password"}
 
 
+def test_login_upgrades_outdated_password_hash(client: TestClient, session) -> None:
+    """Test that a login rehashes a password hashed with an outdated cost.
+
+    Args:
+        client (TestClient): Test client.
+        session (Session): Database session.
+    """
+    mock_user = USERS["current_user_create"]
+    db_user = auth_crud.get_user(mock_user.username, session)
+    db_user.hashed_password = make_context(bcrypt_rounds=4).hash(mock_user.hashed_password)
+    session.commit()
+
+    response = client.post(
+        f"{AUTH_URL}/token",
+        data={"username": mock_user.username, "password": mock_user.hashed_password},
+    )
+
+    assert response.status_code == 200
+    session.refresh(db_user)
+    assert db_user.hashed_password.startswith(f"$2b${BCRYPT_ROUNDS:02d}$")
+    assert auth_crud.verify_and_update_password(
+        mock_user.hashed_password, db_user.hashed_password
+    ) == (True, None)
+
+
 ### AUTHZ ###
 def test_update_project_non_authorized(client: TestClient, auth_token: dict) -> None:
     """Test for update project non authorized.
@@ -176,3 +230,810 @@ def test_update_task_non_authorized(client: TestClient, auth_token: dict) -> Non
 # For users, it is not possible to update or delete other users, so there is no need to test it, that
 # is due to the fact that the user ID is taken from the JWT token, and the user can only update or
 # delete itself.
+
+
+# INTERNAL IDENTITY
+def test_internal_identity_signature_and_expiry() -> None:
+    """Test that only untampered and unexpired internal identities are accepted."""
+    claims = {"sub": "user1", "uid": 1, "disabled": False, "exp": int(time.time()) + 60}
+
+    identity = auth_crud.sign_internal_identity(claims)
+    principal = auth_crud.verify_internal_identity(identity)
+    assert (principal.id, principal.username, principal.disabled) == (1, "user1", False)
+
+    forged = auth_crud.sign_internal_identity({**claims, "uid": 2}).split(".")[0]
+    assert auth_crud.verify_internal_identity(f"{forged}.{identity.split('.')[1]}") is None
+
+    expired = auth_crud.sign_internal_identity({**claims, "exp": int(time.time()) - 1})
+    assert auth_crud.verify_internal_identity(expired) is None
+
+    # Tokens without a user id are resolved by the services themselves
+    assert auth_crud.sign_internal_identity({"sub": "user1", "exp": claims["exp"]}) is None
+
+
+def test_gateway_identity_skips_user_lookup(
+    client: TestClient, auth_token: dict, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Test that requests through the gateway don't decode the token or load the user again.
+
+    Args:
+        client (TestClient): Test client.
+        auth_token (dict): Auth token.
+        monkeypatch (pytest.MonkeyPatch): Pytest monkeypatch.
+    """
+
+    def fail(*args, **kwargs):
+        raise AssertionError("The user should not be loaded")
+
+    monkeypatch.setattr(auth_crud, "get_user", fail)
+
+    response = client.post(TASKS_URL, json=mock_test_data("task"), headers=auth_token)
+    assert response.status_code == 201, response.text
+    assert response.json()["owner_id"] == 1
+
+
+def test_gateway_identity_cannot_be_forged(client: TestClient, auth_token: dict) -> None:
+    """Test that an identity sent by the client is replaced by the one verified by the gateway.
+
+    Args:
+        client (TestClient): Test client.
+        auth_token (dict): Auth token.
+    """
+    second_user_token = get_auth_token_second_user(client)
+    client.post(TASKS_URL, json=mock_test_data("task"), headers=second_user_token)
+
+    payload = auth_crud.sign_internal_identity(
+        {"sub": "user2", "uid": 2, "exp": int(time.time()) + 60}
+    ).split(".")[0]
+    forged = f"{payload}.forged-signature"
+    assert auth_crud.verify_internal_identity(forged) is None
+
+    response = client.get(
+        f"{TASKS_URL}/",
+        headers={**auth_token, auth_crud.INTERNAL_IDENTITY_HEADER: forged},
+    )
+
+    # The request is authenticated as the owner of the token, which has no tasks
+    assert response.status_code == 200
+    assert response.json() == []
+
+
+def test_secrets_are_required_settings(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that a missing secret stops the service instead of falling back to a default.
+
+    Args:
+        monkeypatch (pytest.MonkeyPatch): Pytest monkeypatch.
+    """
+    for name in ("INTERNAL_IDENTITY_SECRET", "PAT_SECRET"):
+        monkeypatch.delenv(name)
+
+        with pytest.raises(RuntimeError, match=name):
+            settings.get_required_setting(name)
+
+    monkeypatch.setenv("INTERNAL_IDENTITY_SECRET", "")
+    with pytest.raises(RuntimeError):
+        settings.get_required_setting("INTERNAL_IDENTITY_SECRET")
+
+
+def test_get_current_user_does_not_block_event_loop(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that the user is loaded from the database outside of the event loop.
+
+    Args:
+        monkeypatch (pytest.MonkeyPatch): Pytest monkeypatch.
+    """
+
+    def slow_get_user(username: str, db=None):
+        time.sleep(0.2)
+        return USERS["current_user_create"]
+
+    monkeypatch.setattr(auth_crud, "get_user", slow_get_user)
+    token = auth_crud.create_access_token({"sub": "user1"})
+
+    async def run() -> float:
+        ticks = 0
+
+        async def ticker() -> None:
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        users = await asyncio.gather(
+            *(
+                auth_crud.get_current_user(request=None, token=token, db=None, read_db=None)
+                for _ in range(4)
+            )
+        )
+        task.cancel()
+
+        assert all(user.username == "user1" for user in users)
+        return ticks
+
+    # The loop kept ticking while the four queries ran in parallel
+    assert asyncio.run(run()) >= 10
+
+
+# PRINCIPAL CACHE
+def test_principal_cache_expiry_eviction_and_invalidation() -> None:
+    """Test that principals expire with their token, are bounded and invalidated per user."""
+    cache = PrincipalCache(ttl=60, max_entries=2)
+    user1, user2 = Principal(id=1, username="user1"), Principal(id=2, username="user2")
+    expiry = time.time() + 600
+
+    cache.set("token-a", user1, expiry, cache.generation)
+    cache.set("token-b", user2, expiry, cache.generation)
+    assert cache.get("token-a") == user1
+
+    # The least recently used entry is evicted
+    cache.set("token-c", user1, expiry, cache.generation)
+    assert cache.get("token-b") is None
+    assert cache.get("token-a") == cache.get("token-c") == user1
+
+    cache.invalidate(1)
+    assert cache.get("token-a") is None and cache.get("token-c") is None
+
+    # Expired tokens and principals resolved before an invalidation are not cached
+    generation = cache.generation
+    cache.set("token-d", user2, time.time() - 1, generation)
+    cache.invalidate(2)
+    cache.set("token-e", user2, expiry, generation)
+    assert cache.get("token-d") is None and cache.get("token-e") is None
+
+
+def test_principal_cache_skips_user_lookup_until_invalidated(
+    client: TestClient, session, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Test that the principal of a token is only loaded once, until the user changes.
+
+    Args:
+        client (TestClient): Test client.
+        session (Session): Database session.
+        monkeypatch (pytest.MonkeyPatch): Pytest monkeypatch.
+    """
+    lookups = []
+    get_user = auth_crud.get_user
+
+    def counting_get_user(username: str, db=None):
+        lookups.append(username)
+        return get_user(username, db)
+
+    monkeypatch.setattr(auth_crud, "get_user", counting_get_user)
+
+    # Tokens without a user id are not resolved by the gateway
+    headers = {"Authorization": f"Bearer {auth_crud.create_access_token({'sub': 'user1'})}"}
+
+    for _ in range(3):
+        assert (
+            client.get(
+                f"{TASKS_URL}/", headers={**headers, "Cache-Control": "no-cache"}
+            ).status_code
+            == 200
+        )
+    assert lookups == ["user1"]
+
+    set_user_disabled(session, user_id=1, disabled=True)
+    response = client.get(f"{TASKS_URL}/", headers={**headers, "Cache-Control": "no-cache"})
+
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Inactive user"}
+    assert lookups == ["user1"] * 2
+
+
+# PASSWORD HASHING
+def test_password_hashing_pool_backpressure_and_metrics() -> None:
+    """Test that hashes run in the pool, and are rejected with a 429 once the queue is full."""
+    hasher = PasswordHasher(workers=1, max_queue=1)
+
+    try:
+        hashed_password = hasher.hash("Password1!")
+        assert hasher.verify("Password1!", hashed_password)
+        assert not hasher.verify("wrong", hashed_password)
+
+        # A hash running and another one queued
+        hasher.pending = 2
+        with pytest.raises(HTTPException) as error:
+            hasher.hash("Password1!")
+        hasher.pending = 0
+    finally:
+        hasher.shutdown()
+
+    assert error.value.status_code == 429
+    assert int(error.value.headers["Retry-After"]) >= 1
+
+    stats = hasher.stats()
+    assert (stats["completed"], stats["rejected"], stats["queued"]) == (3, 1, 0)
+    assert stats["hash_latency_p50_ms"] > 0
+
+
+def test_password_hashing_stats(
+    client: TestClient, auth_token: dict, monitoring_headers: dict
+) -> None:
+    """Test that the password hashing metrics are exposed by the gateway.
+
+    Args:
+        client (TestClient): Test client.
+        auth_token (dict): Auth token.
+        monitoring_headers (dict): Headers of the monitoring system.
+    """
+    response = client.get("/api/gateway/password-hashing", headers=monitoring_headers)
+
+    assert response.status_code == 200
+    # The test users were created and one of them logged in
+    assert response.json()["completed"] >= 3
+    assert response.json()["hash_latency_p99_ms"] > 0
+
+
+class HeldExecutor:
+    """Executor whose jobs wait until they are released, to saturate the password hashing pool."""
+
+    def __init__(self) -> None:
+        self.futures: list[Future] = []
+        self.result = None
+
+    def submit(self, function, *args) -> Future:
+        future: Future = Future()
+        # Running in a worker, it can't be cancelled anymore
+        future.set_running_or_notify_cancel()
+        self.futures.append(future)
+        if self.result is not None:
+            future.set_result(self.result)
+        return future
+
+    def release(self, result) -> None:
+        """Complete the jobs with a result, and the next ones right away."""
+        self.result = (result, 0.0)
+        for future in self.futures:
+            if not future.done():
+                future.set_result(self.result)
+
+
+def test_password_hashing_cancelled_hash_keeps_its_place() -> None:
+    """Test that a hash whose caller stopped waiting holds its place until the worker is done."""
+    hasher = PasswordHasher(workers=1, max_queue=0)
+    executor = HeldExecutor()
+    hasher.executor = executor
+
+    async def run() -> None:
+        task = asyncio.create_task(hasher.hash_async("Password1!"))
+        while not executor.futures:
+            await asyncio.sleep(0)
+
+        # The client disconnected, but the worker is still hashing
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        assert hasher.pending == 1
+        with pytest.raises(HTTPException) as error:
+            await hasher.hash_async("Password1!")
+        assert error.value.status_code == 429
+
+        executor.release("hash")
+        assert hasher.pending == 0
+        assert await hasher.hash_async("Password1!") == "hash"
+
+    asyncio.run(run())
+
+
+def test_password_hashing_queue_does_not_starve_sync_routes(
+    client: TestClient, auth_token: dict, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Test that logins waiting for the password hashing pool don't hold threads of the threadpool.
+
+    Args:
+        client (TestClient): Test client.
+        auth_token (dict): Auth token.
+        monkeypatch (pytest.MonkeyPatch): Pytest monkeypatch.
+    """
+    executor = HeldExecutor()
+    monkeypatch.setattr(password_hasher, "executor", executor)
+    monkeypatch.setattr(password_hasher, "max_queue", 100)
+    monkeypatch.setattr(rate_limiter, "enabled", False)
+    monkeypatch.setattr(login_throttle, "enabled", False)
+    # The logins don't share the database session of the test
+    monkeypatch.setattr(
+        auth_crud, "get_user", lambda username, db=None: User(hashed_password="hash")
+    )
+
+    # More than the 40 threads of the threadpool
+    logins = 50
+
+    async def run() -> tuple[httpx.Response, list[httpx.Response]]:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as http:
+            tasks = [
+                asyncio.create_task(
+                    http.post(
+                        f"/{AUTH_URL}/token", data={"username": "user1", "password": "Wrong1!"}
+                    )
+                )
+                for _ in range(logins)
+            ]
+
+            async def wait_for_logins() -> None:
+                while len(executor.futures) < logins:
+                    await asyncio.sleep(0.01)
+
+            try:
+                await asyncio.wait_for(wait_for_logins(), timeout=5)
+
+                # Every hash is queued, a sync route still gets a thread
+                response = await asyncio.wait_for(
+                    http.get(f"{TASKS_URL}/", headers=auth_token), timeout=5
+                )
+            finally:
+                executor.release((False, None))
+
+            return response, await asyncio.gather(*tasks)
+
+    response, login_responses = asyncio.run(run())
+
+    assert response.status_code == 200
+    assert [login.status_code for login in login_responses] == [401] * logins
+    assert password_hasher.pending == 0
+
+
+# TOKEN KEYS
+def test_tokens_are_verified_with_the_published_keys(client: TestClient) -> None:
+    """Test that a token can be verified with the public keys of the JWKS endpoint only.
+
+    Args:
+        client (TestClient): Test client.
+    """
+    token = auth_crud.create_access_token({"sub": "user1"})
+
+    response = client.get(f"{AUTH_URL}/.well-known/jwks.json")
+
+    assert response.status_code == 200
+    assert "max-age" in response.headers["Cache-Control"]
+    jwks = response.json()
+    assert all("d" not in key for key in jwks["keys"])
+    assert jwt.get_unverified_header(token)["kid"] in {key["kid"] for key in jwks["keys"]}
+    assert TokenVerifier(lambda: jwks).decode(token)["sub"] == "user1"
+
+    # The shared secret tokens aren't accepted anymore
+    with pytest.raises(JWTError):
+        auth_crud.decode_access_token(jwt.encode({"sub": "user1"}, "secret", algorithm="HS256"))
+
+
+def test_token_verifier_key_rotation(tmp_path) -> None:
+    """Test that the verifier caches the keys, and fetches them again for a new kid only.
+
+    Args:
+        tmp_path (Path): Directory of the signing keys.
+    """
+    (tmp_path / "2026-01.pem").write_text(generate_private_key())
+    old_keys = SigningKeys(str(tmp_path))
+    fetches = []
+
+    def get_jwks() -> dict:
+        fetches.append(time.monotonic())
+        return signing_keys.jwks()
+
+    signing_keys = old_keys
+    verifier = TokenVerifier(get_jwks, min_refresh_interval=0)
+    old_token = old_keys.sign({"sub": "user1"})
+
+    assert verifier.decode(old_token)["sub"] == "user1"
+    assert verifier.decode(old_token)["sub"] == "user1"
+    assert len(fetches) == 1
+
+    # Rotate: the new key is the last kid in sorted order
+    (tmp_path / "2026-02.pem").write_text(generate_private_key())
+    signing_keys = SigningKeys(str(tmp_path))
+    new_token = signing_keys.sign({"sub": "user1"})
+
+    assert jwt.get_unverified_header(new_token)["kid"] == "2026-02"
+    assert verifier.decode(new_token)["sub"] == "user1"
+    assert verifier.decode(old_token)["sub"] == "user1"
+    assert len(fetches) == 2
+
+    # Unknown kids don't trigger a fetch more than once per interval
+    verifier.min_refresh_interval = 60
+    forged_token = jwt.encode(
+        {"sub": "user1"}, generate_private_key(), algorithm="RS256", headers={"kid": "forged"}
+    )
+    for _ in range(3):
+        with pytest.raises(JWTError):
+            verifier.decode(forged_token)
+    assert len(fetches) == 2
+
+
+# REFRESH TOKENS
+def login(client: TestClient) -> dict:
+    """Log in as the current user.
+
+    Args:
+        client (TestClient): Test client.
+
+    Returns:
+        dict: Access token and refresh token.
+    """
+    mock_user = USERS["current_user_create"]
+    response = client.post(
+        f"{AUTH_URL}/token",
+        data={"username": mock_user.username, "password": mock_user.hashed_password},
+    )
+    return response.json()
+
+
+def test_refresh_token_rotation_and_reuse_detection(client: TestClient) -> None:
+    """Test that a refresh token can be used once, and that reusing it revokes its family.
+
+    Args:
+        client (TestClient): Test client.
+    """
+    tokens = login(client)
+
+    response = client.post(f"{AUTH_URL}/refresh", json={"refresh_token": tokens["refresh_token"]})
+
+    assert response.status_code == 200
+    new_tokens = response.json()
+    assert new_tokens["refresh_token"] != tokens["refresh_token"]
+    new_headers = {"Authorization": f"Bearer {new_tokens['access_token']}"}
+    assert client.get(f"{USERS_URL}/me", headers=new_headers).status_code == 200
+
+    # The refresh token was stolen and used again: the whole family is revoked
+    response = client.post(f"{AUTH_URL}/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert response.status_code == 401
+
+    response = client.post(
+        f"{AUTH_URL}/refresh", json={"refresh_token": new_tokens["refresh_token"]}
+    )
+    assert response.status_code == 401
+    assert client.get(f"{USERS_URL}/me", headers=new_headers).status_code == 401
+    assert client.get(PROJECTS_URL, headers=new_headers).status_code == 401
+
+
+def test_refresh_token_is_not_an_access_token(client: TestClient) -> None:
+    """Test that a refresh token can't authenticate a request, nor an access token be refreshed.
+
+    Args:
+        client (TestClient): Test client.
+    """
+    tokens = login(client)
+
+    headers = {"Authorization": f"Bearer {tokens['refresh_token']}"}
+    assert client.get(f"{USERS_URL}/me", headers=headers).status_code == 401
+
+    response = client.post(f"{AUTH_URL}/refresh", json={"refresh_token": tokens["access_token"]})
+    assert response.status_code == 401
+
+
+def test_logout_revokes_the_session(client: TestClient) -> None:
+    """Test that logging out revokes the access token and the refresh token.
+
+    Args:
+        client (TestClient): Test client.
+    """
+    tokens = login(client)
+    other_session = login(client)
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+
+    # Cache the principal
+    assert client.get(PROJECTS_URL, headers=headers).status_code == 200
+
+    assert client.post(f"{AUTH_URL}/logout", headers=headers).status_code == 204
+
+    assert client.get(PROJECTS_URL, headers=headers).status_code == 401
+    response = client.post(f"{AUTH_URL}/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert response.status_code == 401
+
+    other_headers = {"Authorization": f"Bearer {other_session['access_token']}"}
+    assert client.get(PROJECTS_URL, headers=other_headers).status_code == 200
+
+
+def test_disabled_or_deleted_user_tokens_are_revoked(client: TestClient, session) -> None:
+    """Test that the tokens issued to a user are rejected once it is disabled or deleted.
+
+    Args:
+        client (TestClient): Test client.
+        session (Session): Database session.
+    """
+    tokens = login(client)
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+    identity = auth_crud.sign_internal_identity(jwt.get_unverified_claims(tokens["access_token"]))
+
+    # Cache the principal
+    assert client.get(PROJECTS_URL, headers=headers).status_code == 200
+
+    set_user_disabled(session, user_id=1, disabled=True)
+
+    assert client.get(PROJECTS_URL, headers=headers).status_code == 401
+    # An identity signed by the gateway before the user was disabled is rejected as well
+    assert auth_crud.verify_internal_identity(identity) is None
+    response = client.post(f"{AUTH_URL}/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert response.status_code == 401
+
+    second_user_headers = get_auth_token_second_user(client)
+    assert client.get(PROJECTS_URL, headers=second_user_headers).status_code == 200
+    assert client.delete(f"{USERS_URL}/me", headers=second_user_headers).status_code == 204
+
+    assert client.get(PROJECTS_URL, headers=second_user_headers).status_code == 401
+
+
+def test_revocation_store_expiry_and_bloom_filter(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that revocations expire by bucket, and that the Bloom filter skips the lookups.
+
+    Args:
+        monkeypatch (pytest.MonkeyPatch): Pytest monkeypatch.
+    """
+    now = 1_000_000.0
+    monkeypatch.setattr(revocation.time, "time", lambda: now)
+    store = RevocationStore(bucket=60, bloom_capacity=1000, bloom_error_rate=0.01)
+
+    store.revoke("short", now + 30)
+    store.revoke("long", now + 600)
+    store.revoke("expired", now - 1)
+
+    assert store.is_revoked("short") and store.is_revoked("long")
+    assert not store.is_revoked("expired")
+    assert not any(store.is_revoked(f"valid-{i}") for i in range(1000))
+    # The Bloom filter answered nearly all the valid tokens
+    assert store.stats()["bloom_skips"] > 950
+
+    now += 120
+    assert not store.is_revoked("short")
+    assert store.is_revoked("long")
+    assert store.stats()["revoked"] == 1
+
+    now += 600
+    assert not store.is_revoked("long")
+    assert store.stats()["buckets"] == 0
+
+
+# LOGIN THROTTLING
+def test_login_throttle_delays_and_lockout(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test the progressive delays and the lockout of a username.
+
+    Args:
+        monkeypatch (pytest.MonkeyPatch): Pytest monkeypatch.
+    """
+    now = 1_000_000.0
+    monkeypatch.setattr(login_throttle_module.time, "time", lambda: now)
+    throttle = LoginThrottle(
+        store=MemoryStore(window=600),
+        window=600,
+        base_delay=1,
+        max_delay=60,
+        username=Policy(free_failures=2, lockout=4),
+        ip=Policy(free_failures=100, lockout=200),
+        enabled=True,
+    )
+
+    def retry_after() -> int:
+        with pytest.raises(HTTPException) as error:
+            throttle.attempt("user1", "10.0.0.1")
+        assert error.value.status_code == 429
+        return int(error.value.headers["Retry-After"])
+
+    for _ in range(2):
+        throttle.attempt("user1", "10.0.0.1")
+
+    # The free failures are used, every failure doubles the delay
+    throttle.attempt("user1", "10.0.0.1")
+    assert retry_after() == 1
+    now += 1
+    throttle.attempt("user1", "10.0.0.1")
+
+    # Locked out until the oldest failure leaves the window
+    now += 60
+    assert retry_after() == 600 - 61
+    # Other usernames from the same IP are not affected
+    throttle.attempt("user2", "10.0.0.1")
+
+    now += 600 - 61
+    attempt = throttle.attempt("user1", "10.0.0.1")
+    throttle.record_success("user1", "10.0.0.1", attempt)
+    assert throttle.store.failures("username:user1", now) == []
+    assert throttle.stats()["locked_out"] == 1
+
+
+def test_login_throttle_counts_concurrent_attempts() -> None:
+    """Test that attempts sent in parallel are throttled as if they had failed in sequence."""
+    throttle = LoginThrottle(
+        store=MemoryStore(window=600),
+        window=600,
+        base_delay=1,
+        max_delay=60,
+        username=Policy(free_failures=2, lockout=4),
+        ip=Policy(free_failures=100, lockout=200),
+        enabled=True,
+    )
+    barrier = threading.Barrier(20)
+
+    def attempt() -> bool:
+        barrier.wait()
+        try:
+            throttle.attempt("user1", "10.0.0.1")
+        except HTTPException:
+            return False
+        return True
+
+    with ThreadPoolExecutor(max_workers=20) as executor:
+        allowed = list(executor.map(lambda _: attempt(), range(20)))
+
+    # The free failures and the first delayed one, the others wait for their delay
+    assert allowed.count(True) == 3
+    assert len(throttle.store.failures("username:user1", time.time())) == 3
+    assert len(throttle.store.failures("ip:10.0.0.1", time.time())) == 3
+
+
+def test_login_throttled_before_hashing(
+    client: TestClient, monkeypatch: pytest.MonkeyPatch, monitoring_headers: dict
+) -> None:
+    """Test that a throttled login is rejected without verifying the password.
+
+    Args:
+        client (TestClient): Test client.
+        monkeypatch (pytest.MonkeyPatch): Pytest monkeypatch.
+        monitoring_headers (dict): Headers of the monitoring system.
+    """
+    monkeypatch.setitem(login_throttle.policies, "username", Policy(free_failures=1, lockout=3))
+    mock_user = USERS["current_user_create"]
+
+    for _ in range(2):
+        response = client.post(
+            f"{AUTH_URL}/token", data={"username": mock_user.username, "password": "wrong"}
+        )
+        assert response.status_code == 401
+
+    hashes = auth_crud.password_hasher.stats()["completed"]
+    response = client.post(
+        f"{AUTH_URL}/token",
+        data={"username": mock_user.username, "password": mock_user.hashed_password},
+    )
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+    assert auth_crud.password_hasher.stats()["completed"] == hashes
+    response = client.get("/api/gateway/login-throttle", headers=monitoring_headers)
+    assert response.json()["throttled"] == 1
+
+
+# PERSONAL ACCESS TOKENS
+def test_personal_access_token_scopes(client: TestClient, auth_token: dict) -> None:
+    """Test that a personal access token authenticates the requests its scopes allow.
+
+    Args:
+        client (TestClient): Test client.
+        auth_token (dict): Auth token.
+    """
+    response = client.post(
+        f"{AUTH_URL}/tokens",
+        json={"name": "ci", "scopes": ["projects:write", "users:read"], "expires_in_days": 30},
+        headers=auth_token,
+    )
+
+    assert response.status_code == 201
+    token = response.json()["token"]
+    assert token.startswith(auth_crud.PAT_PREFIX)
+    assert response.json()["scopes"] == ["projects:write", "users:read"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    assert client.get(f"{USERS_URL}/me", headers=headers).json()["username"] == "user1"
+    project_data = mock_test_data("project")
+    assert client.post(PROJECTS_URL, json=project_data, headers=headers).status_code == 201
+    assert client.get(PROJECTS_URL, headers=headers).status_code == 200
+
+    # Out of the scopes of the token
+    assert client.get(TASKS_URL, headers=headers).json() == PERMISSIONS_ERROR
+    response = client.put(f"{USERS_URL}/me/details", json={}, headers=headers)
+    assert response.json() == PERMISSIONS_ERROR
+    assert client.get(f"{AUTH_URL}/tokens", headers=headers).status_code == 403
+
+    # Only the digest is stored
+    tokens = client.get(f"{AUTH_URL}/tokens", headers=auth_token).json()
+    assert [token["name"] for token in tokens] == ["ci"]
+    assert "token" not in tokens[0]
+
+
+def test_personal_access_token_revocation(client: TestClient, auth_token: dict) -> None:
+    """Test that a revoked or unknown personal access token is rejected, even if cached.
+
+    Args:
+        client (TestClient): Test client.
+        auth_token (dict): Auth token.
+    """
+    created = client.post(
+        f"{AUTH_URL}/tokens", json={"name": "ci", "scopes": ["projects:read"]}, headers=auth_token
+    ).json()
+    headers = {"Authorization": f"Bearer {created['token']}"}
+    assert client.get(PROJECTS_URL, headers=headers).status_code == 200
+
+    response = client.delete(f"{AUTH_URL}/tokens/{created['id']}", headers=auth_token)
+
+    assert response.status_code == 204
+    assert client.get(PROJECTS_URL, headers=headers).status_code == 401
+    assert (
+        client.delete(f"{AUTH_URL}/tokens/{created['id']}", headers=auth_token).status_code == 404
+    )
+    headers = {"Authorization": f"Bearer {auth_crud.PAT_PREFIX}unknown"}
+    assert client.get(PROJECTS_URL, headers=headers).status_code == 401
+
+
+def test_personal_access_token_through_gateway(
+    client: TestClient, auth_token: dict, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Test that the gateway resolves a personal access token and forwards its identity.
+
+    Args:
+        client (TestClient): Test client.
+        auth_token (dict): Auth token.
+        monkeypatch (pytest.MonkeyPatch): Pytest monkeypatch.
+    """
+    token = client.post(
+        f"{AUTH_URL}/tokens", json={"name": "ci", "scopes": ["tasks:read"]}, headers=auth_token
+    ).json()["token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    lookups = []
+    get_personal_access_token = auth_crud.get_personal_access_token
+
+    def counting_get_personal_access_token(db, token):
+        lookups.append(token)
+        return get_personal_access_token(db, token)
+
+    monkeypatch.setattr(auth_crud, "get_personal_access_token", counting_get_personal_access_token)
+
+    first = client.get(f"{TASKS_URL}/", headers=headers)
+    second = client.get(f"{TASKS_URL}/", headers=headers)
+
+    # Looked up once by the gateway, the services trust the forwarded identity
+    assert first.status_code == 200 and first.json() == []
+    assert first.headers["x-cache"] == "MISS"
+    assert second.headers["x-cache"] == "HIT"
+    assert lookups == [token]
+
+    # Rate limited per token
+    scope = {"type": "http", "headers": [(b"authorization", f"Bearer {token}".encode())]}
+    assert rate_limiter.client_key(scope, "read") == (
+        f"token:pat:{auth_crud.get_token_digest(token)}"
+    )
+
+    # The responses cached for the user's session are not served to the token
+    assert client.get(f"{PROJECTS_URL}/", headers=auth_token).status_code == 200
+    response = client.get(f"{PROJECTS_URL}/", headers=headers)
+    assert response.status_code == 403
+    assert response.json() == PERMISSIONS_ERROR
+
+    headers = {"Authorization": f"Bearer {auth_crud.PAT_PREFIX}unknown"}
+    assert client.get(f"{TASKS_URL}/", headers=headers).status_code == 401
+
+
+def test_personal_access_token_last_use_is_batched(
+    client: TestClient, auth_token: dict, session
+) -> None:
+    """Test that the last use of the tokens is written in batches, not on every request.
+
+    Args:
+        client (TestClient): Test client.
+        auth_token (dict): Auth token.
+        session (Session): Database session.
+    """
+    tokens = [
+        client.post(
+            f"{AUTH_URL}/tokens", json={"name": name, "scopes": ["tasks:read"]}, headers=auth_token
+        ).json()
+        for name in ("first", "second")
+    ]
+
+    for token in tokens:
+        for _ in range(3):
+            response = client.get(TASKS_URL, headers={"Authorization": f"Bearer {token['token']}"})
+            assert response.status_code == 200
+
+    # Not written yet
+    assert all(
+        token["last_used_at"] is None
+        for token in client.get(f"{AUTH_URL}/tokens", headers=auth_token).json()
+    )
+    assert len(token_usage.pending) == 2
+
+    token_usage.flush(session)
+
+    assert token_usage.pending == {} and token_usage.flushes == 1
+    assert all(
+        token["last_used_at"] is not None
+        for token in client.get(f"{AUTH_URL}/tokens", headers=auth_token).json()
+    )
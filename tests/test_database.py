@@ -0,0 +1,548 @@
+"""Tests for the database components."""
+
+import asyncio
+import threading
+import time
+
+import pytest
+from alembic import command
+from alembic.config import Config
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+import common_components.async_input_validators as async_validators
+import common_components.database.db as db
+import projects_service.projects_async_crud as projects_async_crud
+import tasks_service.tasks_async_crud as tasks_async_crud
+import users_service.users_async_crud as users_async_crud
+from common_components.database import settings
+from common_components.database.pool import InstrumentedQueuePool
+from common_components.database.replicas import Replica, ReplicaRouter, create_replica_engine
+from projects_service.projects_schemas import Project, ProjectBase
+from tasks_service.tasks_schemas import Task, TaskCreateModify
+from tests.test_utils import USERS
+from users_service.users_crud import create_user
+from users_service.users_schemas import User
+
+
+# CONNECTION POOL
+def test_pool_settings_per_service(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that a service setting takes precedence over the global one.
+
+    Args:
+        monkeypatch (pytest.MonkeyPatch): Pytest monkeypatch.
+    """
+    monkeypatch.setattr(settings, "SERVICE_NAME", "auth")
+    monkeypatch.setenv("DATABASE_POOL_SIZE", "20")
+    monkeypatch.setenv("AUTH_DATABASE_POOL_SIZE", "3")
+
+    assert settings._get_database_setting("DATABASE_POOL_SIZE", "5") == "3"
+    assert settings._get_database_setting("DATABASE_MAX_OVERFLOW", "10") == "10"
+
+    monkeypatch.setattr(settings, "SERVICE_NAME", "tasks")
+    assert settings._get_database_setting("DATABASE_POOL_SIZE", "5") == "20"
+
+
+def test_engine_statement_timeout() -> None:
+    """Test that the connections of the engine have the statement timeout set."""
+    with db.engine.connect() as connection:
+        statement_timeout = connection.execute(text("SHOW statement_timeout")).scalar()
+
+    assert statement_timeout == f"{settings.DATABASE_STATEMENT_TIMEOUT // 1000}s"
+
+
+def test_pool_records_checkouts_and_timeouts() -> None:
+    """Test that the pool records the checkouts, and the ones that timed out."""
+    engine = create_engine(
+        settings.DATABASE_URL,
+        poolclass=InstrumentedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.1,
+    )
+
+    try:
+        with engine.connect():
+            stats = engine.pool.stats()
+            assert (stats["checked_out"], stats["idle"]) == (1, 0)
+
+            # The only connection is checked out
+            with pytest.raises(PoolTimeoutError):
+                engine.connect()
+
+        stats = engine.pool.stats()
+    finally:
+        engine.dispose()
+
+    assert (stats["checked_out"], stats["idle"]) == (0, 1)
+    assert stats["checkouts"] == 1
+    assert (stats["checkout_failures"], stats["checkout_timeouts"]) == (1, 1)
+    assert stats["wait_p99_ms"] >= 0
+
+
+def test_database_pool_stats(client: TestClient, monitoring_headers: dict) -> None:
+    """Test that the pool statistics are exposed by the gateway.
+
+    Args:
+        client (TestClient): Test client.
+        monitoring_headers (dict): Headers of the monitoring system.
+    """
+    response = client.get("/api/gateway/database-pool", headers=monitoring_headers)
+
+    assert response.status_code == 200
+    assert response.json()["size"] == settings.DATABASE_POOL_SIZE
+    assert {"checked_out", "idle", "wait_p99_ms", "checkout_timeouts"} <= response.json().keys()
+
+
+# READ REPLICAS
+# The local database stands in for the replicas: it is not in recovery, so it has no lag
+def test_replica_router_skips_lagging_and_unreachable_replicas() -> None:
+    """Test that the reads go to the replicas that can be reached and don't lag too much."""
+    replica = Replica(create_replica_engine(settings.DATABASE_URL))
+    lagging = Replica(create_replica_engine(settings.DATABASE_URL))
+    unreachable = Replica(create_replica_engine("postgresql://todo_app@localhost:1/todo_app"))
+    router = ReplicaRouter([lagging, unreachable, replica], max_lag=5, lag_check_interval=60)
+
+    try:
+        router.check_lags()
+        # The lag is measured once per interval
+        lagging.checked_at, lagging.lag = float("inf"), 30.0
+
+        assert {router.choose(None) for _ in range(3)} == {replica.engine}
+        assert replica.lag == 0
+        assert unreachable.lag is None
+
+        replica.lag = 10.0
+        assert router.choose(None) is None
+    finally:
+        for engine in (replica.engine, lagging.engine, unreachable.engine):
+            engine.dispose()
+
+    stats = router.stats()
+    assert (stats["replica_reads"], stats["primary_reads"]) == (3, 1)
+    # 3 skipped by the round robin, then 3 once every replica lags
+    assert stats["lagging_skips"] == 3 + 3
+
+
+def test_replica_router_reads_your_writes() -> None:
+    """Test that a client reads from the primary for a while after it wrote."""
+    replica = Replica(create_replica_engine(settings.DATABASE_URL))
+    router = ReplicaRouter([replica], read_your_writes_window=10)
+
+    try:
+        router.check_lags()
+        router.record_write("user:john")
+
+        assert router.choose("user:john") is None
+        assert router.choose("user:jane") is replica.engine
+        assert router.choose(None) is replica.engine
+
+        # After the window, the replica has caught up
+        router.writes["user:john"] -= 10
+        assert router.choose("user:john") is replica.engine
+    finally:
+        replica.engine.dispose()
+
+    assert router.stats()["recent_write_reads"] == 1
+
+
+def test_replica_lag_is_checked_in_the_background(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that the requests don't wait for the lag check of a replica that is slow to answer.
+
+    Args:
+        monkeypatch (pytest.MonkeyPatch): Pytest monkeypatch.
+    """
+    replica = Replica(create_replica_engine(settings.DATABASE_URL))
+    router = ReplicaRouter([replica], lag_check_interval=60)
+    answered = threading.Event()
+    check_lag = replica.check_lag
+
+    def slow_check_lag() -> float | None:
+        answered.wait(5)
+        return check_lag()
+
+    monkeypatch.setattr(replica, "check_lag", slow_check_lag)
+
+    try:
+        # The lag is unknown until the replica answers, the reads go to the primary meanwhile
+        started = time.monotonic()
+        assert [router.choose(None) for _ in range(3)] == [None] * 3
+        assert time.monotonic() - started < 1
+
+        answered.set()
+        with replica.lock:
+            assert router.choose(None) is replica.engine
+    finally:
+        replica.engine.dispose()
+
+    assert router.stats()["lagging_skips"] == 3
+
+
+def test_replica_sessions_are_read_only() -> None:
+    """Test that a write sent to a replica session fails."""
+    engine = create_replica_engine(settings.DATABASE_URL)
+
+    try:
+        with db.SessionLocal(bind=engine) as replica_session:
+            assert replica_session.execute(text("SELECT count(*) FROM users")).scalar() >= 0
+
+            with pytest.raises(DBAPIError, match="read-only transaction"):
+                replica_session.execute(text("UPDATE users SET disabled = false"))
+    finally:
+        engine.dispose()
+
+
+def test_primary_sessions_record_writes(session: Session, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that the commits of a primary session that wrote are recorded for its client.
+
+    Args:
+        session (Session): Test session, whose transaction is rolled back at the end.
+        monkeypatch (pytest.MonkeyPatch): Pytest monkeypatch.
+    """
+    router = ReplicaRouter([])
+    monkeypatch.setattr(db, "replica_router", router)
+
+    def primary_session(client_key: str) -> Session:
+        return db.SessionLocal(
+            bind=session.connection(),
+            info={"client_key": client_key},
+            join_transaction_mode="create_savepoint",
+        )
+
+    with primary_session("user:reader") as reader:
+        reader.execute(text("SELECT 1"))
+        reader.commit()
+
+    with primary_session("user:writer") as writer:
+        create_user(writer, USERS["current_user_create"])
+
+    assert not router.wrote_recently("user:reader")
+    assert router.wrote_recently("user:writer")
+
+
+def test_database_replica_stats(client: TestClient, monitoring_headers: dict) -> None:
+    """Test that the replica statistics are exposed by the gateway.
+
+    Args:
+        client (TestClient): Test client.
+        monitoring_headers (dict): Headers of the monitoring system.
+    """
+    response = client.get("/api/gateway/database-replicas", headers=monitoring_headers)
+
+    assert response.status_code == 200
+    assert response.json()["replicas"] == {}
+    assert {"replica_reads", "primary_reads", "lagging_skips"} <= response.json().keys()
+
+
+# ASYNC DATABASE LAYER
+def run_in_async_session(test) -> None:
+    """Run an async test in an AsyncSession, rolled back at the end like the sync test sessions.
+
+    Args:
+        test: Coroutine function taking the AsyncSession.
+    """
+
+    async def run() -> None:
+        engine = create_async_engine(settings.ASYNC_DATABASE_URL, poolclass=NullPool)
+        try:
+            async with engine.connect() as connection:
+                transaction = await connection.begin()
+                session = AsyncSession(
+                    bind=connection,
+                    join_transaction_mode="create_savepoint",
+                    expire_on_commit=False,
+                )
+                try:
+                    await test(session)
+                finally:
+                    await session.close()
+                    await transaction.rollback()
+        finally:
+            await engine.dispose()
+
+    asyncio.run(run())
+
+
+def without_timestamps(task: dict) -> dict:
+    """Remove the timestamps, set by the database, of a serialized task and its subtasks.
+
+    Args:
+        task (dict): Serialized task.
+
+    Returns:
+        dict: Serialized task without timestamps.
+    """
+    assert task.pop("created_at") and task.pop("updated_at")
+    task["subtasks"] = [without_timestamps(subtask) for subtask in task["subtasks"]]
+
+    return task
+
+
+def test_async_engine_statement_timeout() -> None:
+    """Test that the connections of the async engine have the statement timeout set."""
+
+    async def show_statement_timeout() -> str:
+        async with db.async_engine.connect() as connection:
+            return (await connection.execute(text("SHOW statement_timeout"))).scalar()
+
+    try:
+        statement_timeout = asyncio.run(show_statement_timeout())
+    finally:
+        # The pooled connections belong to the event loop closed by asyncio.run
+        asyncio.run(db.async_engine.dispose())
+
+    assert statement_timeout == f"{settings.DATABASE_STATEMENT_TIMEOUT // 1000}s"
+
+
+def test_async_crud_loads_nested_relationships(session: Session) -> None:
+    """Test that the async CRUD functions eagerly load what the schemas serialize.
+
+    Args:
+        session (Session): Sync test session, resetting the sequences at the end.
+    """
+
+    async def test(db: AsyncSession) -> None:
+        db_user = await users_async_crud.create_user(db, USERS["current_user_create"])
+        db_project = await projects_async_crud.create_project(
+            db, ProjectBase(name="Async project", description="Description"), user_id=db_user.id
+        )
+        db_task = await tasks_async_crud.create_task(
+            db, TaskCreateModify(title="Task"), user_id=db_user.id
+        )
+        db_subtask = await tasks_async_crud.create_task(
+            db, TaskCreateModify(title="Subtask", parent_id=db_task.id), user_id=db_user.id
+        )
+        await tasks_async_crud.create_task(
+            db, TaskCreateModify(title="Subsubtask", parent_id=db_subtask.id), user_id=db_user.id
+        )
+        await tasks_async_crud.create_task(
+            db,
+            TaskCreateModify(title="Project task", project_id=db_project.id),
+            user_id=db_user.id,
+        )
+
+        # Serializing outside of the greenlet would fail on any relationship left to lazy load
+        tasks = await tasks_async_crud.get_all_own_tasks(db, owner_id=db_user.id)
+        assert [
+            without_timestamps(Task.model_validate(task, from_attributes=True).model_dump())
+            for task in tasks
+        ] == [
+            {
+                "title": "Task",
+                "description": None,
+                "priority": 0,
+                "parent_id": None,
+                "project_id": None,
+                "id": db_task.id,
+                "owner_id": db_user.id,
+                "subtasks": [
+                    {
+                        "title": "Subtask",
+                        "description": None,
+                        "priority": 0,
+                        "parent_id": db_task.id,
+                        "project_id": None,
+                        "id": db_subtask.id,
+                        "owner_id": db_user.id,
+                        "subtasks": [
+                            {
+                                "title": "Subsubtask",
+                                "description": None,
+                                "priority": 0,
+                                "parent_id": db_subtask.id,
+                                "project_id": None,
+                                "id": db_subtask.id + 1,
+                                "owner_id": db_user.id,
+                                "subtasks": [],
+                            }
+                        ],
+                    }
+                ],
+            }
+        ]
+
+        projects = await projects_async_crud.get_owned_and_collaborated_projects(
+            db, user_id=db_user.id
+        )
+        assert [
+            Project.model_validate(project, from_attributes=True).tasks[0].title
+            for project in projects
+        ] == ["Project task"]
+
+        user = User.model_validate(
+            await users_async_crud.get_user_by_id(db, db_user.id), from_attributes=True
+        )
+        assert [task.title for task in user.tasks] == [
+            "Task",
+            "Subtask",
+            "Subsubtask",
+            "Project task",
+        ]
+        assert [project.name for project in user.owned_projects] == ["Async project"]
+
+        await tasks_async_crud.delete_task(db, owner_id=db_user.id, task_id=db_task.id)
+        assert await tasks_async_crud.get_all_own_tasks(db, owner_id=db_user.id) == []
+
+    run_in_async_session(test)
+
+
+def test_async_validators(session: Session) -> None:
+    """Test that the async validators raise the same errors as the sync ones.
+
+    Args:
+        session (Session): Sync test session, resetting the sequences at the end.
+    """
+
+    async def test(db: AsyncSession) -> None:
+        db_user = await users_async_crud.create_user(db, USERS["current_user_create"])
+
+        assert await async_validators.validate_user(db, user_id=db_user.id, username="newuser")
+
+        with pytest.raises(HTTPException) as error:
+            await async_validators.validate_user(db, username=db_user.username)
+        assert error.value.detail == "Username already registered"
+
+        with pytest.raises(HTTPException) as error:
+            await async_validators.validate_task(db, task_id=1, user_id=db_user.id)
+        assert error.value.status_code == 404
+
+        with pytest.raises(HTTPException) as error:
+            await async_validators.validate_project(db, project_id=1)
+        assert error.value.detail == "Project not found"
+
+    run_in_async_session(test)
+
+
+# MIGRATIONS
+@pytest.fixture()
+def migrations_database(monkeypatch: pytest.MonkeyPatch):
+    """Create an empty database next to the test database, for the migrations to run against.
+
+    Args:
+        monkeypatch (pytest.MonkeyPatch): Pytest monkeypatch.
+
+    Yields:
+        tuple[Config, Engine]: Alembic config and engine of the database.
+    """
+    name = f"{settings.DATABASE_NAME}_migrations"
+    server = create_engine(settings.DATABASE_URL, isolation_level="AUTOCOMMIT", poolclass=NullPool)
+    with server.connect() as connection:
+        connection.execute(text(f"DROP DATABASE IF EXISTS {name}"))
+        connection.execute(text(f"CREATE DATABASE {name}"))
+        # The strings are converted in the time zone of the database
+        connection.execute(text(f"ALTER DATABASE {name} SET timezone TO 'UTC'"))
+
+    url = f"{settings.DATABASE_URL.rsplit('/', 1)[0]}/{name}"
+    monkeypatch.setattr(settings, "DATABASE_URL", url)
+    # No ini file, so migrations/env.py leaves the logging of the tests alone
+    config = Config()
+    config.set_main_option("script_location", "migrations")
+    engine = create_engine(url, poolclass=NullPool)
+
+    yield config, engine
+
+    engine.dispose()
+    with server.connect() as connection:
+        connection.execute(text(f"DROP DATABASE IF EXISTS {name}"))
+
+
+def test_migrations_upgrade_and_downgrade(migrations_database) -> None:
+    """Test that the migrations upgrade an empty database to head and downgrade it back, and that
+    the timestamp strings and columns of the projects are kept in sync during the expand phase.
+
+    Args:
+        migrations_database (tuple[Config, Engine]): Alembic config and engine of the database.
+    """
+    config, engine = migrations_database
+
+    def project_timestamps(connection, project_id: int) -> tuple:
+        return connection.execute(
+            text(
+                "SELECT created_at, updated_at, to_char(created_at_tz, 'YYYY-MM-DD HH24:MI:SS'), "
+                "to_char(updated_at_tz, 'YYYY-MM-DD HH24:MI:SS') FROM projects WHERE id = :id"
+            ),
+            {"id": project_id},
+        ).one()
+
+    command.upgrade(config, "0002")
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO users (id, username) VALUES (1, 'user1')"))
+        connection.execute(
+            text(
+                "INSERT INTO projects (id, name, owner_id, created_at, updated_at) "
+                "VALUES (1, 'before', 1, '2024-01-02 03:04:05', '2024-01-02 03:04:05')"
+            )
+        )
+
+    # Expand: the existing rows are backfilled, and both versions of the code write the projects
+    command.upgrade(config, "0003")
+    with engine.begin() as connection:
+        assert project_timestamps(connection, 1)[2:] == ("2024-01-02 03:04:05",) * 2
+
+        # Previous code, strings only
+        connection.execute(
+            text(
+                "INSERT INTO projects (id, name, owner_id, created_at, updated_at) "
+                "VALUES (2, 'old', 1, '2024-02-03 04:05:06', '2024-02-03 04:05:06')"
+            )
+        )
+        assert project_timestamps(connection, 2)[2:] == ("2024-02-03 04:05:06",) * 2
+        connection.execute(
+            text("UPDATE projects SET updated_at = '2024-03-04 05:06:07' WHERE id = 2")
+        )
+        assert project_timestamps(connection, 2)[3] == "2024-03-04 05:06:07"
+
+        # New code, timestamps only
+        connection.execute(
+            text(
+                "INSERT INTO projects (id, name, owner_id, created_at_tz, updated_at_tz) "
+                "VALUES (3, 'new', 1, '2024-04-05 06:07:08+00', '2024-04-05 06:07:08+00')"
+            )
+        )
+        assert project_timestamps(connection, 3)[:2] == ("2024-04-05 06:07:08.000000",) * 2
+        connection.execute(
+            text("UPDATE projects SET updated_at_tz = '2024-05-06 07:08:09+00' WHERE id = 3")
+        )
+        assert project_timestamps(connection, 3) == (
+            "2024-04-05 06:07:08.000000",
+            "2024-05-06 07:08:09.000000",
+            "2024-04-05 06:07:08",
+            "2024-05-06 07:08:09",
+        )
+
+        # Tasks get the time of the migration
+        connection.execute(text("INSERT INTO tasks (id, title, owner_id) VALUES (1, 'task', 1)"))
+        assert connection.execute(text("SELECT created_at FROM tasks")).scalar() is not None
+
+    command.upgrade(config, "head")
+    with engine.connect() as connection:
+        columns = connection.execute(
+            text(
+                "SELECT column_name FROM information_schema.columns "
+                "WHERE table_name = 'projects' AND column_name LIKE '%_at%'"
+            )
+        ).scalars()
+        assert sorted(columns) == ["created_at_tz", "updated_at_tz"]
+        assert connection.execute(text("SELECT count(*) FROM projects")).scalar() == 3
+
+    # The contract is undone with the strings restored, and the trigger in sync again
+    command.downgrade(config, "0003")
+    with engine.begin() as connection:
+        assert project_timestamps(connection, 3)[1] == "2024-05-06 07:08:09.000000"
+        connection.execute(
+            text("UPDATE projects SET created_at = '2024-06-07 08:09:10' WHERE id = 3")
+        )
+        assert project_timestamps(connection, 3)[2] == "2024-06-07 08:09:10"
+
+    command.downgrade(config, "base")
+    with engine.connect() as connection:
+        tables = connection.execute(
+            text("SELECT tablename FROM pg_tables WHERE schemaname = 'public'")
+        ).scalars()
+        assert list(tables) == ["alembic_version"]
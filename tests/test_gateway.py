@@ -0,0 +1,1084 @@
+"""Tests for the API gateway."""
+
+import asyncio
+import inspect
+import time
+import zlib
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from starlette.responses import JSONResponse, Response, StreamingResponse
+
+from auth_service.auth_crud import PAT_PREFIX, create_access_token, verify_internal_identity
+
+from tests.test_utils import (
+    AUTH_URL,
+    TASKS_URL,
+    USERS,
+    get_auth_token_second_user,
+    mock_test_data,
+)
+
+from api_gateway_service.api_gateway import app
+from api_gateway_service import aggregation, batch, monitoring
+from api_gateway_service.api_router import service_urls
+from api_gateway_service.compression import CompressionMiddleware, negotiate_encoding
+from api_gateway_service.hedging import RetryBudget
+from api_gateway_service.identity import get_client_ip, parse_networks
+from api_gateway_service.rate_limiter import Limit, MemoryStore, RateLimiter, rate_limiter
+from api_gateway_service.resilience import AIMDConcurrencyLimit, CircuitBreaker
+from api_gateway_service.response_cache import (
+    CachedResponse,
+    ResponseCache,
+    ResponseCacheMiddleware,
+)
+from api_gateway_service.single_flight import SingleFlight
+from api_gateway_service.upstreams import Upstream, UpstreamConfig, UpstreamRegistry
+
+GATEWAY_URL = "/api/gateway"
+
+
+class MockUpstreams:
+    """Upstream services replaced by a mock transport that records every request.
+
+    The default handler answers with the path that was requested. Tests can replace it, also with
+    an async handler. Responses are always returned as unread streams, like the ones coming from
+    the network.
+    """
+
+    def __init__(self) -> None:
+        self.requests: list[httpx.Request] = []
+        self.handler = lambda request: httpx.Response(200, json={"upstream": request.url.path})
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        self.requests.append(request)
+        response = self.handler(request)
+        if inspect.isawaitable(response):
+            response = await response
+
+        if response.is_stream_consumed:
+            response = httpx.Response(
+                response.status_code,
+                headers=response.headers,
+                stream=httpx.ByteStream(response.content),
+            )
+
+        return response
+
+
+@pytest.fixture()
+def upstreams():
+    """Replace the upstream services of the gateway with mocks.
+
+    Yields:
+        MockUpstreams: Mocked upstream services.
+    """
+    mock_upstreams = MockUpstreams()
+
+    previous = getattr(app.state, "upstreams", None)
+    app.state.upstreams = UpstreamRegistry.from_service_urls(
+        service_urls, transport=httpx.MockTransport(mock_upstreams.handle)
+    )
+
+    yield mock_upstreams
+
+    app.state.upstreams = previous
+
+
+def test_lifespan_creates_and_closes_upstream_clients() -> None:
+    """Test that the gateway creates one shared client per service and closes it on shutdown."""
+    with TestClient(app):
+        upstreams = app.state.upstreams
+        clients = [upstreams[service].client for service in service_urls]
+
+        assert len(set(map(id, clients))) == len(service_urls)
+        assert not any(client.is_closed for client in clients)
+
+    assert all(client.is_closed for client in clients)
+
+
+def test_proxy_reuses_shared_client(client: TestClient, upstreams: MockUpstreams) -> None:
+    """Test that proxied requests go through the shared client of the upstream.
+
+    Args:
+        client (TestClient): Test client.
+        upstreams (MockUpstreams): Mocked upstream services.
+    """
+    shared_client = app.state.upstreams["tasks"].client
+
+    for _ in range(2):
+        response = client.post("/api/tasks/archive", json={"task_id": 1})
+        assert response.status_code == 200, response.text
+
+    assert app.state.upstreams["tasks"].client is shared_client
+    assert [request.url.path for request in upstreams.requests] == ["/tasks/archive"] * 2
+
+
+def test_upstream_config_from_env(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that the pool configuration can be set globally and overridden per upstream.
+
+    Args:
+        monkeypatch (pytest.MonkeyPatch): Pytest monkeypatch.
+    """
+    monkeypatch.setenv("UPSTREAM_MAX_CONNECTIONS", "50")
+    monkeypatch.setenv("TASKS_SERVICE_MAX_CONNECTIONS", "200")
+    monkeypatch.setenv("TASKS_SERVICE_KEEPALIVE_EXPIRY", "2.5")
+    monkeypatch.setenv("UPSTREAM_HTTP2", "true")
+
+    tasks_config = UpstreamConfig.from_env("tasks", service_urls["tasks"])
+    users_config = UpstreamConfig.from_env("users", service_urls["users"])
+
+    assert tasks_config.max_connections == 200
+    assert tasks_config.keepalive_expiry == 2.5
+    assert users_config.max_connections == 50
+    assert tasks_config.http2 and users_config.http2
+    assert not tasks_config.http2_prior_knowledge
+
+
+def test_upstreams_stats(
+    client: TestClient, upstreams: MockUpstreams, monitoring_headers: dict
+) -> None:
+    """Test that the pool occupancy of every upstream is exposed.
+
+    Args:
+        client (TestClient): Test client.
+        upstreams (MockUpstreams): Mocked upstream services.
+        monitoring_headers (dict): Headers of the monitoring system.
+    """
+    response = client.get(f"{GATEWAY_URL}/upstreams", headers=monitoring_headers)
+
+    assert response.status_code == 200
+    assert set(response.json()) == set(service_urls)
+    assert response.json()["tasks"]["max_connections"] == 100
+    assert response.json()["tasks"]["active_connections"] == 0
+    assert response.json()["tasks"]["endpoints"][0]["url"] == "http://tasks-service:8003"
+    assert response.json()["tasks"]["endpoints"][0]["healthy"]
+
+
+def test_proxy_streams_form_body_and_keeps_status_and_headers(
+    client: TestClient, upstreams: MockUpstreams
+) -> None:
+    """Test that form-encoded bodies, status codes and headers go through the proxy untouched.
+
+    Args:
+        client (TestClient): Test client.
+        upstreams (MockUpstreams): Mocked upstream services.
+    """
+    upstreams.handler = lambda request: httpx.Response(
+        202,
+        content=request.content,
+        headers={"Content-Type": "text/plain", "X-Upstream": "auth"},
+    )
+
+    response = client.post(
+        "/api/auth/introspect?verbose=1", data={"username": "user1", "password": "Password1!"}
+    )
+
+    assert response.status_code == 202
+    assert response.headers["x-upstream"] == "auth"
+    assert response.text == "username=user1&password=Password1%21"
+    assert upstreams.requests[0].url.query == b"verbose=1"
+    assert upstreams.requests[0].headers["content-type"] == "application/x-www-form-urlencoded"
+
+
+@pytest.mark.parametrize("method", ["GET", "PUT", "PATCH", "DELETE"])
+def test_proxy_forwards_every_method(
+    client: TestClient, upstreams: MockUpstreams, method: str
+) -> None:
+    """Test that the proxy handles every HTTP method.
+
+    Args:
+        client (TestClient): Test client.
+        upstreams (MockUpstreams): Mocked upstream services.
+        method (str): HTTP method.
+    """
+    response = client.request(method, "/api/projects/1/export")
+
+    assert response.status_code == 200
+    assert upstreams.requests[0].method == method
+    assert upstreams.requests[0].url.path == "/projects/1/export"
+    # Requests without a body are not sent as chunked
+    assert "transfer-encoding" not in upstreams.requests[0].headers
+
+
+def test_proxy_streams_large_response(client: TestClient, upstreams: MockUpstreams) -> None:
+    """Test that large upstream bodies are streamed back in chunks.
+
+    Args:
+        client (TestClient): Test client.
+        upstreams (MockUpstreams): Mocked upstream services.
+    """
+    chunk = b"x" * 64 * 1024
+
+    async def export():
+        for _ in range(32):
+            yield chunk
+
+    upstreams.handler = lambda request: httpx.Response(200, content=export())
+
+    with client.stream("GET", "/api/projects/export") as response:
+        chunks = list(response.iter_raw())
+
+    assert response.status_code == 200
+    assert sum(map(len, chunks)) == 32 * len(chunk)
+
+
+def test_proxy_unknown_service_and_unreachable_upstream(
+    client: TestClient, upstreams: MockUpstreams
+) -> None:
+    """Test the errors returned when the service is unknown or the upstream is down.
+
+    Args:
+        client (TestClient): Test client.
+        upstreams (MockUpstreams): Mocked upstream services.
+    """
+
+    def unreachable(request: httpx.Request) -> httpx.Response:
+        raise httpx.ConnectError("Connection refused", request=request)
+
+    upstreams.handler = unreachable
+
+    assert client.get("/api/unknown/resource").status_code == 404
+    assert client.get("/api/tasks/1").status_code == 502
+
+
+def test_load_balancer_picks_least_outstanding_endpoint() -> None:
+    """Test that requests go to the replica with the least outstanding requests."""
+    upstream = Upstream(
+        UpstreamConfig(
+            "tasks",
+            service_urls["tasks"],
+            endpoints=["http://tasks-0:8003", "http://tasks-1:8003"],
+        ),
+        transport=httpx.MockTransport(
+            lambda request: httpx.Response(200, stream=httpx.ByteStream(b"[]"))
+        ),
+    )
+
+    async def send_requests() -> list[str]:
+        hosts = []
+        # Keep the first response open, so its replica has one outstanding request
+        first = await upstream.send(upstream.client.build_request("GET", upstream.url("/")))
+        hosts.append(first.request.url.host)
+
+        for _ in range(3):
+            response = await upstream.send(upstream.client.build_request("GET", upstream.url("/")))
+            hosts.append(response.request.url.host)
+            await response.aclose()
+
+        await first.aclose()
+        return hosts
+
+    hosts = asyncio.run(send_requests())
+
+    assert len(set(hosts[1:])) == 1 and hosts[0] not in hosts[1:]
+    assert [endpoint.outstanding for endpoint in upstream.balancer.endpoints] == [0, 0]
+    assert sum(endpoint.requests for endpoint in upstream.balancer.endpoints) == 4
+
+
+def test_health_checks_eject_and_readmit_endpoints() -> None:
+    """Test that failing replicas are ejected by the health probes and readmitted on recovery."""
+    sick_hosts = {"tasks-1"}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        # Unauthorized probes still mean that the replica is alive
+        return httpx.Response(503 if request.url.host in sick_hosts else 401)
+
+    upstream = Upstream(
+        UpstreamConfig(
+            "tasks",
+            service_urls["tasks"],
+            endpoints=["http://tasks-0:8003", "http://tasks-1:8003"],
+        ),
+        transport=httpx.MockTransport(handler),
+    )
+    balancer = upstream.balancer
+
+    async def check_health(times: int) -> None:
+        for _ in range(times):
+            await balancer.check_health(upstream.client)
+
+    asyncio.run(check_health(2))
+
+    assert [endpoint.healthy for endpoint in balancer.endpoints] == [True, False]
+    assert {balancer.pick().origin.host for _ in range(10)} == {"tasks-0"}
+
+    sick_hosts.clear()
+    asyncio.run(check_health(2))
+
+    assert all(endpoint.healthy for endpoint in balancer.endpoints)
+
+
+@pytest.mark.parametrize(
+    "endpoint",
+    [
+        "upstreams",
+        "retry-budget",
+        "cache",
+        "rate-limits",
+        "password-hashing",
+        "login-throttle",
+        "database-pool",
+        "database-replicas",
+    ],
+)
+def test_monitoring_endpoints_require_token(
+    client: TestClient,
+    upstreams: MockUpstreams,
+    auth_token: dict,
+    monitoring_headers: dict,
+    monkeypatch: pytest.MonkeyPatch,
+    endpoint: str,
+) -> None:
+    """Test that only the monitoring system can read the statistics, not the users.
+
+    Args:
+        client (TestClient): Test client.
+        upstreams (MockUpstreams): Mocked upstream services.
+        auth_token (dict): Auth token.
+        monitoring_headers (dict): Headers of the monitoring system.
+        monkeypatch (pytest.MonkeyPatch): Pytest monkeypatch.
+        endpoint (str): Monitoring endpoint.
+    """
+    url = f"{GATEWAY_URL}/{endpoint}"
+
+    assert client.get(url).status_code == 403
+    assert client.get(url, headers=auth_token).status_code == 403
+    assert client.get(url, headers={"X-Monitoring-Token": "wrong"}).status_code == 403
+    assert client.get(url, headers=monitoring_headers).status_code == 200
+
+    # Disabled without a token
+    monkeypatch.setattr(monitoring, "MONITORING_TOKEN", "")
+    assert client.get(url, headers=monitoring_headers).status_code == 404
+
+
+def test_response_cache_hit_and_invalidation(
+    client: TestClient, auth_token: dict, monitoring_headers: dict
+) -> None:
+    """Test that GET responses are cached per user and invalidated by the writes of the user.
+
+    Args:
+        client (TestClient): Test client.
+        auth_token (dict): Auth token.
+        monitoring_headers (dict): Headers of the monitoring system.
+    """
+    first = client.get(f"{TASKS_URL}/", headers=auth_token)
+    second = client.get(f"{TASKS_URL}/", headers=auth_token)
+
+    assert first.headers["x-cache"] == "MISS"
+    assert second.headers["x-cache"] == "HIT"
+    assert second.json() == first.json() == []
+
+    # Other users have their own entries
+    second_user = client.get(f"{TASKS_URL}/", headers=get_auth_token_second_user(client))
+    assert second_user.headers["x-cache"] == "MISS"
+
+    # A write of the user invalidates its entries
+    client.post(TASKS_URL, json=mock_test_data("task"), headers=auth_token)
+    third = client.get(f"{TASKS_URL}/", headers=auth_token)
+
+    assert third.headers["x-cache"] == "MISS"
+    assert len(third.json()) == 1
+
+    response = client.get(f"{GATEWAY_URL}/cache", headers=monitoring_headers)
+    assert response.json()["hits"] == 1
+    assert response.json()["misses"] == 3
+    assert response.json()["entries"] == 2
+
+
+def test_response_cache_is_kept_by_read_only_batches(
+    client: TestClient, auth_token: dict, monitoring_headers: dict
+) -> None:
+    """Test that a batch of reads is served from the cache instead of invalidating it.
+
+    Args:
+        client (TestClient): Test client.
+        auth_token (dict): Auth token.
+        monitoring_headers (dict): Headers of the monitoring system.
+    """
+    first = client.get(f"{TASKS_URL}/", headers=auth_token)
+    assert first.headers["x-cache"] == "MISS"
+
+    response = client.post(
+        "/api/batch",
+        json={"requests": [{"path": f"{TASKS_URL}/"}, {"path": "/api/users/me"}]},
+        headers=auth_token,
+    )
+    assert [item["status"] for item in response.json()["responses"]] == [200, 200]
+    assert response.json()["responses"][0]["headers"]["x-cache"] == "HIT"
+
+    second = client.get(f"{TASKS_URL}/", headers=auth_token)
+    assert second.headers["x-cache"] == "HIT"
+
+    response = client.get(f"{GATEWAY_URL}/cache", headers=monitoring_headers)
+    assert response.json()["invalidations"] == 0
+
+
+def test_response_cache_is_bounded_and_expires() -> None:
+    """Test the LRU eviction and the TTL expiry of the response cache."""
+    cache = ResponseCache(ttl=60, max_entries=2, max_bytes=1024)
+
+    def cached(body: bytes, ttl: float = 60) -> CachedResponse:
+        return CachedResponse(200, [], body, expires_at=time.monotonic() + ttl)
+
+    cache.set(("user1", "/a", b""), cached(b"a"))
+    cache.set(("user1", "/b", b""), cached(b"b"))
+    cache.get(("user1", "/a", b""))  # "/b" becomes the least recently used
+    cache.set(("user2", "/c", b""), cached(b"c"))
+
+    assert cache.get(("user1", "/b", b"")) is None
+    assert cache.get(("user1", "/a", b"")).body == b"a"
+
+    # Entries bigger than the memory bound are evicted
+    cache.set(("user2", "/d", b""), cached(b"d" * 1000))
+    cache.set(("user2", "/e", b""), cached(b"e" * 1000))
+    assert cache.size <= 1024
+
+    cache.set(("user1", "/f", b""), cached(b"f", ttl=-1))
+    assert cache.get(("user1", "/f", b"")) is None
+    assert cache.stats()["evictions"] >= 2
+
+
+def test_single_flight_shares_result_and_errors() -> None:
+    """Test that concurrent calls with the same key run once and share the result or error."""
+    single_flight = SingleFlight()
+    calls = []
+
+    async def slow_call():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return len(calls)
+
+    async def failing_call():
+        await asyncio.sleep(0.05)
+        raise RuntimeError("upstream failed")
+
+    async def run():
+        results = await asyncio.gather(*(single_flight.do("key", slow_call) for _ in range(10)))
+        errors = await asyncio.gather(
+            *(single_flight.do("error", failing_call) for _ in range(3)), return_exceptions=True
+        )
+        return results, errors
+
+    results, errors = asyncio.run(run())
+
+    assert len(calls) == 1
+    assert [result for result, _ in results] == [1] * 10
+    assert [shared for _, shared in results].count(False) == 1
+    assert all(isinstance(error, RuntimeError) for error in errors)
+    assert single_flight.stats() == {"leaders": 2, "coalesced": 11, "in_flight": 0}
+
+
+def test_response_cache_coalesces_concurrent_reads() -> None:
+    """Test that identical concurrent reads of a user reach the services only once."""
+    calls = []
+
+    async def service(scope, receive, send):
+        calls.append(scope["path"])
+        await asyncio.sleep(0.05)
+        await JSONResponse([{"id": 1}])(scope, receive, send)
+
+    # Without caching, so only the coalescing is tested
+    middleware = ResponseCacheMiddleware(
+        service, cache=ResponseCache(ttl=0), coalescer=SingleFlight()
+    )
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'user1'})}"}
+
+    async def run():
+        transport = httpx.ASGITransport(app=middleware)
+        async with httpx.AsyncClient(transport=transport, base_url="http://gateway") as client:
+            return await asyncio.gather(
+                *(client.get(f"{TASKS_URL}/", headers=headers) for _ in range(5))
+            )
+
+    responses = asyncio.run(run())
+
+    assert calls == [f"{TASKS_URL}/"]
+    assert all(response.json() == [{"id": 1}] for response in responses)
+    assert sorted(response.headers["x-cache"] for response in responses) == ["COALESCED"] * 4 + [
+        "MISS"
+    ]
+
+
+def test_circuit_breaker_fails_fast_with_retry_after(
+    client: TestClient, upstreams: MockUpstreams, monitoring_headers: dict
+) -> None:
+    """Test that the gateway stops calling a failing upstream and answers 503 with Retry-After.
+
+    Args:
+        client (TestClient): Test client.
+        upstreams (MockUpstreams): Mocked upstream services.
+        monitoring_headers (dict): Headers of the monitoring system.
+    """
+    upstreams.handler = lambda request: httpx.Response(500)
+
+    statuses = [client.get("/api/tasks/1").status_code for _ in range(7)]
+
+    assert statuses == [500] * 5 + [503] * 2
+    assert len(upstreams.requests) == 5
+
+    response = client.get("/api/tasks/1")
+    assert response.headers["retry-after"] == "10"
+
+    # Other upstreams are not affected
+    assert client.get("/api/projects/1").status_code == 500
+
+    response = client.get(f"{GATEWAY_URL}/upstreams", headers=monitoring_headers)
+    stats = response.json()["tasks"]["circuit_breaker"]
+    assert stats["state"] == "open"
+    assert stats["rejections"] == 3
+
+
+def test_circuit_breaker_half_open_probe() -> None:
+    """Test that an open circuit lets a single probe through after the reset timeout."""
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.01)
+
+    breaker.record(failed=True)
+    breaker.record(failed=True)
+    assert breaker.state == "open" and not breaker.allow()
+
+    time.sleep(0.02)
+    assert breaker.allow()  # The probe
+    assert not breaker.allow()  # Other requests wait for the probe
+
+    breaker.record(failed=True)
+    assert breaker.state == "open"
+
+    time.sleep(0.02)
+    assert breaker.allow()
+    breaker.record(failed=False)
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_aimd_concurrency_limit() -> None:
+    """Test that the concurrency limit grows while healthy and backs off on failures or slowness."""
+    limit = AIMDConcurrencyLimit(initial_limit=4, min_limit=1, max_limit=5, latency_threshold=1)
+
+    assert all(limit.try_acquire() for _ in range(4))
+    assert not limit.try_acquire()
+
+    # Healthy responses while the limit is in use grow it up to the maximum
+    for _ in range(4):
+        limit.release(latency=0.01, failed=False)
+        limit.try_acquire()
+    assert limit.stats()["limit"] == 5
+
+    # Failures and slow responses shrink it
+    limit.release(latency=0.01, failed=True)
+    limit.release(latency=2, failed=False)
+    assert limit.stats()["limit"] == 4
+    assert limit.stats()["rejections"] == 1
+
+
+def hedged_upstream(budget: RetryBudget, slow_calls: int) -> tuple[Upstream, list]:
+    """Build an upstream whose first calls are slow, with enough latency samples to hedge.
+
+    Args:
+        budget (RetryBudget): Retry budget of the upstream.
+        slow_calls (int): Number of calls that take one second to answer.
+
+    Returns:
+        tuple[Upstream, list]: Upstream and the list of calls that it received.
+    """
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url.host)
+        if len(calls) <= slow_calls:
+            await asyncio.sleep(1)
+        return httpx.Response(200, stream=httpx.ByteStream(str(len(calls)).encode()))
+
+    upstream = Upstream(
+        UpstreamConfig(
+            "tasks",
+            service_urls["tasks"],
+            endpoints=["http://tasks-0:8003", "http://tasks-1:8003"],
+        ),
+        transport=httpx.MockTransport(handler),
+        budget=budget,
+    )
+    for _ in range(20):
+        upstream.latencies.record(0.01)
+
+    return upstream, calls
+
+
+def test_hedged_request_wins_over_slow_request() -> None:
+    """Test that a slow idempotent request is hedged and the fastest response is used."""
+    budget = RetryBudget(ratio=1, max_tokens=10)
+    upstream, calls = hedged_upstream(budget, slow_calls=1)
+
+    async def send():
+        started = time.perf_counter()
+        response = await upstream.send(upstream.client.build_request("GET", upstream.url("/")))
+        body = await response.aread()
+        await response.aclose()
+        return body, time.perf_counter() - started
+
+    body, elapsed = asyncio.run(send())
+
+    assert body == b"2"  # The response of the hedge
+    assert elapsed < 0.5
+    assert len(calls) == 2
+    assert upstream.stats()["hedging"]["hedges"] == upstream.stats()["hedging"]["hedges_won"] == 1
+    assert upstream.stats()["hedging"]["delay_ms"] == 50
+    assert [endpoint.outstanding for endpoint in upstream.balancer.endpoints] == [0, 0]
+
+
+def test_hedging_is_limited_by_the_retry_budget() -> None:
+    """Test that no hedge is sent when the retry budget is exhausted."""
+    budget = RetryBudget(ratio=0.25, max_tokens=10)
+    upstream, calls = hedged_upstream(budget, slow_calls=1)
+
+    async def send():
+        response = await upstream.send(upstream.client.build_request("GET", upstream.url("/")))
+        await response.aclose()
+
+    asyncio.run(send())
+
+    assert len(calls) == 1
+    assert upstream.hedges == 0
+    assert budget.stats()["exhausted"] == 1
+
+    # Four requests fund a single extra one
+    for _ in range(3):
+        budget.deposit()
+    assert budget.try_withdraw() and not budget.try_withdraw()
+
+
+def test_negotiate_encoding() -> None:
+    """Test that the encoding with the highest quality value, then preference, is chosen."""
+    encodings = ["zstd", "br", "gzip"]
+
+    assert negotiate_encoding("gzip, deflate, br", encodings) == "br"
+    assert negotiate_encoding("gzip;q=1.0, br;q=0.5", encodings) == "gzip"
+    assert negotiate_encoding("*", encodings) == "zstd"
+    assert negotiate_encoding("*, zstd;q=0", encodings) == "br"
+    assert negotiate_encoding("identity", encodings) is None
+    assert negotiate_encoding("gzip;q=0", encodings) is None
+    assert negotiate_encoding("", encodings) is None
+
+
+def test_compression_middleware() -> None:
+    """Test that large and streaming responses are compressed, and small or encoded ones are not."""
+    large = {"tasks": [{"id": i, "title": f"Task {i}", "subtasks": []} for i in range(200)]}
+
+    async def application(scope, receive, send):
+        if scope["path"] == "/large":
+            response = JSONResponse(large)
+        elif scope["path"] == "/small":
+            response = JSONResponse({"id": 1})
+        elif scope["path"] == "/image":
+            response = Response(b"\x89PNG" * 1000, media_type="image/png")
+        else:
+            chunks = (f"line {i}\n" * 100 for i in range(10))
+            response = StreamingResponse(chunks, media_type="text/plain")
+        await response(scope, receive, send)
+
+    client = TestClient(CompressionMiddleware(application, minimum_size=500))
+
+    response = client.get("/large", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.num_bytes_downloaded < len(response.content) / 4
+    assert response.json() == large
+
+    response = client.get("/stream", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.text == "".join(f"line {i}\n" * 100 for i in range(10))
+
+    for path, accept_encoding in [("/small", "gzip"), ("/image", "gzip"), ("/large", "identity")]:
+        response = client.get(path, headers={"Accept-Encoding": accept_encoding})
+        assert "content-encoding" not in response.headers
+        assert int(response.headers["content-length"]) == len(response.content)
+
+
+def test_compression_flushes_every_streamed_chunk() -> None:
+    """Test that every chunk of a streaming response can be decoded as soon as it is received."""
+    chunks = [f"data: event {i}\n\n".encode() * 100 for i in range(3)]
+
+    async def application(scope, receive, send):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"text/event-stream")],
+            }
+        )
+        for chunk in chunks:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/events",
+        "headers": [(b"accept-encoding", b"gzip")],
+    }
+    asyncio.run(CompressionMiddleware(application, minimum_size=0)(scope, receive, send))
+
+    decompressor = zlib.decompressobj(31)
+    bodies = [message["body"] for message in messages if message["type"] == "http.response.body"]
+    for chunk, body in zip(chunks, bodies):
+        assert decompressor.decompress(body) == chunk
+
+    assert decompressor.decompress(bodies[-1]) + decompressor.flush() == b""
+    assert decompressor.eof
+
+
+def test_rate_limit_login_per_ip(client: TestClient, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that logins over the limit get a 429 with the RateLimit and Retry-After headers.
+
+    Args:
+        client (TestClient): Test client.
+        monkeypatch (pytest.MonkeyPatch): Pytest monkeypatch.
+    """
+    monkeypatch.setitem(rate_limiter.limits, "login", Limit.parse("login", "2/60"))
+    data = {"username": "nobody", "password": "wrong"}
+
+    response = client.post("/api/auth/token", data=data)
+    assert response.status_code != 429
+    assert response.headers["ratelimit-limit"] == "2"
+    assert response.headers["ratelimit-remaining"] == "1"
+    assert response.headers["ratelimit-policy"] == "2;w=60"
+
+    client.post("/api/auth/token", data=data)
+    response = client.post("/api/auth/token", data=data)
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "30"
+    assert response.headers["ratelimit-remaining"] == "0"
+    assert rate_limiter.stats()["limited"]["login"] == 1
+
+
+def test_rate_limit_per_user_shared_between_replicas() -> None:
+    """Test that users are limited separately, and that replicas sharing a store share limits."""
+    store = MemoryStore(shards=4)
+    replicas = [RateLimiter(store, read="3/60"), RateLimiter(store, read="3/60")]
+
+    def scope(username: str | None, ip: str = "10.0.0.1") -> dict:
+        headers = []
+        if username:
+            token = create_access_token({"sub": username})
+            headers.append((b"authorization", f"Bearer {token}".encode()))
+        return {
+            "type": "http",
+            "method": "GET",
+            "path": "/api/tasks/",
+            "headers": headers,
+            "client": (ip, 1234),
+        }
+
+    async def check(username: str | None, ip: str = "10.0.0.1", replica: int = 0) -> bool:
+        result = await replicas[replica].check(scope(username, ip))
+        return result.allowed
+
+    async def run():
+        user1 = [await check("user1", replica=i % 2) for i in range(4)]
+        return user1, await check("user2"), await check(None), await check(None, "10.0.0.2")
+
+    user1, user2, anonymous, other_ip = asyncio.run(run())
+
+    assert user1 == [True, True, True, False]
+    assert user2 and anonymous and other_ip
+
+
+def test_rate_limit_per_ip_across_users() -> None:
+    """Test that the requests of every user of an IP also share the limit of the IP."""
+    limiter = RateLimiter(MemoryStore(shards=4), read="10/60", ip="3/60")
+
+    def scope(username: str, ip: str = "10.0.0.1") -> dict:
+        token = create_access_token({"sub": username})
+        return {
+            "type": "http",
+            "method": "GET",
+            "path": "/api/tasks/",
+            "headers": [(b"authorization", f"Bearer {token}".encode())],
+            "client": (ip, 1234),
+        }
+
+    async def run():
+        same_ip = [(await limiter.check(scope(f"user{i}"))).allowed for i in range(4)]
+        return same_ip, (await limiter.check(scope("user9", "10.0.0.2"))).allowed
+
+    same_ip, other_ip = asyncio.run(run())
+
+    assert same_ip == [True, True, True, False]
+    assert other_ip
+    assert limiter.stats()["limited"] == {"login": 0, "write": 0, "read": 0, "ip": 1}
+
+
+def test_rate_limit_ip_rejection_keeps_route_tokens() -> None:
+    """Test that a request rejected by the IP limit doesn't use a token of its route class."""
+    store = MemoryStore(shards=4)
+    limiter = RateLimiter(store, read="10/60", ip="2/60")
+    token = create_access_token({"sub": "user1"})
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/api/tasks/",
+        "headers": [(b"authorization", f"Bearer {token}".encode())],
+        "client": ("10.0.0.1", 1234),
+    }
+    route_key = f"read:{limiter.client_key(scope, 'read')}"
+
+    async def run():
+        results = [await limiter.check(scope) for _ in range(4)]
+        # Read without taking a token, with the IP bucket left alone
+        _, tokens = await store.take([(route_key, limiter.limits["read"])], cost=0)
+        return results, tokens[0]
+
+    results, route_tokens = asyncio.run(run())
+
+    assert [result.allowed for result in results] == [True, True, False, False]
+    assert results[-1].limit.name == "ip"
+    assert route_tokens == pytest.approx(8, abs=0.01)
+    assert limiter.stats()["limited"] == {"login": 0, "write": 0, "read": 0, "ip": 2}
+
+
+def test_client_ip_from_trusted_proxies() -> None:
+    """Test that the forwarded client IP is only believed when a trusted proxy sent it."""
+    proxies = parse_networks("10.0.0.0/8, 192.168.1.1")
+    header_names = ["x-real-ip", "x-forwarded-for"]
+
+    def client_ip(peer: str, forwarded_for: str | None = None) -> str | None:
+        headers = [(b"x-forwarded-for", forwarded_for.encode())] if forwarded_for else []
+        return get_client_ip({"client": (peer, 1234), "headers": headers}, proxies, header_names)
+
+    # Direct clients can't pick their IP
+    assert client_ip("203.0.113.7", "198.51.100.1") == "203.0.113.7"
+    # The first address that is not a trusted proxy, from the right, is the client
+    assert client_ip("10.0.0.2", "198.51.100.1") == "198.51.100.1"
+    assert client_ip("10.0.0.2", "1.2.3.4, 198.51.100.1, 192.168.1.1") == "198.51.100.1"
+    assert client_ip("10.0.0.2", "unknown, 10.0.0.3") == "10.0.0.3"
+    assert client_ip("10.0.0.2") == "10.0.0.2"
+
+
+def test_rate_limit_memory_store_is_bounded() -> None:
+    """Test that the memory store drops the oldest buckets when it is full."""
+    store = MemoryStore(shards=2, max_keys=4)
+    limit = Limit.parse("read", "10/60")
+
+    async def run():
+        for i in range(20):
+            await store.take([(f"ip:{i}", limit)])
+
+    asyncio.run(run())
+
+    assert len(store) <= 4
+
+
+def test_batch_runs_sub_requests(
+    client: TestClient, auth_token: dict, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Test that the sub-requests of a batch run with their dependencies and own status codes.
+
+    Args:
+        client (TestClient): Test client.
+        auth_token (dict): Auth token.
+        monkeypatch (pytest.MonkeyPatch): Pytest monkeypatch.
+    """
+    # The test database session can't be shared between threads
+    monkeypatch.setattr(batch, "BATCH_CONCURRENCY", 1)
+    task = mock_test_data("task")
+
+    response = client.post(
+        "/api/batch",
+        json={
+            "requests": [
+                {"id": "create", "method": "POST", "path": f"{TASKS_URL}/", "body": task},
+                {"id": "tasks", "path": f"{TASKS_URL}/", "depends_on": ["create"]},
+                {"id": "me", "path": "/api/users/me"},
+                {"id": "missing", "method": "DELETE", "path": f"{TASKS_URL}/999"},
+                {"id": "child", "path": f"{TASKS_URL}/?limit=1", "depends_on": ["missing"]},
+            ]
+        },
+        headers=auth_token,
+    )
+
+    assert response.status_code == 200, response.text
+    responses = response.json()["responses"]
+    assert [item["id"] for item in responses] == ["create", "tasks", "me", "missing", "child"]
+    assert [item["status"] for item in responses] == [201, 200, 200, 404, 424]
+    assert responses[0]["body"]["title"] == task["title"]
+    assert [item["title"] for item in responses[1]["body"]] == [task["title"]]
+    assert responses[2]["body"]["username"] == USERS["current_user_create"].username
+    assert responses[2]["headers"]["content-type"] == "application/json"
+
+
+def test_batch_with_personal_access_token(
+    client: TestClient, auth_token: dict, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Test that a batch accepts a personal access token, and its scopes apply to every
+    sub-request.
+
+    Args:
+        client (TestClient): Test client.
+        auth_token (dict): Auth token.
+        monkeypatch (pytest.MonkeyPatch): Pytest monkeypatch.
+    """
+    monkeypatch.setattr(batch, "BATCH_CONCURRENCY", 1)
+    token = client.post(
+        f"{AUTH_URL}/tokens", json={"name": "ci", "scopes": ["tasks:write"]}, headers=auth_token
+    ).json()["token"]
+    task = mock_test_data("task")
+
+    response = client.post(
+        "/api/batch",
+        json={
+            "requests": [
+                {"id": "create", "method": "POST", "path": f"{TASKS_URL}/", "body": task},
+                {"id": "tasks", "path": f"{TASKS_URL}/", "depends_on": ["create"]},
+                {"id": "me", "path": "/api/users/me"},
+            ]
+        },
+        headers={"Authorization": f"Bearer {token}"},
+    )
+
+    assert response.status_code == 200, response.text
+    responses = response.json()["responses"]
+    assert [item["status"] for item in responses] == [201, 200, 403]
+    assert responses[0]["body"]["owner_id"] == 1
+    assert [item["title"] for item in responses[1]["body"]] == [task["title"]]
+
+    response = client.post(
+        "/api/batch",
+        json={"requests": [{"path": "/api/users/me"}]},
+        headers={"Authorization": f"Bearer {PAT_PREFIX}unknown"},
+    )
+    assert response.status_code == 401
+
+
+def test_batch_runs_independent_sub_requests_concurrently(
+    client: TestClient, upstreams: MockUpstreams, auth_token: dict
+) -> None:
+    """Test that independent sub-requests are not run one after the other.
+
+    Args:
+        client (TestClient): Test client.
+        upstreams (MockUpstreams): Mocked upstream services.
+        auth_token (dict): Auth token.
+    """
+
+    async def slow_handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(0.2)
+        return httpx.Response(200, json={"upstream": request.url.path})
+
+    upstreams.handler = slow_handler
+
+    started = time.perf_counter()
+    response = client.post(
+        "/api/batch",
+        json={"requests": [{"path": f"/api/tasks/archive/{i}"} for i in range(5)]},
+        headers=auth_token,
+    )
+    elapsed = time.perf_counter() - started
+
+    assert [item["body"] for item in response.json()["responses"]] == [
+        {"upstream": f"/tasks/archive/{i}"} for i in range(5)
+    ]
+    assert elapsed < 0.6
+
+
+def test_batch_validation(client: TestClient, auth_token: dict) -> None:
+    """Test that unauthenticated and invalid batches are rejected.
+
+    Args:
+        client (TestClient): Test client.
+        auth_token (dict): Auth token.
+    """
+    response = client.post("/api/batch", json={"requests": [{"path": "/api/users/me"}]})
+    assert response.status_code == 401
+
+    for requests in [
+        [],
+        [{"path": "/api/users/me"}] * (batch.BATCH_MAX_REQUESTS + 1),
+        [{"method": "POST", "path": "/api/batch"}],
+        [{"path": "https://example.com/"}],
+        [{"path": "/api/users/me", "depends_on": ["later"]}, {"id": "later", "path": "/api/"}],
+    ]:
+        response = client.post("/api/batch", json={"requests": requests}, headers=auth_token)
+        assert response.status_code == 400, requests
+
+
+def test_home_fetches_sources_concurrently_with_partial_results(
+    client: TestClient,
+    upstreams: MockUpstreams,
+    auth_token: dict,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Test that the home screen sources are fetched concurrently and slow ones are skipped.
+
+    Args:
+        client (TestClient): Test client.
+        upstreams (MockUpstreams): Mocked upstream services.
+        auth_token (dict): Auth token.
+        monkeypatch (pytest.MonkeyPatch): Pytest monkeypatch.
+    """
+    monkeypatch.setattr(aggregation, "HOME_SOURCE_TIMEOUT", 0.5)
+    delays = {"/users/me": 0.3, "/tasks/": 0.3, "/projects/": 2}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(delays[request.url.path])
+        if request.url.path == "/users/me":
+            return httpx.Response(200, json={"username": "user1"})
+        return httpx.Response(200, json=[{"id": 1}])
+
+    upstreams.handler = handler
+
+    started = time.perf_counter()
+    response = client.get("/api/home", headers=auth_token)
+    elapsed = time.perf_counter() - started
+
+    assert response.status_code == 200, response.text
+    assert response.json() == {
+        "user": {"username": "user1"},
+        "tasks": [{"id": 1}],
+        "projects": None,
+        "errors": {"projects": "timeout"},
+    }
+    assert elapsed < 0.9
+
+    # The verified identity is forwarded to every source
+    assert all("x-internal-identity" in request.headers for request in upstreams.requests)
+    assert client.get("/api/home").status_code == 401
+
+
+def test_home_with_personal_access_token(
+    client: TestClient, upstreams: MockUpstreams, auth_token: dict
+) -> None:
+    """Test that the home screen accepts a personal access token and forwards its identity.
+
+    Args:
+        client (TestClient): Test client.
+        upstreams (MockUpstreams): Mocked upstream services.
+        auth_token (dict): Auth token.
+    """
+    token = client.post(
+        f"{AUTH_URL}/tokens", json={"name": "ci", "scopes": ["tasks:read"]}, headers=auth_token
+    ).json()["token"]
+
+    response = client.get("/api/home", headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == 200, response.text
+    assert response.json()["errors"] == {}
+    # The services check the scopes of the token
+    identities = [
+        verify_internal_identity(request.headers["x-internal-identity"])
+        for request in upstreams.requests
+    ]
+    assert len(identities) == 3
+    assert all(identity.username == "user1" for identity in identities)
+    assert all(identity.scopes == ["tasks:read"] for identity in identities)
+
+    headers = {"Authorization": f"Bearer {PAT_PREFIX}unknown"}
+    assert client.get("/api/home", headers=headers).status_code == 401
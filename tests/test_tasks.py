@@ -1,5 +1,7 @@
 """Tests for tasks service."""
 
+from datetime import datetime
+
 from fastapi.testclient import TestClient
 
 from tests.test_utils import PROJECTS_URL, TASKS_URL, mock_test_data, perform_assertions
@@ -134,6 +136,37 @@ def test_update_task(client: TestClient, auth_token: dict) -> None:
     perform_assertions(response, "PUT", mock_task, owner_id=1, parent_id=None, project_id=None)
 
 
+def test_task_timestamps(client: TestClient, auth_token: dict) -> None:
+    """Test that the timestamps of a task are set by the database, with their time zone.
+
+    Args:
+        client (TestClient): Test client
+        auth_token (fixture): JWT token for authentication
+    """
+    mock_task = mock_test_data("task")
+
+    response = client.post(
+        TASKS_URL,
+        json=mock_task,
+        headers=auth_token,
+    )
+
+    created_at = datetime.fromisoformat(response.json()["created_at"])
+    assert created_at.tzinfo is not None
+
+    mock_task["title"] = "Updated title"
+    response = client.put(
+        f"{TASKS_URL}/1",
+        json=mock_task,
+        headers=auth_token,
+    )
+
+    updated_at = datetime.fromisoformat(response.json()["updated_at"])
+    assert updated_at.tzinfo is not None
+    assert datetime.fromisoformat(response.json()["created_at"]) == created_at
+    assert updated_at >= created_at
+
+
 def test_delete_task(client: TestClient, auth_token: dict) -> None:
     """Nominal test for deleting a task.
 
@@ -1,7 +1,10 @@
 """Tests for the users service."""
 
+import pytest
 from fastapi.testclient import TestClient
 
+from auth_service.password_hashing import password_hasher
+
 from tests.test_utils import USERS, USERS_URL, mock_test_data
 
 
@@ -122,6 +125,42 @@ def test_update_account_password(client: TestClient, auth_token: dict) -> None:
     assert response.status_code == 200
 
 
+def test_update_account_password_hashing_queue_full(
+    client: TestClient, auth_token: dict, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Test that a password change is rejected with a 429 when the password hashing queue is full.
+
+    Args:
+        client (TestClient): Test client
+        auth_token (fixture): JWT token for authentication
+        monkeypatch (pytest.MonkeyPatch): Pytest monkeypatch.
+    """
+    mock_user = USERS["current_user_create"]
+    monkeypatch.setattr(
+        password_hasher, "pending", password_hasher.workers + password_hasher.max_queue
+    )
+
+    response = client.patch(
+        f"{USERS_URL}/me/password",
+        headers=auth_token,
+        json={
+            "current_password": mock_user.hashed_password,
+            "new_password": "NewPassword1!",
+        },
+    )
+
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+
+    # The password was not changed
+    monkeypatch.undo()
+    response = client.post(
+        "/api/auth/token",
+        data={"username": mock_user.username, "password": mock_user.hashed_password},
+    )
+    assert response.status_code == 200
+
+
 def test_update_account_password_short_password(client: TestClient, auth_token: dict) -> None:
     """Test for updating the current user's password with a password that is too short.
 
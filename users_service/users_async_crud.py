@@ -0,0 +1,218 @@
+"""Async variants of the CRUD operations of the users_crud module, for the async routes.
+
+An AsyncSession can't lazy load a relationship, so the tasks and projects serialized by the User
+schema are eagerly loaded with the users. Password hashing is CPU bound, it is awaited from the
+password hashing pool, off the event loop and without holding a thread."""
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+import auth_service.auth_crud as auth
+import users_service.users_models as models
+import users_service.users_schemas as schemas
+from auth_service.principal_cache import principal_cache
+from projects_service.projects_async_crud import load_project_tasks
+from tasks_service.tasks_async_crud import load_subtasks
+
+
+def _select_users():
+    # The sessions don't expire the objects on commit, refresh the ones already loaded
+    return (
+        select(models.User)
+        .options(
+            selectinload(models.User.tasks).options(load_subtasks()),
+            selectinload(models.User.owned_projects).options(load_project_tasks()),
+            selectinload(models.User.collaborated_projects).options(load_project_tasks()),
+        )
+        .execution_options(populate_existing=True)
+    )
+
+
+async def create_user(db: AsyncSession, user: schemas.UserInDB) -> models.User:
+    """Create user.
+
+    Args:
+        db (AsyncSession): Async database session.
+        user (schemas.UserInDB): User data.
+
+    Returns:
+        models.User: SQL Alchemy User model.
+    """
+    password_db = await auth.get_password_hash_async(user.hashed_password)
+    db_user = models.User(
+        username=user.username.lower(),
+        email=user.email.lower(),
+        hashed_password=password_db,
+    )
+
+    db.add(db_user)
+    await db.commit()
+
+    return await get_user_by_id(db, user_id=db_user.id)  # type: ignore
+
+
+async def get_users(db: AsyncSession, skip: int = 0, limit: int = 100) -> list[models.User]:
+    """Get users.
+
+    Args:
+        db (AsyncSession): Async database session.
+        skip (int, optional): Number of users to skip. Defaults to 0.
+        limit (int, optional): Number of users to return. Defaults to 100.
+
+    Returns:
+        list[User]: List of SQL Alchemy User models.
+    """
+    result = await db.scalars(_select_users().offset(skip).limit(limit))
+
+    return list(result.all())
+
+
+async def get_user_by_id(db: AsyncSession, user_id: int) -> models.User | None:
+    """Get user by ID.
+
+    Args:
+        db (AsyncSession): Async database session.
+        user_id (int): User ID.
+
+    Returns:
+        models.User: SQL Alchemy User model.
+    """
+    return await db.scalar(_select_users().filter(models.User.id == user_id))
+
+
+async def get_user_by_email(db: AsyncSession, email: str) -> models.User | None:
+    """Get user by email.
+
+    Args:
+        db (AsyncSession): Async database session.
+        email (str): User email.
+
+    Returns:
+        models.User: SQL Alchemy User model.
+    """
+    return await db.scalar(_select_users().filter(models.User.email == email))
+
+
+async def get_user_by_username(db: AsyncSession, username: str) -> models.User | None:
+    """Get user by username.
+
+    Args:
+        db (AsyncSession): Async database session.
+        username (str): User username.
+
+    Returns:
+        models.User: SQL Alchemy User model.
+    """
+    return await db.scalar(_select_users().filter(models.User.username == username))
+
+
+async def delete_user_by_id(db: AsyncSession, user_id: int) -> None:
+    """Delete user by ID.
+
+    Args:
+        db (AsyncSession): Async database session.
+        user_id (int): User ID.
+    """
+    db_user = await get_user_by_id(db, user_id=user_id)
+    if db_user is None:
+        return None
+
+    # Before the refresh tokens are deleted with the user, their families tell which access
+    # tokens to revoke
+    await db.run_sync(auth.revoke_user_tokens, user_id)
+
+    await db.delete(db_user)
+    await db.commit()
+
+    principal_cache.invalidate(user_id)
+
+
+async def update_account_details(
+    db: AsyncSession, user_data_update: schemas.UserBase, current_user_id: int
+) -> models.User | None:
+    """Update current user details.
+
+    Args:
+        db (AsyncSession): Async database session.
+        user_data_update (schemas.UserBase): User data.
+        current_user_id (int): Current user ID.
+
+    Returns:
+        models.User: SQL Alchemy User model.
+    """
+    db_user = await get_user_by_id(db, user_id=current_user_id)
+
+    # Validation is performed in route operation
+    db_user.username = user_data_update.username.lower()  # type: ignore
+    db_user.email = user_data_update.email.lower()  # type: ignore
+
+    await db.commit()
+
+    principal_cache.invalidate(current_user_id)
+
+    return await get_user_by_id(db, user_id=current_user_id)
+
+
+async def update_account_password(
+    db: AsyncSession, password_schema: schemas.UserUpdatePassword, current_user_id: int
+) -> models.User | None:
+    """Update current user password.
+
+    Args:
+        db (AsyncSession): Async database session.
+        password_schema (schemas.UserUpdatePassword): User data.
+        current_user_id (int): Current user ID.
+
+    Returns:
+        models.User: SQL Alchemy User model, or None if the current password doesn't match.
+    """
+    db_user = await get_user_by_id(db, user_id=current_user_id)
+
+    # The hashed password in the db and the input one must match
+    if not await auth.verify_password_async(
+        password_schema.current_password, db_user.hashed_password
+    ):
+        return None
+
+    if password_schema.new_password:
+        db_user.hashed_password = await auth.get_password_hash_async(  # type: ignore
+            password_schema.new_password
+        )
+
+    await db.commit()
+
+    principal_cache.invalidate(current_user_id)
+    if password_schema.new_password:
+        # Log out the other sessions, which may have been opened with the old password
+        await db.run_sync(auth.revoke_user_tokens, current_user_id)
+
+    return await get_user_by_id(db, user_id=current_user_id)
+
+
+async def set_user_disabled(db: AsyncSession, user_id: int, disabled: bool) -> models.User | None:
+    """Disable or enable a user.
+
+    Args:
+        db (AsyncSession): Async database session.
+        user_id (int): User ID.
+        disabled (bool): Whether the user is disabled.
+
+    Returns:
+        models.User: SQL Alchemy User model, or None if the user does not exist.
+    """
+    db_user = await get_user_by_id(db, user_id=user_id)
+    if db_user is None:
+        return None
+
+    db_user.disabled = disabled  # type: ignore
+
+    await db.commit()
+
+    principal_cache.invalidate(user_id)
+    if disabled:
+        # The access tokens carry the status of the user, the ones issued until now must not be
+        # accepted anymore
+        await db.run_sync(auth.revoke_user_tokens, user_id)
+
+    return await get_user_by_id(db, user_id=user_id)
@@ -8,20 +8,25 @@ from sqlalchemy.orm import Session
 import auth_service.auth_crud as auth
 import users_service.users_models as models
 import users_service.users_schemas as schemas
+from auth_service.principal_cache import principal_cache
 
 
-def create_user(db: Session, user: schemas.UserInDB) -> models.User:
+def create_user(
+    db: Session, user: schemas.UserInDB, password_hash: str | None = None
+) -> models.User:
     """Create user.
 
     Args:
         db (Session): Database session.
         user (schemas.UserInDB): User data.
+        password_hash (str | None, optional): Hash of the password, when the route already
+            awaited it. Defaults to None, hashing the password here.
 
     Returns:
         models.User: SQL Alchemy User model.
     """
 
-    password_db = auth.get_password_hash(user.hashed_password)
+    password_db = password_hash or auth.get_password_hash(user.hashed_password)
     db_user = models.User(
         username=user.username.lower(),
         email=user.email.lower(),
@@ -99,9 +104,15 @@ def delete_user_by_id(db: Session, user_id: int) -> None:
     if db_user is None:
         return None
 
+    # Before the refresh tokens are deleted with the user, their families tell which access
+    # tokens to revoke
+    auth.revoke_user_tokens(db, user_id)
+
     db.delete(db_user)
     db.commit()
 
+    principal_cache.invalidate(user_id)
+
 
 def update_account_details(
     db: Session, user_data_update: schemas.UserBase, current_user_id: int
@@ -128,6 +139,8 @@ def update_account_details(
     db.commit()
     db.refresh(db_user)
 
+    principal_cache.invalidate(current_user_id)
+
     return db_user
 
 
@@ -153,10 +166,64 @@ def update_account_password(
     if not auth.verify_password(password_schema.current_password, db_user.hashed_password):
         return None
 
+    password_hash = None
     if password_schema.new_password:
-        db_user.hashed_password = auth.get_password_hash(password_schema.new_password)  # type: ignore
+        password_hash = auth.get_password_hash(password_schema.new_password)
+
+    return set_account_password_hash(db, db_user, password_hash)
+
+
+def set_account_password_hash(
+    db: Session, db_user: models.User, password_hash: str | None
+) -> models.User:
+    """Store the new password of a user, whose current password was verified.
+
+    Args:
+        db (Session): Database session.
+        db_user (models.User): SQL Alchemy User model.
+        password_hash (str | None): Hash of the new password, or None to keep the current one.
+
+    Returns:
+        models.User: SQL Alchemy User model.
+    """
+    if password_hash:
+        db_user.hashed_password = password_hash  # type: ignore
 
     db.commit()
     db.refresh(db_user)
 
+    principal_cache.invalidate(db_user.id)
+    if password_hash:
+        # Log out the other sessions, which may have been opened with the old password
+        auth.revoke_user_tokens(db, db_user.id)
+
+    return db_user
+
+
+def set_user_disabled(db: Session, user_id: int, disabled: bool) -> models.User | None:
+    """Disable or enable a user.
+
+    Args:
+        db (Session): Database session.
+        user_id (int): User ID.
+        disabled (bool): Whether the user is disabled.
+
+    Returns:
+        models.User: SQL Alchemy User model, or None if the user does not exist.
+    """
+    db_user = get_user_by_id(db, user_id=user_id)
+    if db_user is None:
+        return None
+
+    db_user.disabled = disabled  # type: ignore
+
+    db.commit()
+    db.refresh(db_user)
+
+    principal_cache.invalidate(user_id)
+    if disabled:
+        # The access tokens carry the status of the user, the ones issued until now must not be
+        # accepted anymore
+        auth.revoke_user_tokens(db, user_id)
+
     return db_user
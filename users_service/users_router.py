@@ -5,26 +5,38 @@ performing any operation in the database. It does so by using the validators in
 as well as Pydantic models.
 
 The routes are protected by OAuth2 JWT tokens. The token is passed in the Authorization header
-of the request. The token is validated by the get_current_active_user function in the auth module.
+of the request. The token is validated by the get_current_active_user function in the auth module,
+or, behind the gateway, the identity it forwards by the get_current_active_principal function.
 
 Docs: https://fastapi.tiangolo.com/tutorial/security/oauth2-jwt/
 """
 
 from fastapi import APIRouter, Depends
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from starlette.status import HTTP_201_CREATED, HTTP_204_NO_CONTENT
 
 import common_components.database.db as db
 import users_service.users_crud as user_crud
 import users_service.users_schemas as user_schema
-from auth_service.auth_crud import get_current_active_user
+from auth_service.auth_crud import (
+    get_current_active_principal,
+    get_current_active_user,
+    get_password_hash_async,
+    verify_password_async,
+)
+from auth_service.auth_schemas import Principal
 from common_components.input_validators import validate_user
 
 router = APIRouter(tags=["Users"], prefix="/users")
 
 
+# Async, so a registration waiting for the password hashing pool doesn't hold a thread of the
+# threadpool. The queries and the serialization, which loads the relationships, run in it.
 @router.post("/", status_code=HTTP_201_CREATED, response_model=user_schema.User)
-def create_user(user: user_schema.UserInDB, db: Session = Depends(db.get_db)) -> user_schema.User:
+async def create_user(
+    user: user_schema.UserInDB, db: Session = Depends(db.get_db)
+) -> user_schema.User:
     """Create user.
 
     Args:
@@ -35,21 +47,30 @@ def create_user(user: user_schema.UserInDB, db: Session = Depends(db.get_db)) ->
         user_schema.User: User data.
 
     Raises:
-        HTTPException: If the username or email is already registered.
+        HTTPException: If the username or email is already registered, or the password hashing
+            queue is full.
     """
-    validate_user(
+    await run_in_threadpool(
+        validate_user,
         db=db,
         username=user.username.lower(),
         email=user.email.lower(),
         password=user.hashed_password,
     )
 
-    return user_crud.create_user(db=db, user=user)
+    password_hash = await get_password_hash_async(user.hashed_password)
+    db_user = await run_in_threadpool(
+        user_crud.create_user, db=db, user=user, password_hash=password_hash
+    )
+
+    return await run_in_threadpool(user_schema.User.model_validate, db_user, from_attributes=True)
 
 
 #### USERS ####
+# Not async: the lazy relationships of the user are loaded while serializing the response, which
+# FastAPI only runs in the threadpool for sync routes. An async route would block the event loop.
 @router.get("/me", response_model=user_schema.User)
-async def read_my_user(
+def read_my_user(
     current_user: user_schema.User = Depends(get_current_active_user),
 ) -> user_schema.User:
     """Get current user.
@@ -66,13 +87,13 @@ async def read_my_user(
 @router.delete("/me", status_code=HTTP_204_NO_CONTENT)
 def delete_my_account(
     db: Session = Depends(db.get_db),
-    current_user: user_schema.User = Depends(get_current_active_user),
+    current_user: Principal = Depends(get_current_active_principal),
 ) -> None:
     """Delete current user.
 
     Args:
         db (Session, optional): Database session. Defaults to Depends(db.get_db).
-        current_user (user_schema.User, optional): Current user. Defaults to Depends(get_current_active_user).
+        current_user (Principal, optional): Current user. Defaults to Depends(get_current_active_principal).
 
     Raises:
         HTTPException: If the user does not exist.
@@ -87,14 +108,14 @@ def delete_my_account(
 def update_account_details(
     user: user_schema.UserBase,
     db: Session = Depends(db.get_db),
-    current_user: user_schema.User = Depends(get_current_active_user),
+    current_user: Principal = Depends(get_current_active_principal),
 ) -> user_schema.UserBase:
     """Update current user details.
 
     Args:
         user (user_schema.UserBase): User data.
         db (Session, optional): Database session. Defaults to Depends(db.get_db).
-        current_user (user_schema.User, optional): Current user. Defaults to Depends(get_current_active_user).
+        current_user (Principal, optional): Current user. Defaults to Depends(get_current_active_principal).
 
     Returns:
         user_schema.UserBase: User data.
@@ -114,18 +135,20 @@ def update_account_details(
     )
 
 
+# Async, like create_user: the verification and the hash of the new password are awaited from the
+# password hashing pool, the queries run in the threadpool.
 @router.patch("/me/password")
-def update_account_password(
+async def update_account_password(
     password_schema: user_schema.UserUpdatePassword,
     db: Session = Depends(db.get_db),
-    current_user: user_schema.User = Depends(get_current_active_user),
+    current_user: Principal = Depends(get_current_active_principal),
 ) -> dict:
     """Update current user password.
 
     Args:
         password_schema (user_schema.UserUpdatePassword): User data.
         db (Session, optional): Database session. Defaults to Depends(db.get_db).
-        current_user (user_schema.User, optional): Current user. Defaults to Depends(get_current_active_user).
+        current_user (Principal, optional): Current user. Defaults to Depends(get_current_active_principal).
 
     Returns:
         dict: Message.
@@ -133,12 +156,19 @@ def update_account_password(
     Raises:
         HTTPException: If the user does not exist.
         HTTPException: If the password is incorrect.
+        HTTPException: If the password hashing queue is full.
     """
-    validate_user(db=db, password=password_schema.new_password)
+    await run_in_threadpool(validate_user, db=db, password=password_schema.new_password)
 
-    user_crud.update_account_password(
-        db, password_schema=password_schema, current_user_id=current_user.id
-    )
+    db_user = await run_in_threadpool(user_crud.get_user_by_id, db, user_id=current_user.id)
+
+    # The hashed password in the db and the input one must match
+    if await verify_password_async(password_schema.current_password, db_user.hashed_password):
+        password_hash = None
+        if password_schema.new_password:
+            password_hash = await get_password_hash_async(password_schema.new_password)
+
+        await run_in_threadpool(user_crud.set_account_password_hash, db, db_user, password_hash)
 
     return {"detail": "Password updated successfully"}
 